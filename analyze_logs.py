@@ -0,0 +1,138 @@
+import argparse
+import glob
+import heapq
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+
+# Reads the access log written by after_request (one JSON object per line)
+# and reports latency percentiles per route and the slowest requests. Files
+# are streamed line by line: percentiles come from log-scale histograms and
+# only the top slow requests are kept, so memory does not grow with the size
+# of the logs.
+
+# Each histogram bucket is 2% wider than the one before; reporting its
+# geometric midpoint keeps a percentile within 1% of the true value
+BUCKET_GROWTH = 1.02
+
+def bucket(duration_ms):
+    return math.floor(math.log(max(duration_ms, 0.001)) / math.log(BUCKET_GROWTH))
+
+def bucket_value(index):
+    # Geometric midpoint of the bucket
+    return BUCKET_GROWTH ** (index + 0.5)
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.max_ms = 0.0
+        self.cache_hits = 0
+        self.cache_lookups = 0
+        self.histogram = Counter()
+
+    def add(self, record):
+        duration = record['duration_ms']
+        self.count += 1
+        self.errors += record['status'] >= 500
+        self.total_ms += duration
+        self.db_ms += record.get('db_ms', 0.0)
+        self.max_ms = max(self.max_ms, duration)
+        self.cache_hits += record.get('cache_hits', 0)
+        self.cache_lookups += record.get('cache_hits', 0) + record.get('cache_misses', 0)
+        self.histogram[bucket(duration)] += 1
+
+    def percentiles(self, quantiles):
+        # Walks the buckets once for all quantiles, which must be ascending
+        ranks = [max(1, math.ceil(q * self.count)) for q in quantiles]
+        values = []
+        seen = 0
+        for index in sorted(self.histogram):
+            seen += self.histogram[index]
+            while ranks and seen >= ranks[0]:
+                values.append(min(bucket_value(index), self.max_ms))
+                ranks.pop(0)
+        return values
+
+def log_files(paths):
+    # Expands each log to its rotated backups, oldest first: app.log.3,
+    # app.log.2, app.log.1, app.log
+    for path in paths:
+        backups = [(int(match.group(1)), backup) for backup in glob.glob(f"{glob.escape(path)}.*")
+                   if (match := re.fullmatch(re.escape(path) + r'\.(\d+)', backup))]
+        for _, backup in sorted(backups, reverse=True):
+            yield backup
+        if os.path.exists(path):
+            yield path
+
+def read_records(paths):
+    for path in log_files(paths):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.startswith('{'):
+                    continue
+                try:
+                    record = json.loads(line)
+                    record['duration_ms'] = float(record['duration_ms'])
+                    record['status'] = int(record['status'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                yield record
+
+def analyze(records, top, route_filter=None):
+    stats = {}
+    slowest = []  # min-heap of (duration, sequence, record)
+    for sequence, record in enumerate(records):
+        route = f"{record.get('method', '-')} {record.get('route') or record.get('path', '-')}"
+        if route_filter and route_filter not in route:
+            continue
+        stats.setdefault(route, RouteStats()).add(record)
+        entry = (record['duration_ms'], sequence, record)
+        if len(slowest) < top:
+            heapq.heappush(slowest, entry)
+        elif entry[0] > slowest[0][0]:
+            heapq.heapreplace(slowest, entry)
+    return stats, [record for _, _, record in sorted(slowest, reverse=True)]
+
+def print_report(stats, slowest, min_count):
+    print(f"{'route':<55} {'count':>7} {'5xx':>5} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'db avg':>8} {'cache':>6}")
+    for route, route_stats in sorted(stats.items(), key=lambda item: -item[1].total_ms):
+        if route_stats.count < min_count:
+            continue
+        p50, p90, p99 = route_stats.percentiles([0.5, 0.9, 0.99])
+        hit_rate = (f"{route_stats.cache_hits / route_stats.cache_lookups:.0%}"
+                    if route_stats.cache_lookups else '-')
+        print(f"{route[:55]:<55} {route_stats.count:>7} {route_stats.errors:>5} "
+              f"{p50:>8.1f} {p90:>8.1f} {p99:>8.1f} {route_stats.max_ms:>8.1f} "
+              f"{route_stats.db_ms / route_stats.count:>8.1f} {hit_rate:>6}")
+
+    if slowest:
+        print(f"\nSlowest {len(slowest)} requests (ms):")
+        for record in slowest:
+            print(f"{record['duration_ms']:>9.1f}  db {record.get('db_ms', 0.0):>8.1f}  {record['status']}  "
+                  f"{record.get('method', '-')} {record.get('path', '-')}  "
+                  f"user={record.get('user_id')} request_id={record.get('request_id')} at {record.get('time')}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Latency report from access logs, including rotated backups')
+    parser.add_argument('paths', nargs='*', default=['logs/access.log'],
+                        help='log files; PATH.1, PATH.2, ... backups are read as well')
+    parser.add_argument('--top', type=int, default=20, help='number of slowest requests to list')
+    parser.add_argument('--route', help='only routes containing this text, e.g. /search')
+    parser.add_argument('--min-count', type=int, default=1, help='hide routes with fewer requests')
+    args = parser.parse_args()
+
+    if not any(True for _ in log_files(args.paths)):
+        print(f"No log files found for: {', '.join(args.paths)}")
+        sys.exit(1)
+
+    stats, slowest = analyze(read_records(args.paths), args.top, args.route)
+    if not stats:
+        print("No access log records found")
+        sys.exit(1)
+    print_report(stats, slowest, args.min_count)
@@ -1,34 +1,72 @@
 import os
+import re
+import io
+import csv
+import sqlite3
+import socket
+import ipaddress
+import json
+import gzip
+import math
+import random
 import logging
+import threading
+import http.client
+import urllib.request
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from collections import namedtuple
 from datetime import datetime, timedelta, UTC
 from contextlib import contextmanager
+from functools import wraps
+from hashlib import sha1
 from uuid import uuid4
+from urllib.parse import urlsplit
 import redis
 from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify, g, Blueprint
-from werkzeug.exceptions import HTTPException
+from flask import Flask, request, jsonify, g, Blueprint, make_response, has_request_context, Response, stream_with_context, redirect, send_file
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException, TooManyRequests
 from flask_cors import CORS
 from flask_jwt_extended import (
     JWTManager, create_access_token, create_refresh_token,
     get_jwt_identity, jwt_required, get_jwt,
-    verify_jwt_in_request
+    verify_jwt_in_request, decode_token
 )
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flask_caching import Cache
-from sqlalchemy import create_engine, Column, Integer, String, Double, ForeignKey, DateTime, Boolean, Index, event
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base, validates
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import create_engine, Column, Integer, String, Double, ForeignKey, DateTime, Boolean, Index, Text, MetaData, Table, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, validates, contains_eager
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
-from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+from marshmallow import Schema, fields, validate, ValidationError
 from password_validator import PasswordValidator
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import text, select, insert, update, delete, inspect, literal, func, and_, or_
+import numpy as np
 import secrets
 from prometheus_client import Counter, Histogram
 import time
 from google.oauth2 import id_token
 from google.auth.transport import requests
+from jobs import JobQueue, JobQueueError, RedisJobBackend, SQLiteJobBackend
+from profiling import SamplingProfiler
+from image_cache import ImageCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 class ApiException(Exception):
     def __init__(self, message, code=400, error_id=None):
@@ -61,6 +99,15 @@ REQUEST_LATENCY = Histogram(
     'request_latency_seconds', 'Request latency',
     ['method', 'endpoint']
 )
+RATE_LIMIT_LATENCY = Histogram(
+    'rate_limit_check_seconds', 'Rate limit check latency',
+    ['endpoint'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1)
+)
+RATE_LIMIT_REJECTED = Counter(
+    'rate_limit_rejected', 'Requests rejected by the rate limiter',
+    ['endpoint']
+)
 
 # Redis setup for rate limiting and caching
 redis_client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
@@ -80,16 +127,94 @@ class Config:
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     JWT_ERROR_MESSAGE_KEY = 'message'
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///sneaker_collector.db')
+    # Per-user tables are split across these databases by user when set;
+    # users and the catalog stay in DATABASE_URL (products are replicated)
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    SHARD_DATABASE_URLS = [url for url in os.getenv('SHARD_DATABASE_URLS', '').split(',') if url]
+    SHARD_MOVE_GRACE = 2  # seconds for in-flight requests to finish before a user's rows move
+    SHARD_MOVE_TIMEOUT = 300  # a move claimed longer ago than this was interrupted and can be taken over
     CACHE_TYPE = "redis"
     CACHE_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     CACHE_DEFAULT_TIMEOUT = 300
     LOG_DIR = "logs"
+    ACCESS_LOG_MAX_BYTES = 10 * 1024 * 1024  # one JSON line per request, read by analyze_logs.py
+    ACCESS_LOG_BACKUP_COUNT = 20
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     PERMANENT_SESSION_LIFETIME = timedelta(days=30)
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
+    # Serve collection/favorites listings from the denormalized listing_items table
+    LISTING_READ_MODEL = os.getenv('LISTING_READ_MODEL', 'true').lower() == 'true'
+    PRODUCT_CACHE_MAX_AGE = 60
+    SEARCH_CACHE_TIMEOUT = 300
+    PRODUCT_DOC_TIMEOUT = 300
+    MAX_BATCH_PRODUCTS = 100
+    JOB_BACKEND = os.getenv('JOB_BACKEND', 'redis')  # 'redis' or 'sqlite'
+    JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs.db')
+    PRICE_HISTORY_DEFAULT_RANGE = {'day': timedelta(days=90), 'week': timedelta(weeks=52), 'month': timedelta(days=730)}
+    MAX_PRICE_HISTORY_POINTS = 1000
+    READ_RATE_LIMIT = "120 per minute"
+    LOGIN_MAX_ATTEMPTS = 5  # per username, then the account is locked
+    LOGIN_MAX_ATTEMPTS_PER_IP = 20
+    LOGIN_ATTEMPT_WINDOW = timedelta(minutes=15)
+    LAST_LOGIN_FLUSH_INTERVAL = 60
+    SUGGEST_REFRESH_INTERVAL = 5  # seconds between catalog change polls
+    SYNC_TOMBSTONE_RETENTION = timedelta(days=30)
+    SYNC_OVERLAP = timedelta(seconds=5)  # covers transactions committing out of order
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')  # 'orjson' or 'json'
+    # About 0.05% false positives at 1M users (two entries each), 4 MB in Redis
+    AVAILABILITY_FILTER_BITS = 2 ** 25
+    AVAILABILITY_FILTER_HASHES = 7
+    TRENDING_HALF_LIFE = timedelta(days=1)
+    TRENDING_WINDOW = timedelta(days=14)  # older entries are dropped on reconciliation
+    TRENDING_RECONCILE_INTERVAL = 3600
+    TRENDING_MAX_HALVINGS = 30  # scores are rescaled once new weights would exceed 2^30
+    TRENDING_MIN_WEIGHT = 1e-6  # share of an event's weight at the window start below which entries are dropped
+    MAX_TRENDING_PRODUCTS = 50
+    SIMILAR_TOP_K = 20  # neighbours kept per product
+    SIMILAR_MIN_COOCCURRENCE = 2
+    SIMILAR_MAX_ITEMS_PER_USER = 500
+    SIMILAR_PAIR_BATCH = 5_000_000
+    SIMILAR_BUILD_INTERVAL = 6 * 3600
+    EXPORT_BATCH_SIZE = 1000  # rows fetched per round trip while streaming exports
+    EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+    HEALTH_CHECK_INTERVAL = 5  # seconds between background health probes
+    HEALTH_POOL_SATURATION = 0.9  # share of pool connections in use that marks it saturated
+    # Requests are profiled when sent with X-Profile-Token, or at random at
+    # PROFILE_SAMPLE_RATE; profiles are kept in Redis for PROFILE_TTL
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_INTERVAL = 0.005
+    PROFILE_TTL = timedelta(days=1)
+    PROFILE_MAX_STATEMENTS = 500
+    COMPRESS_MIN_SIZE = 1024  # smaller bodies are sent as is
+    COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/csv', 'text/html')
+    COMPRESS_LEVELS = {'br': 5, 'gzip': 6}  # per response; cached responses are compressed once at 'max'
+    COMPRESS_CACHED_LEVELS = {'br': 9, 'gzip': 9}
+    CACHE_TTL_JITTER = 0.1  # cache timeouts vary by +/-10% so entries written together expire apart
+    CACHE_EARLY_EXPIRY_BETA = 1.0  # higher refreshes earlier
+    WARM_PRODUCTS = 500  # most requested product documents preloaded on startup
+    WARM_SEARCHES = 50  # most frequent searches whose first page is preloaded
+    WARM_TRACK_SAMPLE_RATE = 0.1  # share of requests counted towards popularity
+    WARM_LOCK_TIMEOUT = 60  # workers starting within this window warm only once
+    THUMBNAIL_SIZES = {'small': 160, 'medium': 400, 'large': 800}  # longest edge in pixels
+    THUMBNAIL_QUALITY = 80
+    THUMBNAIL_MAX_AGE = 365 * 86400  # thumbnail URLs carry the image version, so they never change
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'image_cache')
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 1024 ** 3))
+    IMAGE_ORIGIN_SCHEMES = ('http', 'https')
+    # Hosts fetched even though they resolve to private addresses, e.g. a
+    # local stand-in origin; all others must resolve to public addresses
+    IMAGE_TRUSTED_HOSTS = tuple(host for host in os.getenv('IMAGE_TRUSTED_HOSTS', '').split(',') if host)
+    IMAGE_MAX_REDIRECTS = 3
+    IMAGE_FETCH_TIMEOUT = 5
+    IMAGE_MAX_ORIGINAL_BYTES = 10 * 1024 * 1024
+    IMAGE_MAX_PIXELS = 40_000_000  # larger originals are rejected before decoding
+    IMAGE_FAILURE_TTL = 300  # seconds before a failed origin is tried again
+    IMAGE_RATE_LIMIT = "600 per minute"  # a list screen loads one thumbnail per card
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -103,6 +228,8 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     DATABASE_URL = 'sqlite:///:memory:'
+    JOB_BACKEND = 'sqlite'
+    JOB_DB_PATH = ':memory:'
 
 config = {
     'development': DevelopmentConfig,
@@ -115,6 +242,47 @@ config = {
 env = os.getenv('FLASK_ENV', 'default')
 app.config.from_object(config[env])
 
+# JSON provider with a pluggable backend. Datetimes are serialized as ISO 8601
+# by both backends, so serializers can hand them over unformatted.
+def json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+
+    def use_orjson(self):
+        return orjson is not None and self._app.config['JSON_BACKEND'] == 'orjson'
+
+    def orjson_options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs or not self.use_orjson():
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=json_default, option=self.orjson_options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs or not self.use_orjson():
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if not self.use_orjson():
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=json_default, option=self.orjson_options(indent))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
 # Enable CORS with stricter settings
 CORS(app, resources={
     r"/api/*": {
@@ -129,12 +297,93 @@ CORS(app, resources={
 # Setup extensions
 jwt = JWTManager(app)
 cache = Cache(app)
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    storage_uri="redis://localhost:6379",
-    strategy="fixed-window-elastic-expiry"
-)
+# Rate limiting with GCRA: one Lua call per check stores the theoretical
+# arrival time of the next request and rejects requests that arrive earlier
+# than the burst allowance permits
+RATE_LIMIT_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+def parse_rate_limit(value):
+    match = re.fullmatch(r'\s*(\d+)\s*(?:per|/)\s*(\d*)\s*(second|minute|hour|day)s?\s*', value)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {value}")
+    count, multiplier, period = match.groups()
+    return int(count), int(multiplier or 1) * RATE_LIMIT_PERIODS[period]
+
+def get_remote_address():
+    return request.remote_addr or '127.0.0.1'
+
+def rate_limit_key():
+    # Authenticated requests are limited per user, so users behind a carrier
+    # NAT do not share one budget; everything else is limited per IP
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            return f"user:{decode_token(auth_header[7:])[app.config['JWT_IDENTITY_CLAIM']]}"
+        except Exception:
+            pass
+    return f"ip:{get_remote_address()}"
+
+class RateLimiter:
+    GCRA_SCRIPT = """
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+    local interval = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local tat = tonumber(redis.call('get', KEYS[1]) or now)
+    local new_tat = math.max(tat, now) + interval
+    if new_tat - now > burst then
+        return new_tat - now - burst
+    end
+    redis.call('set', KEYS[1], new_tat, 'PX', new_tat - now)
+    return 0
+    """
+
+    def __init__(self, client, key_func, enabled=True):
+        self.client = client
+        self.key_func = key_func
+        self.enabled = enabled
+        self.script = client.register_script(self.GCRA_SCRIPT)
+
+    def hit(self, endpoint, count, period):
+        # Returns 0 if the request is allowed, else milliseconds to wait.
+        # Whole milliseconds, as the script passes them to SET ... PX, which
+        # rejects fractions; rounding up errs on the strict side.
+        interval = math.ceil(period * 1000 / count)
+        key = f"ratelimit:{endpoint}:{self.key_func()}"
+        return self.script(keys=[key], args=[interval, interval * count])
+
+    def limit(self, value):
+        count, period = parse_rate_limit(value)
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                
+                endpoint = request.endpoint or f.__name__
+                start = time.perf_counter()
+                try:
+                    retry_after = self.hit(endpoint, count, period)
+                except redis.RedisError as e:
+                    app.logger.warning(f"Rate limiting unavailable: {str(e)}")
+                    retry_after = 0
+                finally:
+                    RATE_LIMIT_LATENCY.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+                
+                if retry_after:
+                    RATE_LIMIT_REJECTED.labels(endpoint=endpoint).inc()
+                    raise TooManyRequests(value, retry_after=max(1, int(retry_after) // 1000))
+                return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+limiter = RateLimiter(redis_client, key_func=rate_limit_key)
+
+# Background jobs, run by worker.py
+if app.config['JOB_BACKEND'] == 'sqlite':
+    job_queue = JobQueue(SQLiteJobBackend(app.config['JOB_DB_PATH']), logger=app.logger)
+else:
+    job_queue = JobQueue(RedisJobBackend(redis_client), logger=app.logger)
 
 # Enhanced JWT callbacks
 @jwt.token_in_blocklist_loader
@@ -171,8 +420,15 @@ def unauthorized_callback(error_string):
 api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
 # Enhanced logging setup
+access_logger = logging.getLogger('sneaker_collector.access')
+
 class RequestIdFilter(logging.Filter):
     def filter(self, record):
+        # Background threads and job workers log outside of any request
+        if not has_request_context():
+            record.request_id = 'no_request_id'
+            record.remote_addr = '-'
+            return True
         record.request_id = getattr(g, 'request_id', 'no_request_id')
         record.remote_addr = request.remote_addr
         return True
@@ -220,6 +476,18 @@ def setup_logging(app):
     app.logger.addHandler(error_handler)
     app.logger.addHandler(security_handler)
     app.logger.setLevel(logging.INFO)
+    
+    # Access log, written by after_request
+    if not access_logger.handlers:
+        access_handler = RotatingFileHandler(
+            f'{Config.LOG_DIR}/access.log',
+            maxBytes=Config.ACCESS_LOG_MAX_BYTES,
+            backupCount=Config.ACCESS_LOG_BACKUP_COUNT
+        )
+        access_handler.setFormatter(logging.Formatter('%(message)s'))
+        access_logger.addHandler(access_handler)
+        access_logger.setLevel(logging.INFO)
+        access_logger.propagate = False
 
 # Enhanced password validation
 password_schema = PasswordValidator()
@@ -251,14 +519,7 @@ class RegisterSchema(Schema):
     )
     email = fields.Email(required=True)
     password = fields.Str(required=True, validate=lambda p: password_schema.validate(p))
-    
-    @validates_schema
-    def validate_unique_fields(self, data, **kwargs):
-        with get_db_session() as session:
-            if session.query(User).filter_by(username=data['username']).first():
-                raise ValidationError('Username already exists', 'username')
-            if session.query(User).filter_by(email=data['email']).first():
-                raise ValidationError('Email already exists', 'email')
+    # Uniqueness is enforced by idx_user_username/idx_user_email on insert
 
 class ProfileUpdateSchema(Schema):
     username = fields.Str(validate=[
@@ -279,11 +540,11 @@ class CollectionSchema(Schema):
     purchase_price = fields.Float(validate=validate.Range(min=0))
 
 # Database setup with connection pooling and retry mechanism
-def create_engine_with_retry():
+def create_engine_with_retry(url=None):
     return create_engine(
-        Config.DATABASE_URL,
-        pool_size=5,
-        max_overflow=10,
+        url or Config.DATABASE_URL,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
         pool_timeout=30,
         pool_recycle=1800,
         pool_pre_ping=True
@@ -292,11 +553,22 @@ def create_engine_with_retry():
 Base = declarative_base()
 engine = create_engine_with_retry()
 Session = sessionmaker(bind=engine)
+shard_engines = [create_engine_with_retry(url) for url in Config.SHARD_DATABASE_URLS]
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and with them ON DELETE CASCADE, unless
+    # enabled per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
-# Enhanced session manager with retry mechanism
+# Enhanced session manager with retry mechanism. With user_id the session
+# reads and writes that user's per-user tables on their shard.
 @contextmanager
-def get_db_session(retry_count=3):
-    session = Session()
+def get_db_session(retry_count=3, user_id=None):
+    session = Session(**shard_session_options(user_id))
     try:
         yield session
         session.commit()
@@ -304,7 +576,7 @@ def get_db_session(retry_count=3):
         session.rollback()
         if retry_count > 0:
             app.logger.warning(f"Database error, retrying... ({retry_count} attempts left)")
-            with get_db_session(retry_count - 1) as new_session:
+            with get_db_session(retry_count - 1, user_id) as new_session:
                 yield new_session
         else:
             app.logger.error(f"Database error after all retries: {str(e)}")
@@ -329,8 +601,10 @@ class User(Base):
     is_active = Column(Boolean, default=True, nullable=False)
     failed_login_attempts = Column(Integer, default=0, nullable=False)
     
-    collections = relationship('Collection', back_populates='user', cascade='all, delete-orphan')
-    favorites = relationship('Favorite', back_populates='user', cascade='all, delete-orphan')
+    # Child rows are removed by the ON DELETE CASCADE foreign keys instead of
+    # being loaded and deleted one by one
+    collections = relationship('Collection', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    favorites = relationship('Favorite', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
 
     @validates('username')
     def validate_username(self, key, username):
@@ -367,6 +641,7 @@ class Product(Base):
     __tablename__ = 'products'
     __table_args__ = (
         Index('idx_product_search', 'model', 'brand', 'name'),
+        Index('idx_product_brand_model', 'brand', 'model'),  # search ordering
     )
     
     id = Column(Integer, primary_key=True)
@@ -380,8 +655,8 @@ class Product(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(UTC))
     updated_at = Column(DateTime, onupdate=lambda: datetime.now(UTC))
     
-    collections = relationship('Collection', back_populates='product', cascade='all, delete-orphan')
-    favorites = relationship('Favorite', back_populates='product', cascade='all, delete-orphan')
+    collections = relationship('Collection', back_populates='product', cascade='all, delete-orphan', passive_deletes=True)
+    favorites = relationship('Favorite', back_populates='product', cascade='all, delete-orphan', passive_deletes=True)
 
     @validates('price')
     def validate_price(self, key, price):
@@ -397,6 +672,7 @@ class Product(Base):
             'name': self.name,
             'price': self.price,
             'image_url': self.image_url,
+            'thumbnails': thumbnail_urls(self.id, self.image_url),
             'stock_x_url': self.stock_x_url,
             'goat_url': self.goat_url,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -404,7 +680,7 @@ class Product(Base):
         }
         
         if user_id:
-            with get_db_session() as session:
+            with get_db_session(user_id=user_id) as session:
                 try:
                     data['in_collection'] = session.query(Collection).filter_by(
                         user_id=user_id, 
@@ -425,7 +701,7 @@ class Product(Base):
 class Collection(Base):
     __tablename__ = 'collections'
     __table_args__ = (
-        Index('idx_collection_user', 'user_id'),
+        Index('idx_collection_user_updated', 'user_id', 'updated_at'),  # collection listing
         Index('idx_collection_user_product', 'user_id', 'product_id', unique=True),
     )
     
@@ -472,6 +748,7 @@ class Collection(Base):
             'size': self.size,
             'purchase_price': self.purchase_price,
             'image_url': self.product.image_url,
+            'thumbnails': thumbnail_urls(self.product_id, self.product.image_url),
             'price': self.product.price,
             'stock_x_url': self.product.stock_x_url,
             'goat_url': self.product.goat_url,
@@ -482,7 +759,7 @@ class Collection(Base):
 class Favorite(Base):
     __tablename__ = 'favorites'
     __table_args__ = (
-        Index('idx_favorite_user', 'user_id'),
+        Index('idx_favorite_user_created', 'user_id', 'created_at'),  # favorites listing
         Index('idx_favorite_user_product', 'user_id', 'product_id', unique=True),
     )
     
@@ -502,21 +779,1894 @@ class Favorite(Base):
             'brand': self.product.brand,
             'name': self.product.name,
             'image_url': self.product.image_url,
+            'thumbnails': thumbnail_urls(self.product_id, self.product.image_url),
             'price': self.product.price,
             'stock_x_url': self.product.stock_x_url,
             'goat_url': self.product.goat_url,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# Denormalized read model for the collection and favorites listings. Each row
+# carries a copy of the product columns so a listing page is a single index
+# range scan without joining products. Rows are kept in sync on flush.
+LISTING_PRODUCT_COLUMNS = ('model', 'brand', 'name', 'image_url', 'price', 'stock_x_url', 'goat_url')
+
+class ListingItem(Base):
+    __tablename__ = 'listing_items'
+    __table_args__ = (
+        Index('idx_listing_user_kind_sort', 'user_id', 'kind', 'sort_at'),
+        Index('idx_listing_kind_item', 'kind', 'item_id', unique=True),
+        Index('idx_listing_product', 'product_id'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)  # 'collection' or 'favorite'
+    item_id = Column(Integer, nullable=False)  # id of the collection/favorite row
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    sort_at = Column(DateTime)
+    model = Column(String(100), nullable=False)
+    brand = Column(String(100), nullable=False)
+    name = Column(String(200), nullable=False)
+    price = Column(Double, nullable=False)
+    image_url = Column(String(500))
+    stock_x_url = Column(String(500))
+    goat_url = Column(String(500))
+    count = Column(Integer)
+    size = Column(Double)
+    purchase_price = Column(Double)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+    def to_dict(self):
+        data = {
+            'id': self.item_id,
+            'product_id': self.product_id,
+            'model': self.model,
+            'brand': self.brand,
+            'name': self.name,
+            'image_url': self.image_url,
+            'thumbnails': thumbnail_urls(self.product_id, self.image_url),
+            'price': self.price,
+            'stock_x_url': self.stock_x_url,
+            'goat_url': self.goat_url,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+        if self.kind == 'collection':
+            data['count'] = self.count
+            data['size'] = self.size
+            data['purchase_price'] = self.purchase_price
+            data['updated_at'] = self.updated_at.isoformat() if self.updated_at else None
+        return data
+
+LISTING_KINDS = {Collection: 'collection', Favorite: 'favorite'}
+
+def listing_row(item, product):
+    kind = LISTING_KINDS[type(item)]
+    row = {
+        'kind': kind,
+        'item_id': item.id,
+        'user_id': int(item.user_id),
+        'product_id': int(item.product_id),
+        'created_at': item.created_at,
+        'sort_at': item.updated_at if kind == 'collection' else item.created_at
+    }
+    row.update({column: product[column] for column in LISTING_PRODUCT_COLUMNS})
+    if kind == 'collection':
+        row.update(
+            count=item.count,
+            size=item.size,
+            purchase_price=item.purchase_price,
+            updated_at=item.updated_at
+        )
+    return row
+
+@event.listens_for(Session, 'after_flush')
+def sync_listing_items(session, flush_context):
+    listing = ListingItem.__table__
+    changed = [obj for obj in list(session.new) + list(session.dirty) if type(obj) in LISTING_KINDS]
+    removed = [obj for obj in session.deleted if type(obj) in LISTING_KINDS]
+    products = [obj for obj in session.dirty if isinstance(obj, Product)]
+    connection = session.connection()
+    
+    for obj in changed + removed:
+        connection.execute(delete(listing).where(
+            listing.c.kind == LISTING_KINDS[type(obj)],
+            listing.c.item_id == obj.id
+        ))
+    
+    if changed:
+        product_ids = {int(obj.product_id) for obj in changed}
+        snapshots = {
+            row.id: row for row in connection.execute(
+                select(Product.__table__).where(Product.id.in_(product_ids))
+            ).mappings()
+        }
+        # One executemany per kind, as collection rows carry extra columns
+        for kind in set(LISTING_KINDS[type(obj)] for obj in changed):
+            connection.execute(insert(listing), [
+                listing_row(obj, snapshots[int(obj.product_id)])
+                for obj in changed if LISTING_KINDS[type(obj)] == kind
+            ])
+    
+    for product in products:
+        connection.execute(
+            update(listing)
+            .where(listing.c.product_id == product.id)
+            .values({column: getattr(product, column) for column in LISTING_PRODUCT_COLUMNS})
+        )
+    
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            connection.execute(delete(listing).where(listing.c.product_id == obj.id))
+        elif isinstance(obj, User):
+            connection.execute(delete(listing).where(listing.c.user_id == obj.id))
+
+# Deleted collection/favorite entries, kept so /sync can report deletions
+class SyncTombstone(Base):
+    __tablename__ = 'sync_tombstones'
+    __table_args__ = (
+        Index('idx_tombstone_user_deleted', 'user_id', 'deleted_at'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    kind = Column(String(20), nullable=False)  # 'collection' or 'favorite'
+    item_id = Column(Integer, nullable=False)
+    product_id = Column(Integer, nullable=False)  # no FK, tombstones outlive products
+    deleted_at = Column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+def record_product_tombstones(connection, product_ids):
+    # Entries of deleted products are removed by the database cascade, so
+    # their tombstones are written set-based before the products go
+    now = datetime.now(UTC)
+    for model, kind in LISTING_KINDS.items():
+        connection.execute(insert(SyncTombstone.__table__).from_select(
+            ['user_id', 'kind', 'item_id', 'product_id', 'deleted_at'],
+            select(model.user_id, literal(kind), model.id, model.product_id, literal(now, DateTime))
+            .where(model.product_id.in_(product_ids))
+        ))
+
+@event.listens_for(Session, 'before_flush')
+def record_cascade_tombstones(session, flush_context, instances):
+    product_ids = [obj.id for obj in session.deleted if isinstance(obj, Product)]
+    if product_ids:
+        record_product_tombstones(session.connection(), product_ids)
+
+@event.listens_for(Session, 'after_flush')
+def record_tombstones(session, flush_context):
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    deleted_products = {obj.id for obj in session.deleted if isinstance(obj, Product)}
+    now = datetime.now(UTC)
+    tombstones = [
+        {
+            'user_id': int(obj.user_id),
+            'kind': LISTING_KINDS[type(obj)],
+            'item_id': obj.id,
+            'product_id': int(obj.product_id),
+            'deleted_at': now
+        }
+        for obj in session.deleted
+        if type(obj) in LISTING_KINDS
+        and int(obj.user_id) not in deleted_users
+        and int(obj.product_id) not in deleted_products
+    ]
+    if tombstones:
+        session.connection().execute(insert(SyncTombstone.__table__), tombstones)
+
+def prune_sync_tombstones(session):
+    cutoff = datetime.now(UTC) - Config.SYNC_TOMBSTONE_RETENTION
+    return session.query(SyncTombstone).filter(SyncTombstone.deleted_at < cutoff)\
+                  .delete(synchronize_session=False)
+
+@job_queue.job('prune_sync_tombstones')
+def prune_sync_tombstones_job():
+    with user_data_sessions() as sessions:
+        pruned = sum(prune_sync_tombstones(session) for session in sessions)
+    app.logger.info(f"Pruned {pruned} sync tombstones")
+
+job_queue.schedule('prune_sync_tombstones', every=24 * 3600)
+
+def encode_sync_token(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
+def decode_sync_token(token):
+    return datetime.fromtimestamp(int(token) / 1_000_000, UTC)
+
+# Data versions used for ETags. Writes record which versions they touch while
+# flushing and the new versions are published to Redis once the commit succeeds.
+def user_version_key(user_id):
+    return f"version:user:{int(user_id)}"
+
+def product_version_key(product_id):
+    return f"version:product:{int(product_id)}"
+
+CATALOG_VERSION_KEY = 'version:catalog'
+
+@event.listens_for(Session, 'after_flush')
+def track_version_changes(session, flush_context):
+    keys = session.info.setdefault('version_keys', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if type(obj) in LISTING_KINDS:
+            keys.add(user_version_key(obj.user_id))
+        elif isinstance(obj, Product):
+            keys.add(product_version_key(obj.id))
+            keys.add(CATALOG_VERSION_KEY)
+        elif isinstance(obj, User) and obj in session.deleted:
+            keys.add(user_version_key(obj.id))
+
+@event.listens_for(Session, 'after_commit')
+def publish_version_changes(session):
+    keys = session.info.pop('version_keys', None)
+    if not keys:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, uuid4().hex)
+        pipe.execute()
+    except redis.RedisError as e:
+        app.logger.error(f"Failed to publish data versions: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_version_changes(session):
+    session.info.pop('version_keys', None)
+
+def get_versions(keys):
+    versions = redis_client.mget(keys)
+    for i, version in enumerate(versions):
+        if version is None:
+            # Start unknown versions at a fresh token so an ETag issued before
+            # a Redis flush can never match again
+            redis_client.set(keys[i], uuid4().hex, nx=True)
+            versions[i] = redis_client.get(keys[i])
+    return versions
+
+def conditional_get(version_keys, cache_control='private, no-cache'):
+    # Answers If-None-Match from Redis data versions before the view touches
+    # the database. version_keys(user_id, **view_args) lists the versions the
+    # response depends on.
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            
+            user_id = get_jwt_identity()
+            try:
+                versions = get_versions(version_keys(user_id, **kwargs))
+            except redis.RedisError as e:
+                app.logger.warning(f"ETag versions unavailable: {str(e)}")
+                return f(*args, **kwargs)
+            
+            etag = sha1(f"{user_id}|{request.full_path}|{versions}".encode()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Authorization')
+            return response
+        return wrapper
+    return decorator
+
+RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+# Cached values are stored with how long they took to compute and when they
+# expire, for probabilistic early expiration
+CacheEntry = namedtuple('CacheEntry', 'value delta expires')
+
+def jittered(timeout):
+    return max(1, int(timeout * random.uniform(1 - Config.CACHE_TTL_JITTER, 1 + Config.CACHE_TTL_JITTER)))
+
+def expires_early(entry):
+    # XFetch: a request refreshes the entry ahead of time with a probability
+    # that grows as expiry nears and with how slow the value is to compute
+    return time.time() - entry.delta * Config.CACHE_EARLY_EXPIRY_BETA * math.log(1.0 - random.random()) >= entry.expires
+
+def cached_entries(keys):
+    return [entry if isinstance(entry, CacheEntry) else None for entry in cache.get_many(*keys)]
+
+def count_cache_lookups(hits, misses=0):
+    # Per-request totals for the access log
+    if has_request_context():
+        g.cache_hits = g.get('cache_hits', 0) + hits
+        g.cache_misses = g.get('cache_misses', 0) + misses
+
+def store_entries(keys, compute, timeout):
+    started = time.time()
+    values = compute(keys)
+    entries = {key: value for key, value in values.items() if value is not None}
+    if entries:
+        timeout = jittered(timeout or Config.CACHE_DEFAULT_TIMEOUT)
+        delta = time.time() - started
+        try:
+            cache.set_many({key: CacheEntry(value, delta, time.time() + timeout) for key, value in entries.items()},
+                           timeout=timeout)
+        except redis.RedisError as e:
+            app.logger.warning(f"Failed to cache {len(entries)} entries: {str(e)}")
+    return values
+
+def single_flight_many(keys, compute, timeout=None, wait=5.0):
+    # Returns {key: value} for keys, read with one MGET. For misses only the
+    # worker holding a key's Redis lock computes it, concurrent misses wait
+    # for its result; compute(keys) gets every key this worker locked at once
+    # and returns {key: value}, leaving out keys without a value. Early
+    # refreshes also take the lock, while other workers keep serving the
+    # current value. None values are not cached.
+    entries = dict(zip(keys, cached_entries(keys)))
+    hits = sum(entry is not None for entry in entries.values())
+    count_cache_lookups(hits, len(entries) - hits)
+    values = {key: entry.value for key, entry in entries.items() if entry is not None and not expires_early(entry)}
+    pending = [key for key in entries if key not in values]
+    
+    deadline = time.time() + wait
+    while pending and time.time() < deadline:
+        token = uuid4().hex
+        pipe = redis_client.pipeline(transaction=False)
+        for key in pending:
+            pipe.set(f"lock:{key}", token, nx=True, px=int(wait * 1000))
+        locked = [key for key, acquired in zip(pending, pipe.execute()) if acquired]
+        if locked:
+            try:
+                values.update(store_entries(locked, compute, timeout))
+            finally:
+                pipe = redis_client.pipeline(transaction=False)
+                for key in locked:
+                    RELEASE_LOCK_SCRIPT(keys=[f"lock:{key}"], args=[token], client=pipe)
+                pipe.execute()
+        values.update((key, entries[key].value) for key in pending if key not in locked and entries[key] is not None)
+        pending = [key for key in pending if key not in values and key not in locked]
+        if not pending:
+            break
+        time.sleep(0.02)
+        entries.update(zip(pending, cached_entries(pending)))
+        values.update((key, entries[key].value) for key in pending if entries[key] is not None)
+        pending = [key for key in pending if key not in values]
+    
+    if pending:
+        app.logger.warning(f"Timed out waiting for {', '.join(pending)}, computing directly")
+        values.update(compute(pending))
+    return values
+
+def single_flight(key, compute, timeout=None, wait=5.0):
+    # Single key form of single_flight_many, with compute() returning the value
+    return single_flight_many([key], lambda keys: {key: compute()}, timeout, wait).get(key)
+
+# Feed of changed product ids, consumed by per-process product indexes
+CATALOG_CHANGES_STREAM = 'catalog:changes'
+
+@event.listens_for(Session, 'after_flush')
+def track_catalog_changes(session, flush_context):
+    product_ids = session.info.setdefault('changed_products', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            product_ids.add(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def publish_catalog_changes(session):
+    product_ids = session.info.pop('changed_products', None)
+    if not product_ids:
+        return
+    try:
+        cache.delete_many(*[product_doc_key(product_id) for product_id in product_ids])
+        pipe = redis_client.pipeline(transaction=False)
+        for product_id in product_ids:
+            pipe.xadd(CATALOG_CHANGES_STREAM, {'product_id': product_id}, maxlen=10000, approximate=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        app.logger.error(f"Failed to publish catalog changes: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_catalog_changes(session):
+    session.info.pop('changed_products', None)
+
+def stream_id(entry_id):
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    return tuple(int(part) for part in entry_id.split('-'))
+
+def tokenize(value):
+    return set(re.findall(r'\w+', (value or '').lower()))
+
+class ProductSuggester:
+    # In-process prefix index over product brand, model and name. Lookups are
+    # bisections over a sorted (token, product_id) list and never touch the
+    # database; a background thread applies catalog changes from Redis.
+    def __init__(self):
+        # (sorted (token, product_id) entries, {product_id: (brand, model,
+        # name, tokens)}). Replaced as a whole on every change and never
+        # modified in place, so lookups read a consistent pair without the lock.
+        self.index = ([], {})
+        self.last_change_id = '0-0'
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def build(self):
+        with self.lock:
+            try:
+                latest = redis_client.xrevrange(CATALOG_CHANGES_STREAM, count=1)
+                self.last_change_id = latest[0][0].decode() if latest else '0-0'
+            except redis.RedisError as e:
+                app.logger.warning(f"Catalog change feed unavailable: {str(e)}")
+            with get_db_session() as session:
+                rows = session.query(Product.id, Product.brand, Product.model, Product.name).all()
+            products = {}
+            entries = []
+            for product_id, brand, model, name in rows:
+                tokens = tokenize(brand) | tokenize(model) | tokenize(name)
+                products[product_id] = (brand, model, name, tokens)
+                entries.extend((token, product_id) for token in tokens)
+            entries.sort()
+            self.index = (entries, products)
+
+    @staticmethod
+    def remove(entries, products, product_id):
+        product = products.pop(product_id, None)
+        if product:
+            for token in product[3]:
+                i = bisect_left(entries, (token, product_id))
+                if i < len(entries) and entries[i] == (token, product_id):
+                    del entries[i]
+
+    @staticmethod
+    def upsert(entries, products, product_id, brand, model, name):
+        ProductSuggester.remove(entries, products, product_id)
+        tokens = tokenize(brand) | tokenize(model) | tokenize(name)
+        products[product_id] = (brand, model, name, tokens)
+        for token in tokens:
+            insort(entries, (token, product_id))
+
+    def refresh(self):
+        changes = redis_client.xrange(CATALOG_CHANGES_STREAM, min=f'({self.last_change_id}')
+        if not changes:
+            return
+        if self.last_change_id != '0-0':
+            # Trimming removes the oldest entries first, so if our position is
+            # gone the stream may have lost changes we have not seen
+            oldest = redis_client.xrange(CATALOG_CHANGES_STREAM, count=1)
+            if stream_id(oldest[0][0]) > stream_id(self.last_change_id):
+                self.build()
+                return
+        
+        product_ids = {int(fields[b'product_id']) for _, fields in changes}
+        with get_db_session() as session:
+            rows = session.query(Product.id, Product.brand, Product.model, Product.name)\
+                          .filter(Product.id.in_(product_ids)).all()
+        with self.lock:
+            entries, products = list(self.index[0]), dict(self.index[1])
+            for product_id in product_ids:
+                self.remove(entries, products, product_id)
+            for row in rows:
+                self.upsert(entries, products, *row)
+            self.index = (entries, products)
+            self.last_change_id = changes[-1][0].decode()
+
+    def run(self):
+        while True:
+            time.sleep(Config.SUGGEST_REFRESH_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                app.logger.error(f"Product suggestion refresh failed: {str(e)}")
+
+    def start(self):
+        self.build()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='product-suggester', daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def matching(entries, prefix):
+        ids = set()
+        i = bisect_left(entries, (prefix,))
+        while i < len(entries) and entries[i][0].startswith(prefix):
+            ids.add(entries[i][1])
+            i += 1
+        return ids
+
+    def suggest(self, query, limit=10):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        entries, products = self.index
+        # Start from the most selective term to keep the intersection small
+        candidates = None
+        for term in sorted(terms, key=len, reverse=True):
+            ids = self.matching(entries, term)
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        top = nsmallest(
+            limit,
+            (product_id for product_id in candidates if product_id in products),
+            key=lambda product_id: (products[product_id][0].lower(), products[product_id][1].lower(), product_id)
+        )
+        return [
+            {
+                'id': product_id,
+                'brand': products[product_id][0],
+                'model': products[product_id][1],
+                'name': products[product_id][2]
+            }
+            for product_id in top
+        ]
+
+suggester = ProductSuggester()
+
+def rebuild_listing_items(connection):
+    # Set-based backfill for rows written before the read model existed
+    listing = ListingItem.__table__
+    connection.execute(delete(listing))
+    product_columns = [getattr(Product, column) for column in LISTING_PRODUCT_COLUMNS]
+    connection.execute(insert(listing).from_select(
+        ['kind', 'item_id', 'user_id', 'product_id', 'sort_at', *LISTING_PRODUCT_COLUMNS,
+         'count', 'size', 'purchase_price', 'created_at', 'updated_at'],
+        select(
+            text("'collection'"), Collection.id, Collection.user_id, Collection.product_id,
+            Collection.updated_at, *product_columns, Collection.count, Collection.size,
+            Collection.purchase_price, Collection.created_at, Collection.updated_at
+        ).join(Product, Product.id == Collection.product_id)
+    ))
+    connection.execute(insert(listing).from_select(
+        ['kind', 'item_id', 'user_id', 'product_id', 'sort_at', *LISTING_PRODUCT_COLUMNS, 'created_at'],
+        select(
+            text("'favorite'"), Favorite.id, Favorite.user_id, Favorite.product_id,
+            Favorite.created_at, *product_columns, Favorite.created_at
+        ).join(Product, Product.id == Favorite.product_id)
+    ))
+
+# Precompiled serializers for list responses. They select only the columns a
+# response needs and build dicts straight from the result rows.
+class RowSerializer:
+    def __init__(self, fields, joins=(), derived=None):
+        self.keys = tuple(fields)
+        self.columns = tuple(fields.values())
+        self.joins = joins
+        self.derived = derived or {}  # {key: f(item)} computed after the columns
+
+    def select(self, query):
+        for join in self.joins:
+            query = query.join(join)
+        return query.with_entities(*self.columns)
+
+    def __call__(self, rows):
+        keys = self.keys
+        items = [dict(zip(keys, row)) for row in rows]
+        for key, derive in self.derived.items():
+            for item in items:
+                item[key] = derive(item)
+        return items
+
+PRODUCT_THUMBNAILS = {'thumbnails': lambda item: thumbnail_urls(item['id'], item['image_url'])}
+LISTING_THUMBNAILS = {'thumbnails': lambda item: thumbnail_urls(item['product_id'], item['image_url'])}
+
+PRODUCT_SERIALIZER = RowSerializer({column.name: column for column in Product.__table__.c}, derived=PRODUCT_THUMBNAILS)
+
+COLLECTION_ITEM_SERIALIZER = RowSerializer({
+    'id': Collection.id,
+    'product_id': Collection.product_id,
+    **{column: getattr(Product, column) for column in LISTING_PRODUCT_COLUMNS},
+    'count': Collection.count,
+    'size': Collection.size,
+    'purchase_price': Collection.purchase_price,
+    'created_at': Collection.created_at,
+    'updated_at': Collection.updated_at
+}, joins=(Collection.product,), derived=LISTING_THUMBNAILS)
+
+FAVORITE_ITEM_SERIALIZER = RowSerializer({
+    'id': Favorite.id,
+    'product_id': Favorite.product_id,
+    **{column: getattr(Product, column) for column in LISTING_PRODUCT_COLUMNS},
+    'created_at': Favorite.created_at
+}, joins=(Favorite.product,), derived=LISTING_THUMBNAILS)
+
+LISTED_COLLECTION_ITEM_SERIALIZER = RowSerializer({
+    'id': ListingItem.item_id,
+    'product_id': ListingItem.product_id,
+    **{column: getattr(ListingItem, column) for column in LISTING_PRODUCT_COLUMNS},
+    'count': ListingItem.count,
+    'size': ListingItem.size,
+    'purchase_price': ListingItem.purchase_price,
+    'created_at': ListingItem.created_at,
+    'updated_at': ListingItem.updated_at
+}, derived=LISTING_THUMBNAILS)
+
+LISTED_FAVORITE_ITEM_SERIALIZER = RowSerializer({
+    'id': ListingItem.item_id,
+    'product_id': ListingItem.product_id,
+    **{column: getattr(ListingItem, column) for column in LISTING_PRODUCT_COLUMNS},
+    'created_at': ListingItem.created_at
+}, derived=LISTING_THUMBNAILS)
+
+def overlay_membership(session, user_id, items):
+    # Adds the per-user in_collection/in_favorites flags to serialized products
+    product_ids = [item['id'] for item in items]
+    collected = {product_id for (product_id,) in session.query(Collection.product_id).filter(
+        Collection.user_id == int(user_id),
+        Collection.product_id.in_(product_ids)
+    )}
+    favorited = {product_id for (product_id,) in session.query(Favorite.product_id).filter(
+        Favorite.user_id == int(user_id),
+        Favorite.product_id.in_(product_ids)
+    )}
+    for item in items:
+        item['in_collection'] = item['id'] in collected
+        item['in_favorites'] = item['id'] in favorited
+    return items
+
+# Trending leaderboards: Redis sorted sets of product ids scored by how often
+# they were collected/favorited, each event weighted 2^((t - epoch) / half
+# life). Newer events weigh exponentially more, so ranking by score is
+# ranking by time-decayed popularity without ever rewriting old scores. The
+# reconcile job rebuilds the sets from SQL and moves the epoch forward; if it
+# stops running, the increment script rebases the scores itself before the
+# weights grow out of range.
+TRENDING_KINDS = {Collection: 'collected', Favorite: 'favorited'}
+TRENDING_EPOCH_KEY = 'trending:epoch'
+
+def trending_key(kind):
+    return f"trending:{kind}"
+
+def event_timestamp(moment):
+    if moment is None:
+        return time.time()
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return moment.timestamp()
+
+# KEYS: epoch, sorted sets. ARGV: window start, half life, max halvings,
+# min weight, then (key index, product id, timestamp, sign) per event
+TRENDING_SCRIPT = redis_client.register_script("""
+local window_start = tonumber(ARGV[1])
+local half_life = tonumber(ARGV[2])
+local max_halvings = tonumber(ARGV[3])
+local min_weight = tonumber(ARGV[4])
+local epoch = tonumber(redis.call('get', KEYS[1]))
+if not epoch then
+    epoch = window_start
+    redis.call('set', KEYS[1], epoch)
+end
+-- Scores below this are float residue of removals or fully decayed entries
+local floor = min_weight * 2 ^ ((window_start - epoch) / half_life)
+
+local function rebase()
+    -- Moves the epoch to the window start and rescales every score to match
+    local factor = 2 ^ ((epoch - window_start) / half_life)
+    for k = 2, #KEYS do
+        local entries = redis.call('zrange', KEYS[k], 0, -1, 'WITHSCORES')
+        for j = 1, #entries, 2 do
+            local score = tonumber(entries[j + 1]) * factor
+            if score <= min_weight then
+                redis.call('zrem', KEYS[k], entries[j])
+            else
+                redis.call('zadd', KEYS[k], score, entries[j])
+            end
+        end
+    end
+    epoch = window_start
+    floor = min_weight
+    redis.call('set', KEYS[1], epoch)
+end
+
+for i = 5, #ARGV, 4 do
+    local halvings = (tonumber(ARGV[i + 2]) - epoch) / half_life
+    if halvings > max_halvings and epoch < window_start then
+        rebase()
+        halvings = (tonumber(ARGV[i + 2]) - epoch) / half_life
+    end
+    local weight = tonumber(ARGV[i + 3]) * 2 ^ halvings
+    local key = KEYS[tonumber(ARGV[i])]
+    if tonumber(redis.call('zincrby', key, weight, ARGV[i + 1])) <= floor then
+        redis.call('zrem', key, ARGV[i + 1])
+    end
+end
+""")
+
+@event.listens_for(Session, 'after_flush')
+def track_trending_events(session, flush_context):
+    events = session.info.setdefault('trending_events', [])
+    for objs, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objs:
+            kind = TRENDING_KINDS.get(type(obj))
+            if kind:
+                # Removing an entry takes back the weight it added
+                events.append((kind, int(obj.product_id), event_timestamp(obj.created_at), sign))
+
+@event.listens_for(Session, 'after_commit')
+def publish_trending_events(session):
+    events = session.info.pop('trending_events', None)
+    if not events:
+        return
+    keys = [TRENDING_EPOCH_KEY, trending_key('all')] + [trending_key(kind) for kind in TRENDING_KINDS.values()]
+    args = [
+        time.time() - Config.TRENDING_WINDOW.total_seconds(), Config.TRENDING_HALF_LIFE.total_seconds(),
+        Config.TRENDING_MAX_HALVINGS, Config.TRENDING_MIN_WEIGHT
+    ]
+    for kind, product_id, timestamp, sign in events:
+        for key in (trending_key('all'), trending_key(kind)):
+            args.extend([keys.index(key) + 1, product_id, timestamp, sign])
+    try:
+        TRENDING_SCRIPT(keys=keys, args=args)
+    except redis.RedisError as e:
+        # The next reconciliation restores the missed events
+        app.logger.error(f"Failed to update trending scores: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_trending_events(session):
+    session.info.pop('trending_events', None)
+
+def trending_scores(sessions, epoch):
+    # Decayed scores per kind from the entries created since epoch; older
+    # entries would contribute less than 2^-(window / half life)
+    half_life = Config.TRENDING_HALF_LIFE.total_seconds()
+    since = datetime.fromtimestamp(epoch, UTC).replace(tzinfo=None)
+    scores = {}
+    for model, kind in TRENDING_KINDS.items():
+        rows = [
+            row for session in sessions
+            for row in session.query(model.product_id, model.created_at).filter(model.created_at >= since)
+        ]
+        if not rows:
+            scores[kind] = {}
+            continue
+        product_ids = np.array([row[0] for row in rows])
+        ages = np.array([event_timestamp(row[1]) for row in rows]) - epoch
+        unique_ids, positions = np.unique(product_ids, return_inverse=True)
+        totals = np.bincount(positions, weights=np.exp2(ages / half_life))
+        scores[kind] = dict(zip(unique_ids.tolist(), totals.tolist()))
+    combined = {}
+    for kind_scores in scores.values():
+        for product_id, score in kind_scores.items():
+            combined[product_id] = combined.get(product_id, 0) + score
+    scores['all'] = combined
+    return scores
+
+@job_queue.job('reconcile_trending')
+def reconcile_trending():
+    # Events published between the query and the swap are dropped; they are
+    # picked up again by the next run
+    epoch = time.time() - Config.TRENDING_WINDOW.total_seconds()
+    with user_data_sessions() as sessions:
+        scores = trending_scores(sessions, epoch)
+    pipe = redis_client.pipeline()
+    for kind, kind_scores in scores.items():
+        pipe.delete(trending_key(kind))
+        if kind_scores:
+            pipe.zadd(trending_key(kind), kind_scores)
+    pipe.set(TRENDING_EPOCH_KEY, epoch)
+    pipe.execute()
+    app.logger.info(f"Reconciled trending scores for {len(scores['all'])} products")
+
+job_queue.schedule('reconcile_trending', every=Config.TRENDING_RECONCILE_INTERVAL)
+
+# Item-item recommendations: products are similar when the same users
+# collect or favorite both. The co-occurrence counts are built offline by the
+# build_similar_products job and only the top-k neighbours of each product
+# are kept, packed as (id, score) records in one Redis hash.
+SIMILAR_PRODUCTS_KEY = 'recommendations:similar'
+SIMILAR_DTYPE = np.dtype([('id', '<i4'), ('score', '<f4')])
+
+def user_item_pairs(sessions):
+    # (user index, item index) for every user/product interaction, sorted by
+    # user, plus the product id of each item index
+    rows = []
+    for session in sessions:
+        for model in TRENDING_KINDS:
+            rows.extend(session.query(model.user_id, model.product_id).yield_per(10000))
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    pairs = np.unique(np.array(rows, dtype=np.int64), axis=0)
+    users = pairs[:, 0]
+    product_ids, items = np.unique(pairs[:, 1], return_inverse=True)
+    
+    # Very active users relate almost everything to everything; keep a
+    # bounded number of items per user
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    rank = np.arange(len(users)) - np.repeat(starts, np.diff(np.r_[starts, len(users)]))
+    keep = rank < Config.SIMILAR_MAX_ITEMS_PER_USER
+    return users[keep], items[keep], product_ids
+
+def cooccurrence_counts(users, items, item_count):
+    # Sparse co-occurrence as (left * item_count + right, count), built by
+    # expanding each user's items into all ordered pairs, in batches of at
+    # most SIMILAR_PAIR_BATCH pairs
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    degrees = np.diff(np.r_[starts, len(users)])
+    batches = np.cumsum(degrees.astype(np.int64) ** 2) // Config.SIMILAR_PAIR_BATCH
+    keys, counts = [], []
+    for batch in np.unique(batches):
+        group_starts = starts[batches == batch]
+        group_degrees = degrees[batches == batch]
+        entry = np.repeat(group_starts, group_degrees) + \
+            np.arange(group_degrees.sum()) - np.repeat(np.cumsum(group_degrees) - group_degrees, group_degrees)
+        entry_degrees = np.repeat(group_degrees, group_degrees)
+        entry_starts = np.repeat(group_starts, group_degrees)
+        left = np.repeat(items[entry], entry_degrees)
+        offsets = np.arange(entry_degrees.sum()) - np.repeat(np.cumsum(entry_degrees) - entry_degrees, entry_degrees)
+        right = items[np.repeat(entry_starts, entry_degrees) + offsets]
+        mask = left != right
+        batch_keys, batch_counts = np.unique(left[mask] * item_count + right[mask], return_counts=True)
+        keys.append(batch_keys)
+        counts.append(batch_counts)
+    if not keys:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    merged_keys, positions = np.unique(np.concatenate(keys), return_inverse=True)
+    return merged_keys, np.bincount(positions, weights=np.concatenate(counts)).astype(np.int64)
+
+def similar_products_table(sessions):
+    # {product_id: packed top-k neighbours} scored by cosine similarity
+    users, items, product_ids = user_item_pairs(sessions)
+    item_count = len(product_ids)
+    keys, counts = cooccurrence_counts(users, items, item_count)
+    keep = counts >= Config.SIMILAR_MIN_COOCCURRENCE
+    keys, counts = keys[keep], counts[keep]
+    if not len(keys):
+        return {}
+    
+    popularity = np.bincount(items, minlength=item_count)
+    left, right = keys // item_count, keys % item_count
+    scores = counts / np.sqrt(popularity[left] * popularity[right])
+    
+    order = np.lexsort((-scores, left))
+    left, right, scores = left[order], right[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, left[1:] != left[:-1]])
+    rank = np.arange(len(left)) - np.repeat(starts, np.diff(np.r_[starts, len(left)]))
+    keep = rank < Config.SIMILAR_TOP_K
+    left, right, scores = left[keep], right[keep], scores[keep]
+    
+    table = {}
+    bounds = np.r_[np.flatnonzero(np.r_[True, left[1:] != left[:-1]]), len(left)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        neighbours = np.empty(end - start, SIMILAR_DTYPE)
+        neighbours['id'] = product_ids[right[start:end]]
+        neighbours['score'] = scores[start:end]
+        table[int(product_ids[left[start]])] = neighbours.tobytes()
+    return table
+
+@job_queue.job('build_similar_products')
+def build_similar_products():
+    with user_data_sessions() as sessions:
+        table = similar_products_table(sessions)
+    building_key = f"{SIMILAR_PRODUCTS_KEY}:building"
+    pipe = redis_client.pipeline()
+    pipe.delete(building_key)
+    items = list(table.items())
+    for i in range(0, len(items), 1000):
+        pipe.hset(building_key, mapping=dict(items[i:i + 1000]))
+    if items:
+        pipe.rename(building_key, SIMILAR_PRODUCTS_KEY)
+    else:
+        pipe.delete(SIMILAR_PRODUCTS_KEY)
+    pipe.execute()
+    app.logger.info(f"Built similar products for {len(table)} products")
+
+job_queue.schedule('build_similar_products', every=Config.SIMILAR_BUILD_INTERVAL)
+
+def similar_products(product_ids):
+    # {product_id: [(neighbour_id, score), ...]} for the given products
+    packed = redis_client.hmget(SIMILAR_PRODUCTS_KEY, product_ids)
+    return {
+        product_id: [(int(n['id']), float(n['score'])) for n in np.frombuffer(data, SIMILAR_DTYPE)]
+        for product_id, data in zip(product_ids, packed) if data
+    }
+
+def recommended_products(session, user_id, limit):
+    # Neighbours of the user's most recent products, scored by summed
+    # similarity, excluding what the user already has
+    owned = []
+    for model in TRENDING_KINDS:
+        owned.extend(
+            product_id for (product_id,) in session.query(model.product_id)
+                                                  .filter(model.user_id == int(user_id))
+                                                  .order_by(model.created_at.desc())
+                                                  .limit(Config.SIMILAR_MAX_ITEMS_PER_USER)
+        )
+    owned = list(dict.fromkeys(owned))
+    scores = {}
+    for neighbours in similar_products(owned).values() if owned else ():
+        for product_id, score in neighbours:
+            scores[product_id] = scores.get(product_id, 0) + score
+    for product_id in owned:
+        scores.pop(product_id, None)
+    return [product_id for product_id, _ in nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))]
+
+# Price history: every price a product had is appended to price_points, and
+# price_rollups holds per day/week/month open/high/low/close buckets for charts
+PRICE_PERIODS = ('day', 'week', 'month')
+
+class PricePoint(Base):
+    __tablename__ = 'price_points'
+    __table_args__ = (
+        Index('idx_price_point_product_recorded', 'product_id', 'recorded_at'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    price = Column(Double, nullable=False)
+    recorded_at = Column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+class PriceRollup(Base):
+    __tablename__ = 'price_rollups'
+    __table_args__ = (
+        Index('idx_price_rollup_product_period_bucket', 'product_id', 'period', 'bucket_start', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    period = Column(String(10), nullable=False)  # 'day', 'week' or 'month'
+    bucket_start = Column(DateTime, nullable=False)
+    open = Column(Double, nullable=False)
+    high = Column(Double, nullable=False)
+    low = Column(Double, nullable=False)
+    close = Column(Double, nullable=False)
+    avg = Column(Double, nullable=False)
+    samples = Column(Integer, nullable=False)
+
+    def to_dict(self):
+        return {
+            'bucket_start': self.bucket_start.isoformat(),
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'avg': self.avg
+        }
+
+def bucket_start(moment, period):
+    day = datetime(moment.year, moment.month, moment.day)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+def bucket_axis(start, end, period):
+    # Starts of the buckets from start to end. Long windows take every n-th
+    # bucket, with n the smallest step that keeps the axis within
+    # MAX_PRICE_HISTORY_POINTS.
+    first = bucket_start(start, period)
+    if first > end:
+        return []
+    if period == 'month':
+        count = (end.year - first.year) * 12 + end.month - first.month + 1
+    else:
+        count = (end - first).days // (7 if period == 'week' else 1) + 1
+    step = math.ceil(count / Config.MAX_PRICE_HISTORY_POINTS)
+    if period == 'month':
+        months = [first.year * 12 + first.month - 1 + i for i in range(0, count, step)]
+        return [datetime(month // 12, month % 12 + 1, 1) for month in months]
+    days = 7 if period == 'week' else 1
+    return [first + timedelta(days=i * days) for i in range(0, count, step)]
+
+@event.listens_for(Session, 'after_flush')
+def record_price_points(session, flush_context):
+    now = datetime.now(UTC)
+    points = [
+        {'product_id': obj.id, 'price': obj.price, 'recorded_at': now}
+        for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Product) and (obj in session.new or inspect(obj).attrs.price.history.has_changes())
+    ]
+    if points:
+        # Price points live on the primary, also when written from a shard session
+        session.connection(bind_arguments={'mapper': PricePoint}).execute(insert(PricePoint.__table__), points)
+        session.info.setdefault('repriced_products', set()).update(point['product_id'] for point in points)
+        session.info.setdefault('repriced_since', now)
+
+@event.listens_for(Session, 'after_commit')
+def update_price_rollups(session):
+    product_ids = session.info.pop('repriced_products', None)
+    since = session.info.pop('repriced_since', None)
+    if not product_ids:
+        return
+    since = since.isoformat()
+    try:
+        for product_id in product_ids:
+            # A job still waiting for the same product covers these points as
+            # well, since its window starts earlier
+            job_queue.enqueue(
+                'recompute_price_rollups', [product_id], since=since,
+                dedup_key=f"price_rollups:{product_id}"
+            )
+    except JobQueueError as e:
+        app.logger.warning(f"{str(e)}, recomputing price rollups inline")
+        try:
+            recompute_price_rollups_job(list(product_ids), since=since)
+        except SQLAlchemyError as e:
+            app.logger.error(f"Failed to update price rollups: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_price_points(session):
+    session.info.pop('repriced_products', None)
+    session.info.pop('repriced_since', None)
+
+def recompute_price_rollups(session, product_ids, since=None):
+    # Rebuilds the rollup buckets that contain points recorded at or after
+    # since (per period, the bucket holding since and everything later); all
+    # buckets without it. Older buckets cannot change, as points are only
+    # ever appended.
+    points = session.query(PricePoint.product_id, PricePoint.recorded_at, PricePoint.price)\
+                    .filter(PricePoint.product_id.in_(product_ids))\
+                    .order_by(PricePoint.product_id, PricePoint.recorded_at, PricePoint.id)
+    stale_rollups = session.query(PriceRollup).filter(PriceRollup.product_id.in_(product_ids))
+    cutoffs = {}
+    if since is not None:
+        cutoffs = {period: bucket_start(since, period) for period in PRICE_PERIODS}
+        points = points.filter(PricePoint.recorded_at >= min(cutoffs.values()))
+        stale_rollups = stale_rollups.filter(or_(*[
+            and_(PriceRollup.period == period, PriceRollup.bucket_start >= cutoff)
+            for period, cutoff in cutoffs.items()
+        ]))
+    
+    buckets = {}
+    for product_id, recorded_at, price in points:
+        for period in PRICE_PERIODS:
+            start = bucket_start(recorded_at, period)
+            if cutoffs and start < cutoffs[period]:
+                # Points before a month or day bucket, loaded for a week
+                # bucket that began earlier
+                continue
+            key = (product_id, period, start)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = {'open': price, 'high': price, 'low': price, 'close': price, 'total': price, 'samples': 1}
+            else:
+                bucket['high'] = max(bucket['high'], price)
+                bucket['low'] = min(bucket['low'], price)
+                bucket['close'] = price
+                bucket['total'] += price
+                bucket['samples'] += 1
+    
+    stale_rollups.delete(synchronize_session=False)
+    if buckets:
+        session.execute(insert(PriceRollup.__table__), [
+            {
+                'product_id': product_id,
+                'period': period,
+                'bucket_start': start,
+                'open': bucket['open'],
+                'high': bucket['high'],
+                'low': bucket['low'],
+                'close': bucket['close'],
+                'avg': bucket['total'] / bucket['samples'],
+                'samples': bucket['samples']
+            }
+            for (product_id, period, start), bucket in buckets.items()
+        ])
+
+@job_queue.job('recompute_price_rollups')
+def recompute_price_rollups_job(product_ids, since=None):
+    with get_db_session() as session:
+        recompute_price_rollups(session, product_ids, datetime.fromisoformat(since) if since else None)
+
+def price_series(session, product_ids, period, start, end):
+    rollups = session.query(PriceRollup).filter(
+        PriceRollup.product_id.in_(product_ids),
+        PriceRollup.period == period,
+        PriceRollup.bucket_start >= bucket_start(start, period),
+        PriceRollup.bucket_start <= end
+    ).order_by(PriceRollup.product_id, PriceRollup.bucket_start)
+    series = {product_id: [] for product_id in product_ids}
+    for rollup in rollups:
+        series[rollup.product_id].append(rollup.to_dict())
+    return series
+
+def collection_valuation(session, user_id, period, start, end):
+    # Value of the user's holdings at every bucket of the axis. Each product's
+    # close is carried forward to later buckets; before a product's first
+    # rollup its earliest known price is used, and products without any
+    # history count at their current price.
+    axis = bucket_axis(start, end, period)
+    holdings = session.query(Collection.product_id, Collection.count, Collection.created_at, Product.price)\
+                      .join(Collection.product)\
+                      .filter(Collection.user_id == user_id)\
+                      .order_by(Collection.product_id)\
+                      .all()
+    if not holdings or not axis:
+        return [{'bucket_start': moment.isoformat(), 'value': 0.0} for moment in axis]
+    
+    # Holdings are in product id order, so product_index follows the order of
+    # the rollups below and the (product, time) keys are sorted
+    product_ids = [holding.product_id for holding in holdings]
+    product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+    counts = np.array([holding.count for holding in holdings], dtype=np.float64)
+    current_prices = np.array([holding.price for holding in holdings], dtype=np.float64)
+    acquired = np.array([
+        np.datetime64(bucket_start(holding.created_at or axis[0], period), 's') for holding in holdings
+    ])
+    times = np.array([np.datetime64(moment, 's') for moment in axis])
+    
+    rollups = session.query(PriceRollup.product_id, PriceRollup.bucket_start, PriceRollup.close).filter(
+        PriceRollup.product_id.in_(product_ids),
+        PriceRollup.period == period,
+        PriceRollup.bucket_start <= axis[-1]
+    ).order_by(PriceRollup.product_id, PriceRollup.bucket_start).all()
+    
+    prices = np.broadcast_to(current_prices[:, None], (len(holdings), len(axis))).copy()
+    if rollups:
+        rollup_products = np.array([product_index[row.product_id] for row in rollups], dtype=np.int64)
+        rollup_times = np.array([np.datetime64(row.bucket_start, 's') for row in rollups]).astype(np.int64)
+        closes = np.array([row.close for row in rollups], dtype=np.float64)
+        
+        # One sorted key space (product, time) lets a single searchsorted
+        # find the latest rollup at or before every (product, bucket) pair
+        span = max(int(rollup_times.max()), int(times.astype(np.int64).max())) + 1
+        keys = rollup_products * span + rollup_times
+        queries = np.arange(len(holdings))[:, None] * span + times.astype(np.int64)[None, :]
+        found = np.searchsorted(keys, queries, side='right') - 1
+        valid = (found >= 0) & (rollup_products[np.clip(found, 0, None)] == np.arange(len(holdings))[:, None])
+        
+        has_history = np.zeros(len(holdings), dtype=bool)
+        has_history[rollup_products] = True
+        first_rollup = np.searchsorted(rollup_products, np.arange(len(holdings)))
+        earliest = np.where(has_history, closes[np.clip(first_rollup, 0, len(closes) - 1)], current_prices)
+        prices = np.where(valid, closes[np.clip(found, 0, None)], earliest[:, None])
+    
+    held = acquired[:, None] <= times[None, :]
+    values = (np.where(held, prices, 0.0) * counts[:, None]).sum(axis=0)
+    return [
+        {'bucket_start': moment.isoformat(), 'value': round(float(value), 2)}
+        for moment, value in zip(axis, values)
+    ]
+
+def window_bound(name):
+    # Naive UTC datetime from an ISO 8601 query argument; values with an
+    # offset are converted, values without one are taken as UTC
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiException(f"{name} must be an ISO 8601 date or time")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(UTC).replace(tzinfo=None)
+    return moment
+
+def price_history_window():
+    period = request.args.get('period', 'day')
+    if period not in PRICE_PERIODS:
+        raise ApiException(f"period must be one of: {', '.join(PRICE_PERIODS)}")
+    end = window_bound('end') or datetime.now(UTC).replace(tzinfo=None)
+    start = window_bound('start') or end - Config.PRICE_HISTORY_DEFAULT_RANGE[period]
+    if start > end:
+        raise ApiException('start must not be after end')
+    return period, start, end
+
+# Snapshot of deleted products, with how many users held them at the time
+class ArchivedProduct(Base):
+    __tablename__ = 'archived_products'
+    __table_args__ = (
+        Index('idx_archived_product_product', 'product_id'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    data = Column(Text, nullable=False)  # product document as JSON
+    collected_count = Column(Integer, nullable=False, default=0)
+    favorited_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+# Sharding: per-user tables live on one of the shard databases, picked per
+# user through the user_shards directory (mirrored in a Redis hash). Shards
+# hold a replica of products so listings still join locally; the primary
+# database keeps users, the catalog and everything else.
+USER_SHARDED_TABLES = ('collections', 'favorites', 'listing_items', 'sync_tombstones')
+USER_SHARDS_KEY = 'shards:users'
+
+def shard_moving_key(user_id):
+    return f"shards:moving:{int(user_id)}"
+
+class UserShard(Base):
+    __tablename__ = 'user_shards'
+    
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    shard = Column(Integer, nullable=False)
+    moved_at = Column(DateTime)
+    moving_since = Column(DateTime)  # set while the user's rows are being moved
+
+def shard_table(table, metadata):
+    # Copy of a table for the shard schema, without foreign keys to users,
+    # which only exist on the primary database
+    columns = [
+        Column(
+            column.name, column.type,
+            *[ForeignKey(fk.target_fullname, ondelete=fk.ondelete)
+              for fk in column.foreign_keys if not fk.target_fullname.startswith('users.')],
+            primary_key=column.primary_key, nullable=column.nullable
+        )
+        for column in table.columns
+    ]
+    indexes = [Index(index.name, *[column.name for column in index.columns], unique=index.unique)
+               for index in table.indexes]
+    return Table(table.name, metadata, *columns, *indexes)
+
+shard_metadata = MetaData()
+for table_name in ('products',) + USER_SHARDED_TABLES:
+    shard_table(Base.metadata.tables[table_name], shard_metadata)
+
+# Mappers that always go to the primary database from a shard session
+PRIMARY_BINDS = {
+    User: engine, UserShard: engine, Product: engine,
+    PricePoint: engine, PriceRollup: engine, ArchivedProduct: engine
+}
+
+def shard_for_user(user_id):
+    user_id = int(user_id)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hget(USER_SHARDS_KEY, user_id)
+        pipe.exists(shard_moving_key(user_id))
+        shard, moving = pipe.execute()
+    except redis.RedisError as e:
+        app.logger.warning(f"Shard directory cache unavailable: {str(e)}")
+        shard, moving = None, False
+    if moving:
+        raise ApiException('Your data is being moved, please try again shortly', code=503)
+    if shard is not None:
+        return int(shard)
+    
+    # The directory row is authoritative: a move drops the user from the Redis
+    # hash, so a miss or a Redis outage ends up here and still sees the move
+    with get_db_session() as session:
+        assignment = directory_entry(session, user_id)
+        shard, moving = assignment.shard, assignment.moving_since is not None
+    if moving:
+        raise ApiException('Your data is being moved, please try again shortly', code=503)
+    try:
+        redis_client.hset(USER_SHARDS_KEY, user_id, shard)
+    except redis.RedisError:
+        pass
+    return shard
+
+def directory_entry(session, user_id):
+    # The user's user_shards row. First access pins the user to a shard so
+    # later changes to the shard count do not silently move anyone.
+    assignment = session.get(UserShard, user_id)
+    if assignment is None:
+        try:
+            assignment = UserShard(user_id=user_id, shard=user_id % len(shard_engines))
+            session.add(assignment)
+            session.flush()
+        except IntegrityError:
+            session.rollback()
+            assignment = session.get(UserShard, user_id)
+    if assignment is None:
+        # No users row to pin, e.g. the token of a deleted user
+        raise ApiException('User not found', code=404)
+    return assignment
+
+def shard_binds(shard_engine):
+    # Per-user models are bound explicitly as well: a query is routed by its
+    # first entity, so e.g. collections joined with products stay on the shard
+    return {
+        **PRIMARY_BINDS,
+        **{model: shard_engine for model in (Collection, Favorite, ListingItem, SyncTombstone)}
+    }
+
+def shard_session_options(user_id):
+    if user_id is None or not shard_engines:
+        return {}
+    shard_engine = shard_engines[shard_for_user(user_id)]
+    return {'bind': shard_engine, 'binds': shard_binds(shard_engine)}
+
+@contextmanager
+def user_data_sessions():
+    # One session per database holding per-user tables, for jobs that scan
+    # every user's data
+    sessions = [Session(bind=shard_engine, binds=shard_binds(shard_engine)) for shard_engine in shard_engines] or [Session()]
+    try:
+        yield sessions
+        for session in sessions:
+            session.commit()
+    except SQLAlchemyError:
+        for session in sessions:
+            session.rollback()
+        raise
+    finally:
+        for session in sessions:
+            session.close()
+
+def replicate_products(product_ids):
+    # Brings the product replicas on every shard in line with the primary:
+    # changed products are upserted (with their listing snapshots), deleted
+    # ones removed after recording tombstones, as on the primary
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(Product.__table__).where(Product.id.in_(product_ids))
+        ).mappings().all()
+    existing = [dict(row) for row in rows]
+    removed = list(set(product_ids) - {row['id'] for row in existing})
+    listing = ListingItem.__table__
+    for shard_engine in shard_engines:
+        with shard_engine.begin() as connection:
+            if removed:
+                record_product_tombstones(connection, removed)
+                connection.execute(delete(Product.__table__).where(Product.id.in_(removed)))
+            for row in existing:
+                # Update in place; replacing the row would cascade to entries
+                updated = connection.execute(
+                    update(Product.__table__).where(Product.id == row['id']).values(row)
+                ).rowcount
+                if not updated:
+                    connection.execute(insert(Product.__table__), row)
+                connection.execute(
+                    update(listing)
+                    .where(listing.c.product_id == row['id'])
+                    .values({column: row[column] for column in LISTING_PRODUCT_COLUMNS})
+                )
+
+@event.listens_for(Session, 'after_flush')
+def track_replicated_products(session, flush_context):
+    # Products are written to the primary from any session, see PRIMARY_BINDS
+    if shard_engines:
+        session.info.setdefault('replicated_products', set()).update(
+            obj.id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+            if isinstance(obj, Product)
+        )
+
+@event.listens_for(Session, 'after_commit')
+def publish_replicated_products(session):
+    product_ids = session.info.pop('replicated_products', None)
+    if not product_ids:
+        return
+    try:
+        replicate_products(list(product_ids))
+    except SQLAlchemyError as e:
+        # manage_shards.py sync-products repairs the replicas
+        app.logger.error(f"Failed to replicate products to shards: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_replicated_products(session):
+    session.info.pop('replicated_products', None)
+
+# Deleting a user cascades on the primary only; their rows on the shards are
+# removed once the deletion commits
+@event.listens_for(Session, 'after_flush')
+def track_deleted_users(session, flush_context):
+    if shard_engines:
+        session.info.setdefault('deleted_users', set()).update(
+            obj.id for obj in session.deleted if isinstance(obj, User)
+        )
+
+@event.listens_for(Session, 'after_commit')
+def delete_sharded_user_rows(session):
+    user_ids = session.info.pop('deleted_users', None)
+    if not user_ids:
+        return
+    try:
+        for shard_engine in shard_engines:
+            with shard_engine.begin() as connection:
+                for user_id in user_ids:
+                    delete_user_rows(connection, user_id)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Failed to delete shard rows of users {sorted(user_ids)}: {str(e)}")
+    try:
+        redis_client.hdel(USER_SHARDS_KEY, *user_ids)
+    except redis.RedisError as e:
+        app.logger.warning(f"Failed to clear shard directory entries: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_deleted_users(session):
+    session.info.pop('deleted_users', None)
+
+def sync_shard_products(shard_engine, batch_size=1000):
+    # Full copy of the catalog onto one shard
+    with engine.connect() as source, shard_engine.begin() as target:
+        replica_ids = {product_id for (product_id,) in target.execute(select(Product.__table__.c.id))}
+        catalog_ids = set()
+        rows = source.execution_options(yield_per=batch_size).execute(select(Product.__table__)).mappings()
+        for batch in rows.partitions():
+            batch = [dict(row) for row in batch]
+            catalog_ids.update(row['id'] for row in batch)
+            new = [row for row in batch if row['id'] not in replica_ids]
+            if new:
+                target.execute(insert(Product.__table__), new)
+            for row in batch:
+                if row['id'] in replica_ids:
+                    target.execute(update(Product.__table__).where(Product.id == row['id']).values(row))
+        removed = list(replica_ids - catalog_ids)
+        if removed:
+            record_product_tombstones(target, removed)
+            target.execute(delete(Product.__table__).where(Product.id.in_(removed)))
+
+def copy_user_rows(source, target, user_id):
+    # Inserts the user's rows into the target shard with ids from the target;
+    # listing items are pointed at the new collection/favorite ids
+    new_ids = {}
+    for model, kind in LISTING_KINDS.items():
+        table = shard_metadata.tables[model.__tablename__]
+        new_ids[kind] = {}
+        for row in source.execute(select(table).where(table.c.user_id == user_id)).mappings():
+            row = dict(row)
+            old_id = row.pop('id')
+            new_ids[kind][old_id] = target.execute(insert(table).values(row)).inserted_primary_key[0]
+    
+    listing = shard_metadata.tables['listing_items']
+    listing_rows = []
+    for row in source.execute(select(listing).where(listing.c.user_id == user_id)).mappings():
+        row = dict(row)
+        del row['id']
+        row['item_id'] = new_ids[row['kind']][row['item_id']]
+        listing_rows.append(row)
+    tombstones = shard_metadata.tables['sync_tombstones']
+    tombstone_rows = [
+        {key: value for key, value in row.items() if key != 'id'}
+        for row in source.execute(select(tombstones).where(tombstones.c.user_id == user_id)).mappings()
+    ]
+    for table, rows in ((listing, listing_rows), (tombstones, tombstone_rows)):
+        if rows:
+            target.execute(insert(table), rows)
+    return sum(len(ids) for ids in new_ids.values())
+
+def delete_user_rows(connection, user_id):
+    for table_name in reversed(USER_SHARDED_TABLES):
+        table = shard_metadata.tables[table_name]
+        connection.execute(delete(table).where(table.c.user_id == user_id))
+
+def begin_user_move(user_id):
+    # Claims the user's directory row for a move and returns their shard, or
+    # None while another move of the user is running. Requests for the user
+    # get a 503 from the row as well as from the Redis flag, so a Redis
+    # outage cannot send writes to the old shard while rows are copied.
+    now = datetime.now(UTC)
+    with get_db_session() as session:
+        shard = directory_entry(session, user_id).shard
+        claimed = session.execute(
+            update(UserShard)
+            .where(UserShard.user_id == user_id)
+            .where(or_(UserShard.moving_since.is_(None),
+                       UserShard.moving_since < now - timedelta(seconds=Config.SHARD_MOVE_TIMEOUT)))
+            .values(moving_since=now)
+        ).rowcount
+    if not claimed:
+        return None
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(shard_moving_key(user_id), 1, ex=Config.SHARD_MOVE_TIMEOUT)
+        pipe.hdel(USER_SHARDS_KEY, user_id)
+        pipe.execute()
+    except redis.RedisError:
+        # Redis could come back still pointing at the old shard
+        end_user_move(user_id)
+        raise
+    return shard
+
+def end_user_move(user_id, shard=None):
+    # Releases the claim. With a shard, the user's rows were written there
+    # with new ids, so the move time is recorded and syncing clients start
+    # over with a full listing.
+    with get_db_session() as session:
+        assignment = session.get(UserShard, user_id)
+        assignment.moving_since = None
+        if shard is not None:
+            assignment.shard = shard
+            assignment.moved_at = datetime.now(UTC)
+            session.info.setdefault('version_keys', set()).add(user_version_key(user_id))
+    try:
+        # The hash entry is dropped again in case a lookup cached the old
+        # shard just as the move began
+        pipe = redis_client.pipeline()
+        pipe.delete(shard_moving_key(user_id))
+        pipe.hdel(USER_SHARDS_KEY, user_id)
+        pipe.execute()
+    except redis.RedisError as e:
+        # Requests get a 503 until the flag expires
+        app.logger.warning(f"Failed to clear the moving flag of user {user_id}: {str(e)}")
+
+def move_user(user_id, target):
+    # Moves a user's rows to another shard; requests for the user get a 503
+    # while the move runs. A move that was interrupted leaves the user
+    # claimed and can be run again once SHARD_MOVE_TIMEOUT has passed.
+    user_id = int(user_id)
+    source = begin_user_move(user_id)
+    if source is None:
+        raise RuntimeError(f"User {user_id} is already being moved")
+    if source == target:
+        end_user_move(user_id)
+        return 0
+    try:
+        time.sleep(Config.SHARD_MOVE_GRACE)
+        with shard_engines[source].connect() as source_connection, shard_engines[target].begin() as target_connection:
+            # Rows left on the target by an interrupted move
+            delete_user_rows(target_connection, user_id)
+            moved = copy_user_rows(source_connection, target_connection, user_id)
+        try:
+            end_user_move(user_id, target)
+        except Exception:
+            with shard_engines[target].begin() as connection:
+                delete_user_rows(connection, user_id)
+            raise
+    except Exception:
+        # The user stays on the source shard
+        end_user_move(user_id)
+        raise
+    
+    with shard_engines[source].begin() as connection:
+        delete_user_rows(connection, user_id)
+    return moved
+
+def migrate_primary_user_rows():
+    # Moves per-user rows left on the primary from before sharding was
+    # enabled to each user's shard. Runs at startup, before requests are
+    # routed by user; users another process is migrating are skipped and get
+    # a 503 until it is done. Returns the number of rows moved.
+    user_ids = set()
+    with engine.connect() as connection:
+        for table_name in USER_SHARDED_TABLES:
+            table = Base.metadata.tables[table_name]
+            user_ids.update(connection.execute(select(table.c.user_id).distinct()).scalars())
+    moved = 0
+    for user_id in sorted(user_ids):
+        try:
+            shard = begin_user_move(user_id)
+        except ApiException:
+            app.logger.warning(f"Rows of missing user {user_id} left on the primary database")
+            continue
+        if shard is None:
+            continue
+        try:
+            # The shard commits before the primary: an interruption in between
+            # leaves the rows in both, and the next run replaces the shard's copy
+            with engine.begin() as source, shard_engines[shard].begin() as target:
+                delete_user_rows(target, user_id)
+                moved += copy_user_rows(source, target, user_id)
+                delete_user_rows(source, user_id)
+        except Exception:
+            end_user_move(user_id)
+            raise
+        end_user_move(user_id, shard)
+    return moved
+
+def holder_counts(session, model, product_ids):
+    # {product_id: number of users holding it}, summed over the shards
+    def counts_in(query_session):
+        return query_session.query(model.product_id, func.count())\
+                            .filter(model.product_id.in_(product_ids))\
+                            .group_by(model.product_id)
+    if not shard_engines:
+        return dict(counts_in(session))
+    counts = {}
+    with user_data_sessions() as sessions:
+        for shard_session in sessions:
+            for product_id, count in counts_in(shard_session):
+                counts[product_id] = counts.get(product_id, 0) + count
+    return counts
+
+def delete_products(session, product_ids, archive=True, batch_size=500):
+    # Bulk delete without loading products or their collection/favorite rows.
+    # Statements bypass the flush hooks, so tombstones and change
+    # notifications are recorded here explicitly.
+    connection = session.connection()
+    deleted = 0
+    product_ids = list(product_ids)
+    for i in range(0, len(product_ids), batch_size):
+        batch = product_ids[i:i + batch_size]
+        if archive:
+            collected = holder_counts(session, Collection, batch)
+            favorited = holder_counts(session, Favorite, batch)
+            rows = PRODUCT_SERIALIZER.select(session.query(Product)).filter(Product.id.in_(batch)).all()
+            archived = [
+                {
+                    'product_id': item['id'],
+                    'data': app.json.dumps(item),
+                    'collected_count': collected.get(item['id'], 0),
+                    'favorited_count': favorited.get(item['id'], 0),
+                    'archived_at': datetime.now(UTC)
+                }
+                for item in PRODUCT_SERIALIZER(rows)
+            ]
+            if archived:
+                connection.execute(insert(ArchivedProduct.__table__), archived)
+        
+        record_product_tombstones(connection, batch)
+        deleted += connection.execute(delete(Product.__table__).where(Product.id.in_(batch))).rowcount
+        
+        session.info.setdefault('version_keys', set()).update(
+            [CATALOG_VERSION_KEY] + [product_version_key(product_id) for product_id in batch]
+        )
+        session.info.setdefault('changed_products', set()).update(batch)
+        if shard_engines:
+            session.info.setdefault('replicated_products', set()).update(batch)
+    return deleted
+
+# Sampled request counts of product documents and searches, read by
+# warm_caches to preload what is asked for most
+POPULAR_PRODUCTS_KEY = 'warm:products'
+POPULAR_SEARCHES_KEY = 'warm:searches'
+
+def track_popularity(key, members):
+    if not members or random.random() >= Config.WARM_TRACK_SAMPLE_RATE:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for member in members:
+            pipe.zincrby(key, 1, member)
+        pipe.execute()
+    except redis.RedisError as e:
+        app.logger.warning(f"Failed to track popularity: {str(e)}")
+
+# Shared product documents (without per-user flags), in the same cache
+# entries as single_flight
+def product_doc_key(product_id):
+    return f"product:{int(product_id)}"
+
+def get_product_documents(session, product_ids, track=True):
+    # Returns {product_id: document} for the ids that exist: cached documents
+    # come from one MGET, misses from one IN query for the documents this
+    # worker holds the locks of. track=False leaves the lookups out of the
+    # popularity counts.
+    if track:
+        track_popularity(POPULAR_PRODUCTS_KEY, product_ids)
+    keys = {product_doc_key(product_id): int(product_id) for product_id in product_ids}
+    
+    def load(missing):
+        rows = PRODUCT_SERIALIZER.select(session.query(Product))\
+                                 .filter(Product.id.in_([keys[key] for key in missing]))\
+                                 .all()
+        # Round-trip through JSON so loaded documents look like served ones.
+        # Unknown ids are cached as False, so requests for deleted products
+        # do not all reach the database; new products clear their key.
+        loaded = {product_doc_key(item['id']): app.json.loads(app.json.dumps(item)) for item in PRODUCT_SERIALIZER(rows)}
+        return {key: loaded.get(key, False) for key in missing}
+    
+    try:
+        documents = single_flight_many(list(keys), load, timeout=Config.PRODUCT_DOC_TIMEOUT)
+    except redis.RedisError as e:
+        app.logger.warning(f"Product cache unavailable: {str(e)}")
+        documents = load(list(keys))
+    return {keys[key]: document for key, document in documents.items() if document}
+
+def search_result(normalized, page, per_page):
+    # Result ids are shared between users, membership flags are added per request
+    def run_search():
+        with get_db_session() as session:
+            base_query = product_search_query(session, normalized)
+            total = base_query.order_by(None).count()
+            ids = [product_id for (product_id,) in base_query.with_entities(Product.id)
+                                                             .offset((page - 1) * per_page)
+                                                             .limit(per_page)]
+            return {'total': total, 'ids': ids}
+    
+    try:
+        catalog_version = get_versions([CATALOG_VERSION_KEY])[0].decode()
+        return single_flight(
+            f"search:{catalog_version}:{page}:{per_page}:{normalized}",
+            run_search,
+            timeout=Config.SEARCH_CACHE_TIMEOUT
+        )
+    except redis.RedisError as e:
+        app.logger.warning(f"Search cache unavailable: {str(e)}")
+        return run_search()
+
+def warm_caches():
+    # Preloads the most requested product documents and first search pages
+    # after a deploy or Redis flush; the lock makes it once per deploy
+    # rather than once per worker
+    if not redis_client.set('warm:lock', 1, nx=True, ex=Config.WARM_LOCK_TIMEOUT):
+        return
+    product_ids = [int(product_id) for product_id in redis_client.zrevrange(POPULAR_PRODUCTS_KEY, 0, Config.WARM_PRODUCTS - 1)]
+    queries = [query.decode() for query in redis_client.zrevrange(POPULAR_SEARCHES_KEY, 0, Config.WARM_SEARCHES - 1)]
+    
+    with get_db_session() as session:
+        for i in range(0, len(product_ids), Config.MAX_BATCH_PRODUCTS):
+            get_product_documents(session, product_ids[i:i + Config.MAX_BATCH_PRODUCTS])
+    for query in queries:
+        search_result(query, 1, 20)
+    
+    # Halve the counts so popularity follows recent traffic, and drop the tail
+    pipe = redis_client.pipeline()
+    for key, keep in ((POPULAR_PRODUCTS_KEY, Config.WARM_PRODUCTS), (POPULAR_SEARCHES_KEY, Config.WARM_SEARCHES)):
+        pipe.zunionstore(key, {key: 0.5})
+        pipe.zremrangebyrank(key, 0, -keep * 4 - 1)
+    pipe.execute()
+    app.logger.info(f"Warmed {len(product_ids)} product documents and {len(queries)} searches")
+
+def start_cache_warmer():
+    def run():
+        try:
+            warm_caches()
+        except (redis.RedisError, SQLAlchemyError) as e:
+            app.logger.warning(f"Cache warm-up failed: {str(e)}")
+    threading.Thread(target=run, name='cache-warmer', daemon=True).start()
+
+# Listing queries, shared by the routes and query_plans.py
+def collection_listing_query(session, user_id):
+    return session.query(Collection).filter(Collection.user_id == user_id)\
+                  .order_by(Collection.updated_at.desc())
+
+def favorites_listing_query(session, user_id):
+    return session.query(Favorite).filter(Favorite.user_id == user_id)\
+                  .order_by(Favorite.created_at.desc())
+
+def listing_item_query(session, user_id, kind):
+    return session.query(ListingItem).filter(
+        ListingItem.user_id == user_id,
+        ListingItem.kind == kind
+    ).order_by(ListingItem.sort_at.desc())
+
+def normalize_search_query(query):
+    # Terms are matched case-insensitively and combined with AND, so case,
+    # order and repetition do not change the result
+    return ' '.join(sorted(set(query.lower().split())))
+
+def product_search_query(session, query):
+    base_query = session.query(Product)
+    for term in query.split():
+        base_query = base_query.filter(
+            Product.model.ilike(f'%{term}%') |
+            Product.brand.ilike(f'%{term}%') |
+            Product.name.ilike(f'%{term}%')
+        )
+    return base_query.order_by(Product.brand, Product.model)
+
+def ensure_indexes():
+    # create_all only creates indexes together with new tables, so add
+    # indexes introduced later to databases that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
 # Enhanced Request tracking with metrics
+def profile_key(request_id):
+    return f"profile:{request_id}"
+
+def profile_token_valid():
+    token = request.headers.get('X-Profile-Token')
+    return bool(Config.PROFILE_TOKEN and token and secrets.compare_digest(token, Config.PROFILE_TOKEN))
+
+# Statement timings: totals for the access log on every request, the
+# individual statements only for profiled ones
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get('statement_started'):
+        elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+        g.db_time = g.get('db_time', 0.0) + elapsed
+        g.db_queries = g.get('db_queries', 0) + 1
+        if g.get('profiler') and len(g.sql_timings) < Config.PROFILE_MAX_STATEMENTS:
+            g.sql_timings.append({
+                'statement': statement,
+                'duration_ms': round(elapsed * 1000, 3),
+                'executemany': executemany
+            })
+
+@event.listens_for(Engine, 'handle_error')
+def discard_statement_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('statement_started'):
+        connection.info['statement_started'].pop()
+
+def store_profile(response):
+    profiler = g.pop('profiler')
+    profiler.stop()
+    profile = {
+        'request_id': g.request_id,
+        'method': request.method,
+        'path': request.path,
+        'endpoint': g.request_endpoint,
+        'status': response.status_code,
+        'duration_ms': round((time.time() - g.start_time) * 1000, 3),
+        'sample_interval_ms': profiler.interval * 1000,
+        'samples': profiler.samples,
+        'sql': g.sql_timings,
+        'sql_ms': round(sum(timing['duration_ms'] for timing in g.sql_timings), 3),
+        'folded': profiler.folded()
+    }
+    try:
+        # Client supplied request ids must not overwrite an existing profile
+        if redis_client.set(profile_key(g.request_id), json.dumps(profile), nx=True,
+                            ex=int(Config.PROFILE_TTL.total_seconds())):
+            response.headers['X-Profile-ID'] = g.request_id
+    except redis.RedisError as e:
+        app.logger.warning(f"Failed to store profile: {str(e)}")
+
 @app.before_request
 def before_request():
     g.request_id = request.headers.get('X-Request-ID', str(uuid4()))
     g.start_time = time.time()
     g.request_endpoint = request.endpoint
+    
+    if profile_token_valid() or random.random() < Config.PROFILE_SAMPLE_RATE:
+        g.sql_timings = []
+        g.profiler = SamplingProfiler(interval=Config.PROFILE_INTERVAL).start()
+
+@app.teardown_request
+def stop_profiler(exception=None):
+    # after_request is skipped for unhandled errors; do not leave the
+    # sampler thread running
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.stop()
+
+def compressed(body, encoding, levels):
+    if encoding == 'br':
+        return brotli.compress(body, quality=levels['br'])
+    return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+
+def negotiate_encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def compress_response(response):
+    if response.mimetype not in Config.COMPRESS_MIMETYPES:
+        return
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return
+    body = response.get_data()
+    encoding = negotiate_encoding()
+    if len(body) < Config.COMPRESS_MIN_SIZE or encoding is None:
+        return
+    response.set_data(compressed(body, encoding, Config.COMPRESS_LEVELS))
+    response.headers['Content-Encoding'] = encoding
+
+def cached_response(timeout, per_user=False, version_keys=None):
+    # Caches a view's 200 responses in Redis together with their gzip and
+    # brotli encodings, so hits are served without serializing or
+    # compressing anything. With version_keys(user_id, **view_args) the key
+    # includes the data versions, so changes are never served stale.
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            rejected = []
+            
+            def render():
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    rejected.append(response)
+                    return None
+                body = response.get_data()
+                entry = {'mimetype': response.mimetype, 'identity': body}
+                if len(body) >= Config.COMPRESS_MIN_SIZE:
+                    for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+                        entry[encoding] = compressed(body, encoding, Config.COMPRESS_CACHED_LEVELS)
+                return entry
+            
+            try:
+                key = f"response:{request.path}"
+                if per_user:
+                    key += f":{get_jwt_identity()}"
+                if version_keys:
+                    versions = get_versions(version_keys(get_jwt_identity(), **kwargs))
+                    key += f":{sha1(str(versions).encode()).hexdigest()}"
+                entry = single_flight(key, render, timeout=timeout)
+            except redis.RedisError as e:
+                app.logger.warning(f"Response cache unavailable: {str(e)}")
+                entry = render()
+            if entry is None:
+                return rejected[-1]
+            
+            encoding = negotiate_encoding()
+            if encoding not in entry:
+                encoding = 'identity'
+            response = Response(entry[encoding], mimetype=entry['mimetype'])
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
 
 @app.after_request
 def after_request(response):
+    compress_response(response)
+    
     # Add security headers
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -524,6 +2674,9 @@ def after_request(response):
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     response.headers['X-Request-ID'] = g.request_id
     
+    if g.get('profiler'):
+        store_profile(response)
+    
     # Add metrics
     if hasattr(g, 'request_endpoint'):
         REQUEST_COUNT.labels(
@@ -538,11 +2691,38 @@ def after_request(response):
                 endpoint=g.request_endpoint or 'unknown'
             ).observe(time.time() - g.start_time)
     
+    log_access(response)
     return response
 
+def request_user_id():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # No token was verified for this request
+        return None
+
+def log_access(response):
+    if not hasattr(g, 'start_time'):
+        return
+    access_logger.info(app.json.dumps({
+        'time': datetime.now(UTC).isoformat(timespec='milliseconds'),
+        'request_id': g.request_id,
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round((time.time() - g.start_time) * 1000, 3),
+        'db_ms': round(g.get('db_time', 0.0) * 1000, 3),
+        'db_queries': g.get('db_queries', 0),
+        'cache_hits': g.get('cache_hits', 0),
+        'cache_misses': g.get('cache_misses', 0),
+        'bytes': response.content_length,
+        'user_id': request_user_id()
+    }))
+
 # Basic routes with enhanced security and caching
 @app.route('/')
-@cache.cached(timeout=3600)
+@cached_response(timeout=3600)
 def index():
     return jsonify({
         'message': 'Welcome to Sneaker Collector API',
@@ -550,41 +2730,367 @@ def index():
         'endpoints': '/api/v1',
     })
 
+class HealthMonitor:
+    # Probes the databases (the primary and each shard), their connection
+    # pools and Redis from a background thread; health endpoints only read
+    # the last result, so probe traffic does not grow with load balancer
+    # polling and never waits on a slow dependency
+    def __init__(self, interval):
+        self.interval = interval
+        self.result = None
+        self.thread = None
+
+    def timed(self, probe, *args):
+        started = time.perf_counter()
+        try:
+            probe(*args)
+        except Exception as e:
+            return {'status': 'unhealthy', 'latency_ms': round((time.perf_counter() - started) * 1000, 2), 'error': str(e)}
+        return {'status': 'healthy', 'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+    def pool_status(self, db_engine):
+        pool = db_engine.pool
+        if not hasattr(pool, 'checkedout'):
+            return {'status': 'healthy'}
+        capacity = pool.size() + max(Config.DB_MAX_OVERFLOW, 0)
+        in_use = pool.checkedout()
+        saturation = in_use / capacity if capacity else 0
+        return {
+            'status': 'saturated' if saturation >= Config.HEALTH_POOL_SATURATION else 'healthy',
+            'in_use': in_use,
+            'capacity': capacity,
+            'saturation': round(saturation, 2)
+        }
+
+    def check_database(self, db_engine):
+        with db_engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+    def probe(self):
+        # The primary is reported as database/pool, shards as shard_<n> and
+        # shard_<n>_pool
+        databases = [('database', 'pool', engine)] + [
+            (f"shard_{shard}", f"shard_{shard}_pool", shard_engine)
+            for shard, shard_engine in enumerate(shard_engines)
+        ]
+        services = {}
+        for name, pool_name, db_engine in databases:
+            services[pool_name] = self.pool_status(db_engine)
+            if services[pool_name]['status'] == 'saturated':
+                # Waiting for a connection would only add to the queue
+                services[name] = {'status': 'unknown', 'error': 'connection pool saturated'}
+            else:
+                services[name] = self.timed(self.check_database, db_engine)
+        services['redis'] = self.timed(redis_client.ping)
+        healthy = all(service['status'] == 'healthy' for service in services.values())
+        self.result = {
+            'status': 'healthy' if healthy else 'unhealthy',
+            'checked_at': time.time(),
+            'services': services
+        }
+        return self.result
+
+    def current(self):
+        result = self.result or self.probe()
+        age = time.time() - result['checked_at']
+        status = result['status']
+        if age > self.interval * 3:
+            # The probe thread is stuck or dead, so the result says nothing
+            status = 'unhealthy'
+        # services keeps the original {name: status} shape for existing
+        # consumers; latency, errors and pool usage are under details
+        return {
+            'status': status,
+            'timestamp': datetime.now(UTC).isoformat(),
+            'version': '2.0.0',
+            'checked_at': datetime.fromtimestamp(result['checked_at'], UTC).isoformat(),
+            'services': {name: service['status'] for name, service in result['services'].items()},
+            'details': result['services']
+        }
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe()
+            except Exception as e:
+                app.logger.error(f"Health probe failed: {str(e)}")
+
+    def start(self):
+        self.probe()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='health-monitor', daemon=True)
+            self.thread.start()
+
+health_monitor = HealthMonitor(Config.HEALTH_CHECK_INTERVAL)
+
 @app.route('/health')
 def health_check():
-    status = {
-        'status': 'healthy',
-        'timestamp': datetime.now(UTC).isoformat(),
-        'version': '2.0.0',
-        'services': {}
-    }
-    
-    # Check database
-    try:
-        with get_db_session() as session:
-            session.execute(text('SELECT 1'))
-        status['services']['database'] = 'healthy'
-    except Exception as e:
-        app.logger.error(f"Database health check failed: {e}")
-        status['services']['database'] = 'unhealthy'
-        status['status'] = 'unhealthy'
+    status = health_monitor.current()
+    return jsonify(status), 200 if status['status'] == 'healthy' else 500
 
-    # Check Redis
-    try:
-        redis_client.ping()
-        status['services']['redis'] = 'healthy'
-    except Exception as e:
-        app.logger.error(f"Redis health check failed: {e}")
-        status['services']['redis'] = 'unhealthy'
-        status['status'] = 'unhealthy'
+@app.route('/health/live')
+def liveness():
+    # The process is up and serving requests; dependencies are not checked
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/health/ready')
+def readiness():
+    status = health_monitor.current()
+    return jsonify(status), 200 if status['status'] == 'healthy' else 503
+
+@api_v1.route('/profiles/<request_id>', methods=['GET'])
+def get_profile_artifact(request_id):
+    if not profile_token_valid():
+        return jsonify({
+            'status': 'error',
+            'message': 'Profile not found'
+        }), 404
     
-    return jsonify(status), 200 if status['status'] == 'healthy' else 500
+    profile = redis_client.get(profile_key(request_id))
+    if profile is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Profile not found'
+        }), 404
+    
+    profile = json.loads(profile)
+    if request.args.get('format') == 'folded':
+        # Input for flamegraph.pl / speedscope
+        return Response(profile['folded'], mimetype='text/plain')
+    return jsonify({'status': 'success', 'profile': profile}), 200
 
 @app.route('/metrics')
 def metrics():
     from prometheus_client import generate_latest
     return generate_latest()
 
+# Login throttling state lives in Redis so failed attempts cost no database
+# writes; only the final lockout is persisted on the user row
+LOGIN_FAILURE_SCRIPT = redis_client.register_script("""
+local counts = {}
+for i, key in ipairs(KEYS) do
+    counts[i] = redis.call('incr', key)
+    if counts[i] == 1 then
+        redis.call('expire', key, ARGV[1])
+    end
+end
+return counts
+""")
+
+# Removes hash fields that still hold the given values (ARGV: field, value,
+# ...), so entries updated since they were read are kept
+DELETE_HASH_FIELDS_SCRIPT = redis_client.register_script("""
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('hget', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        deleted = deleted + redis.call('hdel', KEYS[1], ARGV[i])
+    end
+end
+return deleted
+""")
+
+PENDING_LAST_LOGIN_KEY = 'login:last_login:pending'
+
+def failed_login_user_key(username):
+    return f"login:failed:user:{username.lower()}"
+
+def failed_login_ip_key():
+    return f"login:failed:ip:{request.remote_addr}"
+
+def login_blocked_for_ip():
+    try:
+        count = redis_client.get(failed_login_ip_key())
+    except redis.RedisError as e:
+        app.logger.warning(f"Login throttling unavailable: {str(e)}")
+        return False
+    return count is not None and int(count) >= Config.LOGIN_MAX_ATTEMPTS_PER_IP
+
+def record_failed_login(username):
+    # Returns the failed attempt count for the username within the window
+    try:
+        user_count, _ = LOGIN_FAILURE_SCRIPT(
+            keys=[failed_login_user_key(username), failed_login_ip_key()],
+            args=[int(Config.LOGIN_ATTEMPT_WINDOW.total_seconds())]
+        )
+        return user_count
+    except redis.RedisError as e:
+        app.logger.warning(f"Login throttling unavailable: {str(e)}")
+        return 0
+
+def record_login(user):
+    # Clears the failed attempts and queues last_login; queued timestamps are
+    # written in one batch by the flush_last_logins job
+    now = datetime.now(UTC)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(failed_login_user_key(user.username))
+        pipe.hset(PENDING_LAST_LOGIN_KEY, str(user.id), now.isoformat())
+        pipe.execute()
+    except redis.RedisError as e:
+        app.logger.warning(f"Failed to queue last login, writing it inline: {str(e)}")
+        user.last_login = now
+
+@job_queue.job('flush_last_logins')
+def flush_last_logins():
+    # Queued entries are only removed once written, so a failed run leaves
+    # them for the next one
+    pending = redis_client.hgetall(PENDING_LAST_LOGIN_KEY)
+    if not pending:
+        return
+    with get_db_session() as session:
+        # Users deleted since logging in are skipped; the ORM bulk update
+        # fails the whole batch on a missing row
+        existing = set(session.scalars(select(User.id).where(User.id.in_([int(user_id) for user_id in pending]))))
+        logins = [
+            {'id': int(user_id), 'last_login': datetime.fromisoformat(moment.decode())}
+            for user_id, moment in pending.items() if int(user_id) in existing
+        ]
+        if logins:
+            session.execute(update(User), logins)
+    DELETE_HASH_FIELDS_SCRIPT(
+        keys=[PENDING_LAST_LOGIN_KEY],
+        args=[item for user_id, moment in pending.items() for item in (user_id, moment)]
+    )
+    app.logger.info(f"Recorded last login for {len(logins)} users")
+
+job_queue.schedule('flush_last_logins', every=Config.LAST_LOGIN_FLUSH_INTERVAL)
+
+# Sets the bits (ARGV) of new values in a filter that is built or being built
+# (KEYS: bitmap, built marker, build lock). Into a missing or evicted filter
+# they would only start a bitmap that a later build has to fill anyway.
+ADD_TO_FILTER_SCRIPT = redis_client.register_script("""
+local built = redis.call('exists', KEYS[1]) == 1 and redis.call('exists', KEYS[2]) == 1
+if not built and redis.call('exists', KEYS[3]) == 0 then
+    return 0
+end
+for _, position in ipairs(ARGV) do
+    redis.call('setbit', KEYS[1], position, 1)
+end
+return 1
+""")
+
+class AvailabilityFilter:
+    # Bloom filter of taken usernames and emails kept in a Redis bitmap. A
+    # clear bit means the value is definitely free; otherwise it may be taken
+    # (false positives, deleted users) and must be confirmed against the
+    # unique index. Bits are only ever set, never cleared. The filter is
+    # trusted only while the marker written by build() exists next to the
+    # bitmap, so after a Redis flush or eviction every value is checked in
+    # the database until it has been rebuilt.
+    def __init__(self, key, size, hashes):
+        self.key = key
+        self.built_key = f"{key}:built"
+        self.lock_key = f"lock:{key}"
+        self.size = size
+        self.hashes = hashes
+
+    def positions(self, field, value):
+        digest = sha1(f"{field}:{value}".encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, values):
+        # Also while a build runs: its database scan may have started before
+        # these values were committed
+        positions = [position for field, value in values for position in self.positions(field, value)]
+        ADD_TO_FILTER_SCRIPT(keys=[self.key, self.built_key, self.lock_key], args=positions)
+
+    def might_contain(self, field, value):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.exists(self.key, self.built_key)
+            for position in self.positions(field, value):
+                pipe.getbit(self.key, position)
+            exists, *bits = pipe.execute()
+        except redis.RedisError as e:
+            app.logger.warning(f"Availability filter unavailable: {str(e)}")
+            return True
+        if exists < 2:
+            # Not built (yet): every value has to be checked in the database
+            self.schedule_build()
+            return True
+        return all(bits)
+
+    def schedule_build(self):
+        try:
+            job_queue.enqueue('build_availability_filter', dedup_key='build_availability_filter')
+        except JobQueueError as e:
+            app.logger.warning(str(e))
+
+    def build(self):
+        # Built locally and OR-ed into the live bitmap, so values added by
+        # concurrent registrations are never lost
+        bitmap = bytearray(self.size // 8 + 1)
+        with get_db_session() as session:
+            for username, email in session.query(User.username, User.email).yield_per(10000):
+                for field, value in (('username', username), ('email', email)):
+                    for position in self.positions(field, value):
+                        bitmap[position >> 3] |= 0x80 >> (position & 7)
+        building_key = f"{self.key}:building:{uuid4().hex}"
+        pipe = redis_client.pipeline()
+        pipe.set(building_key, bytes(bitmap), ex=300)
+        pipe.bitop('OR', self.key, self.key, building_key)
+        pipe.delete(building_key)
+        pipe.set(self.built_key, 1)
+        pipe.execute()
+
+    def ensure(self):
+        # Builds the filter unless it is built or another process is building it
+        if redis_client.exists(self.key, self.built_key) == 2:
+            return
+        token = uuid4().hex
+        if redis_client.set(self.lock_key, token, nx=True, ex=300):
+            try:
+                self.build()
+                app.logger.info("Built username/email availability filter")
+            finally:
+                RELEASE_LOCK_SCRIPT(keys=[self.lock_key], args=[token])
+
+availability_filter = AvailabilityFilter(
+    'users:taken', Config.AVAILABILITY_FILTER_BITS, Config.AVAILABILITY_FILTER_HASHES
+)
+
+@job_queue.job('build_availability_filter')
+def build_availability_filter():
+    availability_filter.ensure()
+
+@event.listens_for(Session, 'after_flush')
+def track_taken_names(session, flush_context):
+    taken = session.info.setdefault('taken_names', set())
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            taken.update((('username', obj.username), ('email', obj.email)))
+
+@event.listens_for(Session, 'after_commit')
+def publish_taken_names(session):
+    taken = session.info.pop('taken_names', None)
+    if not taken:
+        return
+    try:
+        availability_filter.add(taken)
+    except redis.RedisError as e:
+        app.logger.error(f"Failed to update availability filter: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_taken_names(session):
+    session.info.pop('taken_names', None)
+
+def name_taken(session, field, value):
+    # Definite "no" from the filter, otherwise one lookup on the unique index
+    if not availability_filter.might_contain(field, value):
+        return False
+    column = User.username if field == 'username' else User.email
+    return session.query(User.id).filter(column == value).first() is not None
+
+def duplicate_user_field(error):
+    # Which unique index a failed users insert violated (SQLite and Postgres
+    # messages); usernames cannot contain the punctuation matched here
+    if re.search(r'idx_user_email|users\.email|\(email\)', str(error.orig)):
+        return 'email'
+    return 'username'
+
 #Login with Google
 @api_v1.route('/auth/google', methods=['POST'])
 @limiter.limit("5 per minute")
@@ -629,8 +3135,7 @@ def google_auth():
             access_token = create_access_token(identity=str(user.id))
             refresh_token = create_refresh_token(identity=str(user.id))
             
-            # Update last login
-            user.last_login = datetime.now(UTC)
+            record_login(user)
             session.commit()
             
             return jsonify({
@@ -664,6 +3169,13 @@ def login():
     except ValidationError as err:
         return jsonify({"status": "error", "message": "Validation error", "errors": err.messages}), 400
     
+    if login_blocked_for_ip():
+        app.logger.warning(f"Login blocked for too many failed attempts from {request.remote_addr}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Too many failed login attempts. Please try again later.'
+        }), 429
+    
     with get_db_session() as session:
         user = session.query(User).filter_by(username=data['username']).first()
         
@@ -674,9 +3186,7 @@ def login():
                     'message': 'Account is deactivated'
                 }), 401
 
-            # Reset failed login attempts
-            user.failed_login_attempts = 0
-            user.last_login = datetime.now(UTC)
+            record_login(user)
             
             # Generate tokens
             access_token = create_access_token(identity=str(user.id))
@@ -695,11 +3205,11 @@ def login():
             }), 200
         
         # Handle failed login
-        if user:
-            user.failed_login_attempts += 1
-            if user.failed_login_attempts >= 5:
-                user.is_active = False
-                app.logger.warning(f"Account locked due to too many failed attempts: {user.username}")
+        failed_attempts = record_failed_login(data['username'])
+        if user and user.is_active and failed_attempts >= Config.LOGIN_MAX_ATTEMPTS:
+            user.failed_login_attempts = failed_attempts
+            user.is_active = False
+            app.logger.warning(f"Account locked due to too many failed attempts: {user.username}")
         
         app.logger.warning(f"Failed login attempt for username: {data['username']}")
         return jsonify({
@@ -745,6 +3255,15 @@ def register():
                 'user': new_user.to_dict()
             }), 201
             
+        except IntegrityError as e:
+            session.rollback()
+            field = duplicate_user_field(e)
+            return jsonify({
+                "status": "error",
+                "message": "Validation error",
+                "errors": {field: [f"{field.capitalize()} already exists"]}
+            }), 400
+            
         except SQLAlchemyError as e:
             session.rollback()
             app.logger.error(f"Database error during registration: {str(e)}")
@@ -753,6 +3272,36 @@ def register():
                 'message': 'Registration failed due to database error'
             }), 500
 
+@api_v1.route('/availability', methods=['GET'])
+@limiter.limit("30 per minute")
+def check_availability():
+    try:
+        schema = RegisterSchema(only=('username', 'email'), partial=True)
+        data = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"status": "error", "message": "Validation error", "errors": err.messages}), 400
+    
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'username or email is required'
+        }), 400
+    
+    try:
+        with get_db_session() as session:
+            result = {
+                field: {'value': value, 'available': not name_taken(session, field, value)}
+                for field, value in data.items()
+            }
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error checking availability: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to check availability'
+        }), 500
+    
+    return jsonify({'status': 'success', **result}), 200
+
 @api_v1.route('/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh():
@@ -794,26 +3343,33 @@ def get_profile():
         }), 200
 
 @api_v1.route('/collection', methods=['GET', 'POST', 'DELETE'])
+@limiter.limit(Config.READ_RATE_LIMIT)
 @jwt_required()
+@conditional_get(lambda user_id: [user_version_key(user_id), CATALOG_VERSION_KEY])
 def manage_collection():
     user_id = int(get_jwt_identity())
     
-    with get_db_session() as session:
+    with get_db_session(user_id=user_id) as session:
         if request.method == 'GET':
             try:
                 page = request.args.get('page', 1, type=int)
                 per_page = min(request.args.get('per_page', 20, type=int), 100)
                 
-                query = session.query(Collection).filter_by(user_id=user_id)
-                total = query.count()
-                collections = query.order_by(Collection.updated_at.desc())\
+                if app.config['LISTING_READ_MODEL']:
+                    query = listing_item_query(session, user_id, 'collection')
+                    serializer = LISTED_COLLECTION_ITEM_SERIALIZER
+                else:
+                    query = collection_listing_query(session, user_id)
+                    serializer = COLLECTION_ITEM_SERIALIZER
+                total = query.order_by(None).count()
+                collections = serializer.select(query)\
                                  .offset((page - 1) * per_page)\
                                  .limit(per_page)\
                                  .all()
                 
                 return jsonify({
                     'status': 'success',
-                    'items': [item.to_dict() for item in collections],
+                    'items': serializer(collections),
                     'total': total,
                     'page': page,
                     'pages': (total + per_page - 1) // per_page
@@ -933,27 +3489,34 @@ def manage_collection():
                 }), 500
 
 @api_v1.route('/favorites', methods=['GET', 'POST', 'DELETE'])
+@limiter.limit(Config.READ_RATE_LIMIT)
 @jwt_required()
+@conditional_get(lambda user_id: [user_version_key(user_id), CATALOG_VERSION_KEY])
 def manage_favorites():
     user_id = get_jwt_identity()
     app.logger.info(f"Favorites request - Method: {request.method}, User ID: {user_id}")
     
     try:
-        with get_db_session() as session:
+        with get_db_session(user_id=user_id) as session:
             if request.method == 'GET':
                 page = request.args.get('page', 1, type=int)
                 per_page = min(request.args.get('per_page', 20, type=int), 100)
                 
-                query = session.query(Favorite).filter_by(user_id=user_id)
-                total = query.count()
-                favorites = query.order_by(Favorite.created_at.desc())\
+                if app.config['LISTING_READ_MODEL']:
+                    query = listing_item_query(session, int(user_id), 'favorite')
+                    serializer = LISTED_FAVORITE_ITEM_SERIALIZER
+                else:
+                    query = favorites_listing_query(session, user_id)
+                    serializer = FAVORITE_ITEM_SERIALIZER
+                total = query.order_by(None).count()
+                favorites = serializer.select(query)\
                                 .offset((page - 1) * per_page)\
                                 .limit(per_page)\
                                 .all()
                 
                 return jsonify({
                     'status': 'success',
-                    'items': [item.to_dict() for item in favorites],
+                    'items': serializer(favorites),
                     'total': total,
                     'page': page,
                     'pages': (total + per_page - 1) // per_page
@@ -1054,6 +3617,9 @@ def manage_favorites():
             'status': 'error',
             'message': 'Database error occurred'
         }), 500
+    except ApiException:
+        # e.g. 503 while the user's data moves between shards
+        raise
     except Exception as e:
         app.logger.error(f"Unexpected error in favorites: {str(e)}")
         return jsonify({
@@ -1062,8 +3628,9 @@ def manage_favorites():
         }), 500
 
 @api_v1.route('/search', methods=['GET'])
+@limiter.limit(Config.READ_RATE_LIMIT)
 @jwt_required()
-# @cache.memoize(300)
+@conditional_get(lambda user_id: [user_version_key(user_id), CATALOG_VERSION_KEY])
 def search_products():
     user_id = get_jwt_identity()
     query = request.args.get('query', '').strip()
@@ -1072,49 +3639,532 @@ def search_products():
     
     app.logger.info(f"Search request - Query: '{query}', Page: {page}, Per page: {per_page}")
     
-    with get_db_session() as session:
+    normalized = normalize_search_query(query)
+    if page == 1 and per_page == 20:
+        track_popularity(POPULAR_SEARCHES_KEY, [normalized])
+    
+    try:
+        result = search_result(normalized, page, per_page)
+        
+        total = result['total']
+        app.logger.info(f"Found {total} matching products")
+        
+        with get_db_session(user_id=user_id) as session:
+            products = get_product_documents(session, result['ids'])
+            items = [products[product_id] for product_id in result['ids'] if product_id in products]
+            app.logger.info(f"Returning {len(items)} products")
+            
+            return jsonify({
+                'status': 'success',
+                'items': overlay_membership(session, user_id, items),
+                'total': total,
+                'page': page,
+                'pages': (total + per_page - 1) // per_page
+            }), 200
+        
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error in search: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to search products'
+        }), 500
+
+@api_v1.route('/search/suggest', methods=['GET'])
+@jwt_required()
+def suggest_products():
+    query = request.args.get('query', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 20)
+    
+    return jsonify({
+        'status': 'success',
+        'items': suggester.suggest(query, limit)
+    }), 200
+
+@api_v1.route('/products', methods=['GET'])
+@jwt_required()
+def get_products():
+    user_id = get_jwt_identity()
+    
+    try:
+        product_ids = [int(product_id) for product_id in request.args.get('ids', '').split(',') if product_id]
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid product ID format'
+        }), 400
+    
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return jsonify({
+            'status': 'error',
+            'message': 'Product IDs are required'
+        }), 400
+    if len(product_ids) > Config.MAX_BATCH_PRODUCTS:
+        return jsonify({
+            'status': 'error',
+            'message': f'At most {Config.MAX_BATCH_PRODUCTS} products can be requested at once'
+        }), 400
+    
+    with get_db_session(user_id=user_id) as session:
         try:
-            base_query = session.query(Product)
+            documents = get_product_documents(session, product_ids)
+            items = [documents[product_id] for product_id in product_ids if product_id in documents]
             
-            if query:
-                search_terms = query.split()
-                search_filters = []
-                
-                for term in search_terms:
-                    term_filter = (
-                        Product.model.ilike(f'%{term}%') |
-                        Product.brand.ilike(f'%{term}%') |
-                        Product.name.ilike(f'%{term}%')
-                    )
-                    search_filters.append(term_filter)
-                
-                if search_filters:
-                    base_query = base_query.filter(*search_filters)
+            return jsonify({
+                'status': 'success',
+                'items': overlay_membership(session, user_id, items),
+                'missing': [product_id for product_id in product_ids if product_id not in documents]
+            }), 200
+            
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_products: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to retrieve products'
+            }), 500
+
+@api_v1.route('/products/trending', methods=['GET'])
+@limiter.limit(Config.READ_RATE_LIMIT)
+@jwt_required()
+def get_trending_products():
+    user_id = get_jwt_identity()
+    kind = request.args.get('kind', 'all')
+    if kind != 'all' and kind not in TRENDING_KINDS.values():
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid trending kind'
+        }), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), Config.MAX_TRENDING_PRODUCTS))
+    
+    try:
+        ranked = redis_client.zrevrange(trending_key(kind), 0, limit - 1)
+    except redis.RedisError as e:
+        app.logger.error(f"Redis error in get_trending_products: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Trending products are unavailable'
+        }), 503
+    product_ids = [int(product_id) for product_id in ranked]
+    
+    with get_db_session(user_id=user_id) as session:
+        try:
+            documents = get_product_documents(session, product_ids)
+            items = [documents[product_id] for product_id in product_ids if product_id in documents]
+            
+            return jsonify({
+                'status': 'success',
+                'kind': kind,
+                'items': overlay_membership(session, user_id, items)
+            }), 200
+            
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_trending_products: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to retrieve trending products'
+            }), 500
+
+@api_v1.route('/products/<int:product_id>/similar', methods=['GET'])
+@limiter.limit(Config.READ_RATE_LIMIT)
+@jwt_required()
+def get_similar_products(product_id):
+    user_id = get_jwt_identity()
+    limit = max(1, min(request.args.get('limit', 10, type=int), Config.SIMILAR_TOP_K))
+    
+    try:
+        neighbours = similar_products([product_id]).get(product_id, [])[:limit]
+    except redis.RedisError as e:
+        app.logger.error(f"Redis error in get_similar_products: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Similar products are unavailable'
+        }), 503
+    
+    with get_db_session(user_id=user_id) as session:
+        try:
+            product_ids = [neighbour_id for neighbour_id, _ in neighbours]
+            documents = get_product_documents(session, product_ids)
+            items = [documents[neighbour_id] for neighbour_id in product_ids if neighbour_id in documents]
+            
+            return jsonify({
+                'status': 'success',
+                'product_id': product_id,
+                'items': overlay_membership(session, user_id, items)
+            }), 200
             
-            total = base_query.count()
-            app.logger.info(f"Found {total} matching products")
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_similar_products: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to retrieve similar products'
+            }), 500
+
+@api_v1.route('/recommendations', methods=['GET'])
+@limiter.limit(Config.READ_RATE_LIMIT)
+@jwt_required()
+def get_recommendations():
+    user_id = get_jwt_identity()
+    limit = max(1, min(request.args.get('limit', 20, type=int), Config.MAX_TRENDING_PRODUCTS))
+    
+    with get_db_session(user_id=user_id) as session:
+        try:
+            try:
+                product_ids = recommended_products(session, user_id, limit)
+                source = 'similar'
+                if not product_ids:
+                    # Nothing to go on yet, fall back to what is popular
+                    product_ids = [int(product_id) for product_id in redis_client.zrevrange(trending_key('all'), 0, limit - 1)]
+                    source = 'trending'
+            except redis.RedisError as e:
+                app.logger.error(f"Redis error in get_recommendations: {str(e)}")
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Recommendations are unavailable'
+                }), 503
             
-            products = base_query.order_by(Product.brand, Product.model).offset((page - 1) * per_page).limit(per_page).all()
-            app.logger.info(f"Returning {len(products)} products")
+            documents = get_product_documents(session, product_ids)
+            items = [documents[product_id] for product_id in product_ids if product_id in documents]
             
             return jsonify({
                 'status': 'success',
-                'items': [product.to_dict(user_id) for product in products],
-                'total': total,
-                'page': page,
-                'pages': (total + per_page - 1) // per_page
+                'source': source,
+                'items': overlay_membership(session, user_id, items)
+            }), 200
+            
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_recommendations: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to retrieve recommendations'
+            }), 500
+
+@api_v1.route('/products/prices', methods=['GET'])
+@jwt_required()
+def get_price_history():
+    try:
+        product_ids = [int(product_id) for product_id in request.args.get('ids', '').split(',') if product_id]
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid product ID format'
+        }), 400
+    
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids or len(product_ids) > Config.MAX_BATCH_PRODUCTS:
+        return jsonify({
+            'status': 'error',
+            'message': f'Between 1 and {Config.MAX_BATCH_PRODUCTS} product IDs are required'
+        }), 400
+    
+    period, start, end = price_history_window()
+    
+    with get_db_session() as session:
+        try:
+            series = price_series(session, product_ids, period, start, end)
+            return jsonify({
+                'status': 'success',
+                'period': period,
+                'series': {str(product_id): points for product_id, points in series.items()}
+            }), 200
+            
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_price_history: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to retrieve price history'
+            }), 500
+
+def export_rows(serializer, query, export_format):
+    # Yields the export in chunks of about 64 KB; rows are fetched in batches
+    # of EXPORT_BATCH_SIZE so memory does not grow with the collection. The
+    # status is already sent when a query fails midway, so the last line
+    # reports the outcome and row count instead:
+    #   csv:    #export,complete,<rows>   (or #export,error,<rows>)
+    #   ndjson: {"export": "complete", "rows": <rows>}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(serializer.keys)
+    rows = 0
+    status = 'complete'
+    try:
+        for row in serializer.select(query).yield_per(Config.EXPORT_BATCH_SIZE):
+            if export_format == 'csv':
+                writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+            else:
+                buffer.write(app.json.dumps(dict(zip(serializer.keys, row))))
+                buffer.write('\n')
+            rows += 1
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error in export after {rows} rows: {str(e)}")
+        status = 'error'
+    
+    if export_format == 'csv':
+        writer.writerow(['#export', status, rows])
+    else:
+        buffer.write(app.json.dumps({'export': status, 'rows': rows}))
+        buffer.write('\n')
+    yield buffer.getvalue()
+
+@api_v1.route('/collection/export', methods=['GET'])
+@limiter.limit("10 per hour")
+@jwt_required()
+def export_collection():
+    user_id = int(get_jwt_identity())
+    export_format = request.args.get('format', 'csv')
+    if export_format not in Config.EXPORT_FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f"format must be one of: {', '.join(Config.EXPORT_FORMATS)}"
+        }), 400
+    
+    session_options = shard_session_options(user_id)
+    
+    def generate():
+        # Read-only and already streaming, so no commit or retry as in
+        # get_db_session; a failure is reported in the export's last line
+        session = Session(**session_options)
+        try:
+            query = collection_listing_query(session, user_id)
+            yield from export_rows(COLLECTION_ITEM_SERIALIZER, query, export_format)
+        finally:
+            session.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=Config.EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename=collection.{export_format}',
+            'Cache-Control': 'no-store'
+        }
+    )
+
+@api_v1.route('/collection/valuation', methods=['GET'])
+@jwt_required()
+def get_collection_valuation():
+    user_id = int(get_jwt_identity())
+    period, start, end = price_history_window()
+    
+    with get_db_session(user_id=user_id) as session:
+        try:
+            return jsonify({
+                'status': 'success',
+                'period': period,
+                'series': collection_valuation(session, user_id, period, start, end)
             }), 200
             
         except SQLAlchemyError as e:
-            app.logger.error(f"Database error in search: {str(e)}")
+            app.logger.error(f"Database error in get_collection_valuation: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to compute collection valuation'
+            }), 500
+
+# Image proxy. Product images are fetched from their origin once, resized to
+# the fixed THUMBNAIL_SIZES and kept in a local content-addressed disk cache.
+# Thumbnail URLs include a hash of the source URL, so they can be cached by
+# clients and CDNs for good and change whenever the image does.
+image_cache = ImageCache(Config.IMAGE_CACHE_DIR, Config.IMAGE_CACHE_MAX_BYTES)
+# Concurrent misses for the same image wait for one fetch per process
+thumbnail_locks = [threading.Lock() for _ in range(64)]
+
+class ThumbnailError(Exception):
+    pass
+
+def image_version(image_url):
+    return sha1(image_url.encode()).hexdigest()[:12]
+
+def thumbnail_urls(product_id, image_url):
+    if not image_url:
+        return None
+    version = image_version(image_url)
+    return {size: f"{api_v1.url_prefix}/products/{product_id}/thumbnail/{size}?v={version}"
+            for size in Config.THUMBNAIL_SIZES}
+
+def thumbnail_failed_key(image_url):
+    return f"thumbnail:failed:{image_version(image_url)}"
+
+def check_image_origin(image_url):
+    # The endpoint is public, so image URLs must not reach internal services:
+    # every address the host resolves to has to be a public one. Returns the
+    # address to connect to, or None for trusted hosts.
+    parts = urlsplit(image_url)
+    if parts.scheme not in Config.IMAGE_ORIGIN_SCHEMES or not parts.hostname:
+        raise ThumbnailError(f"Unsupported image URL: {image_url}")
+    if parts.hostname in Config.IMAGE_TRUSTED_HOSTS:
+        return None
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443, type=socket.SOCK_STREAM)]
+    except (OSError, UnicodeError, ValueError) as e:
+        raise ThumbnailError(f"Failed to resolve {parts.hostname}: {e}") from e
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise ThumbnailError(f"Image host {parts.hostname} resolves to non-public address {ip}")
+    return addresses[0]
+
+def pinned_connection(connection_class, address):
+    # Connects to the address that was checked rather than resolving the host
+    # again, which DNS could answer differently the second time; the Host
+    # header and TLS (SNI, certificate) still use the host name
+    def connect(host, **kwargs):
+        connection = connection_class(host, **kwargs)
+        if address is not None:
+            connection._create_connection = lambda target, *args: socket.create_connection((address, target[1]), *args)
+        return connection
+    return connect
+
+class ImageHTTPHandler(urllib.request.HTTPHandler):
+    # Every request is checked when its connection opens, so each redirect
+    # hop is checked like the original URL
+    def http_open(self, req):
+        return self.do_open(pinned_connection(http.client.HTTPConnection, check_image_origin(req.full_url)), req)
+
+class ImageHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(pinned_connection(http.client.HTTPSConnection, check_image_origin(req.full_url)), req,
+                            context=self._context)
+
+class ImageRedirectHandler(urllib.request.HTTPRedirectHandler):
+    max_redirections = Config.IMAGE_MAX_REDIRECTS
+
+image_opener = urllib.request.build_opener(ImageHTTPHandler, ImageHTTPSHandler, ImageRedirectHandler)
+
+def fetch_original(image_url):
+    origin_request = urllib.request.Request(image_url, headers={'User-Agent': 'SneakerCollector-ImageProxy/1.0'})
+    try:
+        with image_opener.open(origin_request, timeout=Config.IMAGE_FETCH_TIMEOUT) as response:
+            data = response.read(Config.IMAGE_MAX_ORIGINAL_BYTES + 1)
+    except (OSError, ValueError) as e:
+        raise ThumbnailError(f"Failed to fetch {image_url}: {e}") from e
+    if len(data) > Config.IMAGE_MAX_ORIGINAL_BYTES:
+        raise ThumbnailError(f"Image too large: {image_url}")
+    return data
+
+def render_thumbnails(original):
+    # Returns {size: (bytes, mimetype)}. Each size is scaled down from the next
+    # larger one; images with transparency stay PNG, the rest become JPEG.
+    try:
+        image = Image.open(io.BytesIO(original))
+        if image.width * image.height > Config.IMAGE_MAX_PIXELS:
+            raise ThumbnailError(f"Image too large: {image.width}x{image.height}")
+        largest = max(Config.THUMBNAIL_SIZES.values())
+        image.draft('RGB', (largest, largest))  # JPEGs are decoded at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+        
+        thumbnails = {}
+        for size, edge in sorted(Config.THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            if transparent:
+                image.save(buffer, 'PNG', optimize=True)
+                thumbnails[size] = (buffer.getvalue(), 'image/png')
+            else:
+                image.save(buffer, 'JPEG', quality=Config.THUMBNAIL_QUALITY, optimize=True, progressive=True)
+                thumbnails[size] = (buffer.getvalue(), 'image/jpeg')
+        return thumbnails
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ThumbnailError(f"Unreadable image: {e}") from e
+
+def thumbnail_file(image_url, size):
+    # Returns (digest, path, mimetype) of a cached thumbnail, fetching and
+    # rendering every size of the image on a miss
+    name = f"{size} {image_url}"
+    cached = image_cache.get(name)
+    count_cache_lookups(int(cached is not None), int(cached is None))
+    if cached:
+        return cached
+    
+    with thumbnail_locks[int(image_version(image_url), 16) % len(thumbnail_locks)]:
+        cached = image_cache.get(name)
+        if cached:
+            return cached
+        try:
+            if redis_client.exists(thumbnail_failed_key(image_url)):
+                raise ThumbnailError(f"Recently failed: {image_url}")
+        except redis.RedisError:
+            pass
+        try:
+            thumbnails = render_thumbnails(fetch_original(image_url))
+        except ThumbnailError:
+            try:
+                redis_client.set(thumbnail_failed_key(image_url), 1, ex=Config.IMAGE_FAILURE_TTL)
+            except redis.RedisError:
+                pass
+            raise
+        stored = {}
+        for thumbnail_size, (data, mimetype) in thumbnails.items():
+            stored[thumbnail_size] = image_cache.put(f"{thumbnail_size} {image_url}", data, mimetype)
+        return stored[size]
+
+@api_v1.route('/products/<int:product_id>/thumbnail/<size>', methods=['GET'])
+@limiter.limit(Config.IMAGE_RATE_LIMIT)
+def get_thumbnail(product_id, size):
+    # Public, since image tags cannot send the Authorization header
+    if size not in Config.THUMBNAIL_SIZES:
+        return jsonify({
+            'status': 'error',
+            'message': f"size must be one of: {', '.join(Config.THUMBNAIL_SIZES)}"
+        }), 400
+    if Image is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Thumbnails are unavailable'
+        }), 503
+    
+    with get_db_session() as session:
+        try:
+            # Image requests are not product views, so they do not count for warming
+            document = get_product_documents(session, [product_id], track=False).get(product_id)
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in get_thumbnail: {str(e)}")
             return jsonify({
                 'status': 'error',
-                'message': 'Failed to search products'
+                'message': 'Failed to retrieve product'
             }), 500
+    
+    if not document or not document['image_url']:
+        return jsonify({
+            'status': 'error',
+            'message': 'Product image not found'
+        }), 404
+    image_url = document['image_url']
+    
+    # Links from before an image change lead to the current version
+    if request.args.get('v') != image_version(image_url):
+        return redirect(thumbnail_urls(product_id, image_url)[size])
+    
+    try:
+        digest, path, mimetype = thumbnail_file(image_url, size)
+    except ThumbnailError as e:
+        app.logger.warning(f"Thumbnail unavailable for product {product_id}: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Product image is unavailable'
+        }), 502
+    
+    response = send_file(path, mimetype=mimetype, etag=digest, conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={Config.THUMBNAIL_MAX_AGE}, immutable"
+    return response
 
 @api_v1.route('/products/<int:product_id>', methods=['GET'])
 @jwt_required()
-@cache.memoize(300)
+@conditional_get(
+    lambda user_id, product_id: [user_version_key(user_id), product_version_key(product_id)],
+    cache_control=f"private, max-age={Config.PRODUCT_CACHE_MAX_AGE}, must-revalidate"
+)
+@cached_response(
+    timeout=300, per_user=True,
+    version_keys=lambda user_id, product_id: [user_version_key(user_id), product_version_key(product_id)]
+)
 def get_product(product_id):
     user_id = get_jwt_identity()
     
@@ -1140,6 +4190,96 @@ def get_product(product_id):
                 'message': 'Failed to retrieve product'
             }), 500
 
+@api_v1.route('/sync', methods=['GET'])
+@jwt_required()
+def sync_changes():
+    user_id = int(get_jwt_identity())
+    token = request.args.get('since')
+    started_at = datetime.now(UTC)
+    
+    since = None
+    if token:
+        try:
+            since = decode_sync_token(token)
+        except (ValueError, OverflowError, OSError):
+            return jsonify({
+                'status': 'error',
+                'message': 'Invalid sync token'
+            }), 400
+    
+    # Deletions older than the tombstone retention are gone, so such clients
+    # have to start over from a full listing
+    full_resync = since is None or since < started_at - Config.SYNC_TOMBSTONE_RETENTION
+    
+    with get_db_session(user_id=user_id) as session:
+        if shard_engines and not full_resync:
+            # Entries get new ids when the user moves between shards
+            assignment = session.get(UserShard, user_id)
+            moved_at = assignment.moved_at if assignment else None
+            full_resync = moved_at is not None and moved_at.replace(tzinfo=UTC) > since
+        
+        try:
+            collection_query = session.query(Collection)\
+                .join(Collection.product)\
+                .options(contains_eager(Collection.product))\
+                .filter(Collection.user_id == user_id)
+            favorites_query = session.query(Favorite)\
+                .join(Favorite.product)\
+                .options(contains_eager(Favorite.product))\
+                .filter(Favorite.user_id == user_id)
+            tombstones = []
+            
+            if not full_resync:
+                window_start = since - Config.SYNC_OVERLAP
+                collection_query = collection_query.filter(
+                    (Collection.created_at >= window_start) |
+                    (Collection.updated_at >= window_start) |
+                    (Product.updated_at >= window_start)
+                )
+                favorites_query = favorites_query.filter(
+                    (Favorite.created_at >= window_start) |
+                    (Product.updated_at >= window_start)
+                )
+                tombstones = session.query(SyncTombstone).filter(
+                    SyncTombstone.user_id == user_id,
+                    SyncTombstone.deleted_at >= window_start
+                ).all()
+            
+            collection_items = [item.to_dict() for item in collection_query]
+            favorite_items = [item.to_dict() for item in favorites_query]
+            
+            # An entry deleted and added again within the window is reported
+            # as changed only
+            present = {
+                'collection': {item['product_id'] for item in collection_items},
+                'favorite': {item['product_id'] for item in favorite_items}
+            }
+            deleted = {'collection': set(), 'favorite': set()}
+            for tombstone in tombstones:
+                if tombstone.product_id not in present[tombstone.kind]:
+                    deleted[tombstone.kind].add(tombstone.product_id)
+            
+            return jsonify({
+                'status': 'success',
+                'token': encode_sync_token(started_at),
+                'full_resync': full_resync,
+                'collection': {
+                    'items': collection_items,
+                    'deleted': sorted(deleted['collection'])
+                },
+                'favorites': {
+                    'items': favorite_items,
+                    'deleted': sorted(deleted['favorite'])
+                }
+            }), 200
+            
+        except SQLAlchemyError as e:
+            app.logger.error(f"Database error in sync: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to sync changes'
+            }), 500
+
 # Error Handlers
 @app.errorhandler(Exception)
 def handle_error(error):
@@ -1181,14 +4321,19 @@ def handle_error(error):
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    return jsonify({
+    response = jsonify({
         'status': 'error',
         'message': 'Rate limit exceeded',
         'error': str(e.description)
-    }), 429
+    })
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
 
-def create_app(config_name='default'):
-    # Initialize the application
+def create_app(config_name='default', background_threads=True):
+    # Initialize the application. background_threads=False skips the threads
+    # that only serve requests (typeahead index, health probes, cache
+    # warm-up), e.g. in job workers.
     setup_logging(app)
     
     # Register blueprint
@@ -1196,11 +4341,40 @@ def create_app(config_name='default'):
     
     # Create database tables
     Base.metadata.create_all(engine)
+    ensure_indexes()
+    for shard_engine in shard_engines:
+        shard_metadata.create_all(shard_engine)
+        with shard_engine.connect() as connection:
+            replica_empty = connection.execute(select(Product.id).limit(1)).first() is None
+        if replica_empty:
+            sync_shard_products(shard_engine)
+    if shard_engines:
+        moved = migrate_primary_user_rows()
+        if moved:
+            app.logger.info(f"Moved {moved} rows from the primary database to the shards")
+    
+    # Backfill the listing read model when it is enabled on an existing database
+    if app.config['LISTING_READ_MODEL']:
+        for user_data_engine in shard_engines or [engine]:
+            with user_data_engine.begin() as connection:
+                if connection.execute(select(ListingItem.id).limit(1)).first() is None:
+                    rebuild_listing_items(connection)
+    
+    if background_threads:
+        # Load the typeahead index and keep it in sync with catalog changes
+        suggester.start()
+        
+        # Probe dependencies in the background for the health endpoints
+        health_monitor.start()
+        
+        # Preload popular entries so a deploy does not start with a cold cache
+        start_cache_warmer()
     
     # Create Redis indices if needed
     try:
         redis_client.ping()
-    except redis.ConnectionError:
+        availability_filter.ensure()
+    except redis.RedisError:
         app.logger.warning("Redis connection failed. Rate limiting and caching may not work properly.")
     
     return app
@@ -1,13 +1,24 @@
+import sys
 import requests
 
-def health_check():
-    url = "http://localhost:5001/health"
-    response = requests.get(url)
-    if response.status_code != 200:
-        response_json = response.json()
-        services = response_json["services"]
-        return f"Database: {services["database"]}\nRedis: {services["redis"]}"
-    return "All services are running"
+def health_check(base_url="http://localhost:5001"):
+    response = requests.get(f"{base_url}/health/ready", timeout=5)
+    services = response.json()["details"]
+    lines = []
+    for name, service in services.items():
+        line = f"{name.replace('_', ' ').capitalize()}: {service['status']}"
+        if 'latency_ms' in service:
+            line += f" ({service['latency_ms']} ms)"
+        if 'saturation' in service:
+            line += f" ({service['in_use']}/{service['capacity']} connections in use)"
+        if 'error' in service:
+            line += f" - {service['error']}"
+        lines.append(line)
+    if response.status_code == 200:
+        lines.append("All services are running")
+    return response.status_code == 200, "\n".join(lines)
 
 if __name__ == "__main__":
-    print(health_check())
\ No newline at end of file
+    healthy, report = health_check()
+    print(report)
+    sys.exit(0 if healthy else 1)
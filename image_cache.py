@@ -0,0 +1,101 @@
+import os
+import threading
+from hashlib import sha256
+
+# Content-addressed disk cache for the image proxy. Blobs are stored under the
+# SHA-256 of their content, so identical images fetched from different URLs
+# share one file; names (source URL + size) map to blobs through small ref
+# files. Reads bump a file's mtime, and once the cache grows past max_bytes
+# the least recently used files are removed until it is under low_water.
+
+class ImageCache:
+    def __init__(self, root, max_bytes, low_water=0.9):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        self.size = None  # bytes on disk, counted by the first write
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def ref_path(self, name):
+        key = sha256(name.encode()).hexdigest()
+        return os.path.join(self.root, 'refs', key[:2], key)
+
+    @staticmethod
+    def write(path, data):
+        # Written to a temporary file and renamed, so readers in other
+        # processes never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, name):
+        # Returns (digest, path, metadata) for a name, or None
+        ref_path = self.ref_path(name)
+        try:
+            with open(ref_path) as f:
+                digest, metadata = f.read().split(' ', 1)
+            path = self.blob_path(digest)
+            os.utime(path)
+            os.utime(ref_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return digest, path, metadata
+
+    def put(self, name, data, metadata=''):
+        digest = sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        written = 0
+        if not os.path.exists(path):
+            self.write(path, data)
+            written += len(data)
+        ref = f"{digest} {metadata}".encode()
+        self.write(self.ref_path(name), ref)
+        written += len(ref)
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.usage()
+            else:
+                self.size += written
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+        return digest, path, metadata
+
+    def files(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def usage(self):
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self):
+        # Rescans the disk rather than trusting the running total, since other
+        # worker processes write to the same directory
+        with self.lock:
+            entries = sorted(self.files())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * self.low_water
+            removed = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.size = total
+            return removed
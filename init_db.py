@@ -1,7 +1,7 @@
 from app import create_app, Base, engine
 
 def init_database():
-    app = create_app()
+    app = create_app(background_threads=False)
     with app.app_context():
         Base.metadata.drop_all(engine)
         Base.metadata.create_all(engine)
@@ -0,0 +1,337 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+
+# Small background job queue. Jobs are registered by name, enqueued with JSON
+# arguments and run by worker processes (see worker.py). Backends: Redis for
+# deployments, SQLite as an in-process stand-in for tests and development.
+
+class JobQueueError(Exception):
+    pass
+
+class Job:
+    def __init__(self, name, args=None, kwargs=None, id=None, attempts=0, dedup_key=None):
+        self.id = id or uuid4().hex
+        self.name = name
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self.attempts = attempts
+        self.dedup_key = dedup_key
+
+    def dumps(self):
+        return json.dumps({
+            'id': self.id,
+            'name': self.name,
+            'args': self.args,
+            'kwargs': self.kwargs,
+            'attempts': self.attempts,
+            'dedup_key': self.dedup_key
+        })
+
+    @classmethod
+    def loads(cls, payload):
+        return cls(**json.loads(payload))
+
+class RedisJobBackend:
+    # Due and delayed jobs share one sorted set scored by run time; claimed
+    # jobs move to a processing set scored by their lease expiry
+    PUSH_SCRIPT = """
+    if #KEYS == 3 then
+        local existing = redis.call('get', KEYS[3])
+        if existing then return existing end
+        redis.call('set', KEYS[3], ARGV[1], 'EX', ARGV[4])
+    end
+    redis.call('hset', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('zadd', KEYS[1], ARGV[3], ARGV[1])
+    return ARGV[1]
+    """
+    CLAIM_SCRIPT = """
+    local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+    if #ids == 0 then return nil end
+    redis.call('zrem', KEYS[1], ids[1])
+    redis.call('zadd', KEYS[2], ARGV[2], ids[1])
+    return redis.call('hget', KEYS[3], ids[1])
+    """
+    RECOVER_SCRIPT = """
+    local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1])
+    for _, id in ipairs(ids) do
+        redis.call('zrem', KEYS[1], id)
+        redis.call('zadd', KEYS[2], ARGV[1], id)
+    end
+    return #ids
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, client, prefix='jobs'):
+        self.client = client
+        self.scheduled = f"{prefix}:scheduled"
+        self.processing = f"{prefix}:processing"
+        self.data = f"{prefix}:data"
+        self.failed = f"{prefix}:failed"
+        self.prefix = prefix
+        self.push_script = client.register_script(self.PUSH_SCRIPT)
+        self.claim_script = client.register_script(self.CLAIM_SCRIPT)
+        self.recover_script = client.register_script(self.RECOVER_SCRIPT)
+        self.release_script = client.register_script(self.RELEASE_SCRIPT)
+
+    def dedup_key(self, key):
+        return f"{self.prefix}:dedup:{key}"
+
+    def push(self, job, run_at, dedup_ttl):
+        keys = [self.scheduled, self.data]
+        if job.dedup_key:
+            keys.append(self.dedup_key(job.dedup_key))
+        job_id = self.push_script(keys=keys, args=[job.id, job.dumps(), run_at, dedup_ttl])
+        return job_id.decode() if isinstance(job_id, bytes) else job_id
+
+    def claim(self, now, lease_until):
+        payload = self.claim_script(keys=[self.scheduled, self.processing, self.data], args=[now, lease_until])
+        if payload is None:
+            return None
+        job = Job.loads(payload)
+        if job.dedup_key:
+            # Once started, an identical job may be queued again
+            self.release_script(keys=[self.dedup_key(job.dedup_key)], args=[job.id])
+        return job
+
+    def extend(self, job, lease_until):
+        # XX: a lease that was already recovered is not revived
+        self.client.zadd(self.processing, {job.id: lease_until}, xx=True)
+
+    def ack(self, job):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.processing, job.id)
+        pipe.hdel(self.data, job.id)
+        pipe.execute()
+
+    def retry(self, job, run_at):
+        pipe = self.client.pipeline()
+        pipe.hset(self.data, job.id, job.dumps())
+        pipe.zrem(self.processing, job.id)
+        pipe.zadd(self.scheduled, {job.id: run_at})
+        pipe.execute()
+
+    def bury(self, job, error):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.processing, job.id)
+        pipe.hdel(self.data, job.id)
+        pipe.lpush(self.failed, json.dumps({'job': json.loads(job.dumps()), 'error': error}))
+        pipe.ltrim(self.failed, 0, 999)
+        pipe.execute()
+
+    def recover(self, now):
+        return self.recover_script(keys=[self.processing, self.scheduled], args=[now])
+
+    def once(self, key, ttl):
+        return bool(self.client.set(f"{self.prefix}:once:{key}", 1, nx=True, ex=int(ttl)))
+
+class SQLiteJobBackend:
+    def __init__(self, path=':memory:'):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                run_at REAL NOT NULL,
+                leased_until REAL,
+                dedup_key TEXT UNIQUE,
+                failed INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (failed, leased_until, run_at);
+            CREATE TABLE IF NOT EXISTS job_markers (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def transaction(self, f):
+        # Runs f() in a write transaction, rolled back if f() fails
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = f()
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+            return result
+
+    def push(self, job, run_at, dedup_ttl):
+        def push_job():
+            if job.dedup_key:
+                existing = self.connection.execute(
+                    'SELECT id FROM jobs WHERE dedup_key = ?', (job.dedup_key,)
+                ).fetchone()
+                if existing:
+                    return existing[0]
+            self.connection.execute(
+                'INSERT INTO jobs (id, payload, run_at, dedup_key) VALUES (?, ?, ?, ?)',
+                (job.id, job.dumps(), run_at, job.dedup_key)
+            )
+            return job.id
+        return self.transaction(push_job)
+
+    def claim(self, now, lease_until):
+        def claim_job():
+            row = self.connection.execute(
+                'SELECT id, payload FROM jobs WHERE failed = 0 AND leased_until IS NULL AND run_at <= ? '
+                'ORDER BY run_at LIMIT 1', (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                'UPDATE jobs SET leased_until = ?, dedup_key = NULL WHERE id = ?', (lease_until, row[0])
+            )
+            return Job.loads(row[1])
+        return self.transaction(claim_job)
+
+    def extend(self, job, lease_until):
+        self.execute(
+            'UPDATE jobs SET leased_until = ? WHERE id = ? AND leased_until IS NOT NULL',
+            (lease_until, job.id)
+        )
+
+    def ack(self, job):
+        self.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+
+    def retry(self, job, run_at):
+        self.execute(
+            'UPDATE jobs SET payload = ?, run_at = ?, leased_until = NULL WHERE id = ?',
+            (job.dumps(), run_at, job.id)
+        )
+
+    def bury(self, job, error):
+        self.execute(
+            'UPDATE jobs SET payload = ?, failed = 1, error = ?, leased_until = NULL WHERE id = ?',
+            (job.dumps(), error, job.id)
+        )
+
+    def recover(self, now):
+        with self.lock:
+            return self.connection.execute(
+                'UPDATE jobs SET leased_until = NULL WHERE leased_until < ?', (now,)
+            ).rowcount
+
+    def once(self, key, ttl):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('DELETE FROM job_markers WHERE expires_at < ?', (now,))
+            return self.connection.execute(
+                'INSERT OR IGNORE INTO job_markers (key, expires_at) VALUES (?, ?)', (key, now + ttl)
+            ).rowcount == 1
+
+class JobQueue:
+    # A claimed job is leased for `lease` seconds and renewed every third of
+    # that while it runs, so only jobs of a dead worker are run again
+    def __init__(self, backend=None, logger=None, lease=300, dedup_ttl=3600, max_backoff=30):
+        self.backend = backend
+        self.logger = logger or logging.getLogger(__name__)
+        self.lease = lease
+        self.dedup_ttl = dedup_ttl
+        self.max_backoff = max_backoff
+        self.registry = {}
+        self.periodic = {}
+
+    def job(self, name=None, retries=3, backoff=30):
+        def decorator(f):
+            self.registry[name or f.__name__] = (f, retries, backoff)
+            return f
+        return decorator
+
+    def schedule(self, name, every):
+        self.periodic[name] = every
+
+    def enqueue(self, name, *args, delay=0, dedup_key=None, **kwargs):
+        # With a dedup_key, enqueueing while an identical job is still waiting
+        # returns the waiting job's id instead of adding another one
+        job = Job(name, list(args), kwargs, dedup_key=dedup_key)
+        try:
+            return self.backend.push(job, time.time() + delay, self.dedup_ttl)
+        except Exception as e:
+            raise JobQueueError(f"Failed to enqueue {name}: {e}") from e
+
+    def enqueue_periodic(self, now):
+        for name, every in self.periodic.items():
+            slot = int(now // every)
+            if self.backend.once(f"{name}:{slot}", every * 2):
+                self.enqueue(name)
+
+    def run(self, job):
+        entry = self.registry.get(job.name)
+        if entry is None:
+            self.backend.bury(job, 'unknown job')
+            self.logger.error(f"Unknown job {job.name} ({job.id})")
+            return False
+
+        f, retries, backoff = entry
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self.renew_lease, args=(job, finished), name='job-lease', daemon=True)
+        heartbeat.start()
+        try:
+            f(*job.args, **job.kwargs)
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts <= retries:
+                self.backend.retry(job, time.time() + backoff * 2 ** (job.attempts - 1))
+                self.logger.warning(f"Job {job.name} ({job.id}) failed, retry {job.attempts}/{retries}: {e}")
+            else:
+                self.backend.bury(job, str(e))
+                self.logger.error(f"Job {job.name} ({job.id}) failed permanently: {e}")
+            return False
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        self.backend.ack(job)
+        return True
+
+    def renew_lease(self, job, finished):
+        while not finished.wait(self.lease / 3):
+            try:
+                self.backend.extend(job, time.time() + self.lease)
+            except Exception as e:
+                self.logger.warning(f"Failed to renew lease of job {job.name} ({job.id}): {e}")
+
+    def work(self, burst=False, poll_interval=1.0):
+        # Runs jobs until stopped; with burst=True returns once nothing is due.
+        # Backend errors are logged and retried with backoff rather than
+        # ending the worker.
+        processed = 0
+        failures = 0
+        while True:
+            try:
+                now = time.time()
+                self.backend.recover(now)
+                if not burst:
+                    self.enqueue_periodic(now)
+
+                job = self.backend.claim(now, now + self.lease)
+                if job is not None:
+                    self.run(job)
+                    processed += 1
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(poll_interval * 2 ** failures, self.max_backoff)
+                self.logger.error(f"Job backend error, retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+                continue
+
+            if job is None:
+                if burst:
+                    return processed
+                time.sleep(poll_interval)
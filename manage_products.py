@@ -0,0 +1,25 @@
+import argparse
+from app import create_app, get_db_session, delete_products
+
+def read_product_ids(args):
+    product_ids = list(args.product_ids)
+    if args.file:
+        with open(args.file) as f:
+            product_ids.extend(int(line) for line in f if line.strip())
+    return product_ids
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk product administration')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    delete_parser = subparsers.add_parser('delete', help='delete products, archiving them first')
+    delete_parser.add_argument('product_ids', type=int, nargs='*')
+    delete_parser.add_argument('--file', help='file with one product ID per line')
+    delete_parser.add_argument('--no-archive', action='store_true', help='skip the archived_products snapshot')
+    args = parser.parse_args()
+    
+    create_app(background_threads=False)
+    product_ids = read_product_ids(args)
+    with get_db_session() as session:
+        deleted = delete_products(session, product_ids, archive=not args.no_archive)
+    print(f"Deleted {deleted} of {len(product_ids)} products")
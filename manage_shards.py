@@ -0,0 +1,99 @@
+import argparse
+import sys
+from sqlalchemy import select, func
+from app import (
+    create_app, shard_engines, get_db_session, Collection, Favorite, UserShard,
+    sync_shard_products, move_user
+)
+
+def shard_user_rows(shard_engine):
+    # {user_id: collection + favorite rows} on one shard
+    rows = {}
+    with shard_engine.connect() as connection:
+        for model in (Collection, Favorite):
+            for user_id, count in connection.execute(
+                select(model.user_id, func.count()).group_by(model.user_id)
+            ):
+                rows[user_id] = rows.get(user_id, 0) + count
+    return rows
+
+def plan_rebalance(users_by_shard, tolerance, max_moves):
+    # Greedy: move the largest user that still narrows the gap from the
+    # fullest to the emptiest shard, until shards are within tolerance
+    loads = [sum(users.values()) for users in users_by_shard]
+    mean = sum(loads) / len(loads)
+    users_by_shard = [dict(users) for users in users_by_shard]
+    moves = []
+    while len(moves) < max_moves:
+        fullest = max(range(len(loads)), key=loads.__getitem__)
+        emptiest = min(range(len(loads)), key=loads.__getitem__)
+        gap = loads[fullest] - loads[emptiest]
+        if gap <= tolerance * mean:
+            break
+        candidates = [(rows, user_id) for user_id, rows in users_by_shard[fullest].items() if 0 < rows <= gap / 2]
+        if not candidates:
+            break
+        rows, user_id = max(candidates)
+        del users_by_shard[fullest][user_id]
+        users_by_shard[emptiest][user_id] = rows
+        loads[fullest] -= rows
+        loads[emptiest] += rows
+        moves.append((user_id, fullest, emptiest, rows))
+    return moves
+
+def status():
+    for shard, shard_engine in enumerate(shard_engines):
+        users = shard_user_rows(shard_engine)
+        print(f"shard {shard}: {len(users)} users, {sum(users.values())} rows ({shard_engine.url.render_as_string(hide_password=True)})")
+    with get_db_session() as session:
+        moving = session.execute(
+            select(UserShard.user_id, UserShard.shard, UserShard.moving_since)
+            .where(UserShard.moving_since.is_not(None))
+        ).all()
+    for user_id, shard, moving_since in moving:
+        # Interrupted moves can be run again with `move` once SHARD_MOVE_TIMEOUT has passed
+        print(f"user {user_id}: moving from shard {shard} since {moving_since:%Y-%m-%d %H:%M:%S}")
+
+def rebalance(tolerance, max_moves, dry_run):
+    moves = plan_rebalance([shard_user_rows(shard_engine) for shard_engine in shard_engines], tolerance, max_moves)
+    for user_id, source, target, rows in moves:
+        print(f"user {user_id}: shard {source} -> {target} ({rows} rows)")
+        if not dry_run:
+            move_user(user_id, target)
+    print(f"{len(moves)} users {'would be moved' if dry_run else 'moved'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Shard administration')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('status', help='users and rows per shard')
+    subparsers.add_parser('sync-products', help='copy the full catalog to every shard')
+
+    move_parser = subparsers.add_parser('move', help='move one user to another shard')
+    move_parser.add_argument('user_id', type=int)
+    move_parser.add_argument('shard', type=int)
+
+    rebalance_parser = subparsers.add_parser('rebalance', help='move users until shards hold similar row counts')
+    rebalance_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed spread as a share of the mean load')
+    rebalance_parser.add_argument('--max-moves', type=int, default=100)
+    rebalance_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    create_app(background_threads=False)
+    if not shard_engines:
+        print("Sharding is not enabled (SHARD_DATABASE_URLS is empty)")
+        sys.exit(1)
+
+    if args.command == 'status':
+        status()
+    elif args.command == 'sync-products':
+        for shard_engine in shard_engines:
+            sync_shard_products(shard_engine)
+        print(f"Synced products to {len(shard_engines)} shards")
+    elif args.command == 'move':
+        if not 0 <= args.shard < len(shard_engines):
+            print(f"Shard must be between 0 and {len(shard_engines) - 1}")
+            sys.exit(1)
+        print(f"Moved {move_user(args.user_id, args.shard)} rows")
+    elif args.command == 'rebalance':
+        rebalance(args.tolerance, args.max_moves, args.dry_run)
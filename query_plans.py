@@ -0,0 +1,97 @@
+import sys
+from app import (
+    create_app, engine, user_data_sessions, PRIMARY_BINDS,
+    collection_listing_query, favorites_listing_query, listing_item_query,
+    product_search_query
+)
+
+# (name, query builder, index the plan must use or None for any index)
+CHECKS = [
+    ('collection listing', lambda s: collection_listing_query(s, 1).limit(20),
+     'idx_collection_user_updated'),
+    ('collection count', lambda s: collection_listing_query(s, 1).order_by(None), None),
+    ('favorites listing', lambda s: favorites_listing_query(s, 1).limit(20),
+     'idx_favorite_user_created'),
+    ('favorites count', lambda s: favorites_listing_query(s, 1).order_by(None), None),
+    ('collection read model', lambda s: listing_item_query(s, 1, 'collection').limit(20),
+     'idx_listing_user_kind_sort'),
+    ('favorites read model', lambda s: listing_item_query(s, 1, 'favorite').limit(20),
+     'idx_listing_user_kind_sort'),
+    ('search listing', lambda s: product_search_query(s, 'jordan 1').limit(20),
+     'idx_product_brand_model'),
+    ('browse listing', lambda s: product_search_query(s, '').limit(20),
+     'idx_product_brand_model'),
+]
+
+def explain(session, query):
+    # Runs on the database the query is routed to, e.g. the user's shard for
+    # collection listings and the primary for product search
+    connection = session.connection(bind_arguments={'mapper': query.column_descriptions[0]['entity']})
+    sql = str(query.statement.compile(
+        dialect=connection.dialect,
+        compile_kwargs={'literal_binds': True}
+    ))
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+        return [row[-1] for row in rows]
+    # Make the planner prefer indexes even on small tables, so the plan shows
+    # whether an index is usable rather than whether it is worth it yet
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    connection.exec_driver_sql('SET LOCAL enable_sort = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {sql}').fetchall()
+    return [row[0] for row in rows]
+
+def plan_problems(plan, expected_index, dialect_name=None):
+    problems = []
+    text = '\n'.join(plan)
+    if (dialect_name or engine.dialect.name) == 'sqlite':
+        for line in plan:
+            if line.startswith('SCAN') and 'INDEX' not in line:
+                problems.append(f'full table scan: {line}')
+            if 'TEMP B-TREE' in line:
+                problems.append(f'sort not served by an index: {line}')
+    else:
+        if 'Seq Scan' in text:
+            problems.append('full table scan')
+        if 'Sort' in text:
+            problems.append('sort not served by an index')
+    if expected_index and expected_index not in text:
+        problems.append(f'{expected_index} not used')
+    return problems
+
+def query_plans():
+    # Returns (name, plan, problems) for each of CHECKS. Per-user queries are
+    # checked on every shard, since each has its own copy of the tables and
+    # their indexes; queries routed to the primary are checked once.
+    results = []
+    with user_data_sessions() as sessions:
+        for number, session in enumerate(sessions):
+            for name, build, expected_index in CHECKS:
+                query = build(session)
+                entity = query.column_descriptions[0]['entity']
+                on_primary = entity in PRIMARY_BINDS
+                if on_primary and number > 0:
+                    continue
+                plan = explain(session, query)
+                dialect_name = session.get_bind(mapper=entity).dialect.name
+                if len(sessions) > 1 and not on_primary:
+                    name = f"{name} (shard {number})"
+                results.append((name, plan, plan_problems(plan, expected_index, dialect_name)))
+            session.rollback()
+    return results
+
+def check_query_plans():
+    failed = False
+    for name, plan, problems in query_plans():
+        status = 'FAIL' if problems else 'OK'
+        print(f"[{status}] {name}")
+        for line in plan:
+            print(f"    {line}")
+        for problem in problems:
+            print(f"    -> {problem}")
+        failed = failed or bool(problems)
+    return not failed
+
+if __name__ == "__main__":
+    create_app(background_threads=False)
+    sys.exit(0 if check_query_plans() else 1)
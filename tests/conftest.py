@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+
+import fakeredis
+import pytest
+import redis
+
+# The app is configured from the environment when it is imported, so the test
+# databases (a primary and two shards, all SQLite files) and an in-process
+# Redis are set up before the import
+TEST_DIR = tempfile.mkdtemp(prefix='sneaker-collector-tests-')
+SHARD_PATHS = [os.path.join(TEST_DIR, f'shard{shard}.db') for shard in range(2)]
+os.environ.update({
+    'FLASK_ENV': 'testing',
+    'JWT_SECRET_KEY': 'test-secret-key-that-is-long-enough-for-hs256',
+    'DATABASE_URL': f"sqlite:///{os.path.join(TEST_DIR, 'primary.db')}",
+    'SHARD_DATABASE_URLS': ','.join(f'sqlite:///{path}' for path in SHARD_PATHS),
+    'IMAGE_CACHE_DIR': os.path.join(TEST_DIR, 'image_cache'),
+})
+os.chdir(TEST_DIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+redis_server = fakeredis.FakeServer()
+redis.from_url = lambda *args, **kwargs: fakeredis.FakeRedis(server=redis_server)
+redis.Redis.from_url = classmethod(lambda cls, *args, **kwargs: fakeredis.FakeRedis(server=redis_server))
+
+import app as app_module  # noqa: E402
+
+PASSWORD = 'Passw0rd!x'
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app = app_module.create_app('testing', background_threads=False)
+    app_module.limiter.enabled = False
+    return flask_app
+
+@pytest.fixture(autouse=True)
+def clean_state(app):
+    yield
+    for engine, metadata in [(app_module.engine, app_module.Base.metadata)] + \
+            [(shard_engine, app_module.shard_metadata) for shard_engine in app_module.shard_engines]:
+        with engine.begin() as connection:
+            for table in reversed(metadata.sorted_tables):
+                connection.execute(table.delete())
+    app_module.redis_client.flushall()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def products(app):
+    # Products 1..5 priced at their id
+    with app_module.get_db_session() as session:
+        session.add_all([
+            app_module.Product(model=f'Model {i}', brand='Nike', name=f'Sneaker {i}', price=float(i))
+            for i in range(1, 6)
+        ])
+    return list(range(1, 6))
+
+@pytest.fixture
+def make_user(client):
+    # Registers a user, returns (user_id, auth headers)
+    def make(username):
+        response = client.post('/api/v1/register', json={
+            'username': username, 'email': f'{username}@example.com', 'password': PASSWORD
+        })
+        assert response.status_code == 201, response.json
+        with app_module.get_db_session() as session:
+            user_id = session.query(app_module.User.id).filter_by(username=username).scalar()
+        return user_id, {'Authorization': f"Bearer {response.json['access_token']}"}
+    return make
@@ -0,0 +1,64 @@
+from sqlalchemy.exc import IntegrityError
+
+import app as app_module
+from app import availability_filter, duplicate_user_field, redis_client
+from conftest import PASSWORD
+
+def available(client, **params):
+    response = client.get('/api/v1/availability', query_string=params)
+    assert response.status_code == 200, response.json
+    return {field: response.json[field]['available'] for field in params}
+
+def test_availability_of_taken_and_free_names(client, make_user):
+    make_user('alice')
+    availability_filter.ensure()
+    make_user('bobby')  # added to the built filter on commit
+    
+    assert available(client, username='alice', email='alice@example.com') == {'username': False, 'email': False}
+    assert available(client, username='bobby') == {'username': False}
+    assert available(client, username='carol', email='carol@example.com') == {'username': True, 'email': True}
+    assert availability_filter.might_contain('username', 'bobby')
+    assert not availability_filter.might_contain('username', 'carol')
+
+def test_filter_is_rebuilt_after_a_redis_flush(client, make_user, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(app_module.job_queue, 'enqueue', lambda name, *args, **kwargs: scheduled.append(name))
+    make_user('alice')
+    availability_filter.ensure()
+    
+    redis_client.flushall()
+    make_user('bobby')  # must not make a filter holding only bobby look complete
+    assert available(client, username='alice', email='alice@example.com') == {'username': False, 'email': False}
+    assert available(client, username='carol') == {'username': True}
+    assert 'build_availability_filter' in scheduled
+    
+    app_module.build_availability_filter()
+    for name in ('alice', 'bobby'):
+        assert availability_filter.might_contain('username', name)
+    assert not availability_filter.might_contain('username', 'carol')
+
+def test_duplicate_registrations_name_the_field(client, make_user):
+    make_user('alice')
+    response = client.post('/api/v1/register', json={
+        'username': 'alice', 'email': 'other@example.com', 'password': PASSWORD
+    })
+    assert response.status_code == 400
+    assert response.json['errors'] == {'username': ['Username already exists']}
+    
+    response = client.post('/api/v1/register', json={
+        'username': 'other', 'email': 'alice@example.com', 'password': PASSWORD
+    })
+    assert response.status_code == 400
+    assert response.json['errors'] == {'email': ['Email already exists']}
+
+def test_duplicate_user_field_reads_postgres_messages():
+    def error(message):
+        return IntegrityError('INSERT INTO users', {}, Exception(message))
+    assert duplicate_user_field(error(
+        'duplicate key value violates unique constraint "idx_user_email"\n'
+        'DETAIL:  Key (email)=(alice@example.com) already exists.'
+    )) == 'email'
+    assert duplicate_user_field(error(
+        'duplicate key value violates unique constraint "idx_user_username"\n'
+        'DETAIL:  Key (username)=(alice) already exists.'
+    )) == 'username'
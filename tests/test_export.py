@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+
+from sqlalchemy.exc import OperationalError
+
+import app as app_module
+
+def collect(client, headers, product_ids):
+    for product_id in product_ids:
+        client.post('/api/v1/collection', json={'product_id': product_id, 'count': 1, 'size': 10}, headers=headers)
+
+def test_export_ends_with_a_completion_line(client, products, make_user):
+    _, headers = make_user('exportuser1')
+    collect(client, headers, [1, 2, 3])
+    
+    lines = client.get('/api/v1/collection/export?format=ndjson', headers=headers).data.decode().splitlines()
+    assert [json.loads(line)['product_id'] for line in lines[:-1]] == [3, 2, 1]
+    assert json.loads(lines[-1]) == {'export': 'complete', 'rows': 3}
+    
+    rows = list(csv.reader(io.StringIO(client.get('/api/v1/collection/export', headers=headers).data.decode())))
+    assert rows[0][:2] == ['id', 'product_id']
+    assert len(rows) == 5
+    assert rows[-1] == ['#export', 'complete', '3']
+
+def test_failed_export_is_marked(client, products, make_user, monkeypatch):
+    _, headers = make_user('exportuser2')
+    collect(client, headers, [1, 2, 3])
+    
+    serializer = app_module.COLLECTION_ITEM_SERIALIZER
+    class FailingQuery:
+        def __init__(self, query):
+            self.query = query
+        def yield_per(self, count):
+            for i, row in enumerate(self.query.yield_per(count)):
+                if i == 2:
+                    raise OperationalError('SELECT', {}, Exception('connection lost'))
+                yield row
+    class FailingSerializer:
+        keys = serializer.keys
+        def select(self, query):
+            return FailingQuery(serializer.select(query))
+    monkeypatch.setattr(app_module, 'COLLECTION_ITEM_SERIALIZER', FailingSerializer())
+    
+    response = client.get('/api/v1/collection/export?format=ndjson', headers=headers)
+    lines = response.data.decode().splitlines()
+    assert response.status_code == 200
+    assert len(lines) == 3
+    assert json.loads(lines[-1]) == {'export': 'error', 'rows': 2}
@@ -0,0 +1,34 @@
+import app as app_module
+
+def test_health_keeps_string_statuses(client):
+    app_module.health_monitor.probe()
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json['services'] == {
+        'pool': 'healthy', 'database': 'healthy',
+        'shard_0_pool': 'healthy', 'shard_0': 'healthy',
+        'shard_1_pool': 'healthy', 'shard_1': 'healthy',
+        'redis': 'healthy'
+    }
+    details = response.json['details']
+    assert details['database']['status'] == 'healthy'
+    assert 'latency_ms' in details['redis']
+    assert details['pool']['capacity'] == app_module.Config.DB_POOL_SIZE + app_module.Config.DB_MAX_OVERFLOW
+
+def test_readiness_and_liveness(client):
+    app_module.health_monitor.probe()
+    assert client.get('/health/live').json == {'status': 'alive'}
+    assert client.get('/health/ready').status_code == 200
+
+def test_readiness_fails_when_a_shard_is_down(client, monkeypatch):
+    def unavailable(db_engine):
+        if db_engine is app_module.shard_engines[1]:
+            raise OSError('connection refused')
+    monkeypatch.setattr(app_module.health_monitor, 'check_database', unavailable)
+    app_module.health_monitor.probe()
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.json['services']['shard_1'] == 'unhealthy'
+    assert response.json['services']['shard_0'] == 'healthy'
+    assert response.json['details']['shard_1']['error'] == 'connection refused'
+    assert 'capacity' in response.json['details']['shard_1_pool']
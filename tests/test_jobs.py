@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from jobs import Job, JobQueue, SQLiteJobBackend
+
+def test_failed_push_is_rolled_back(monkeypatch):
+    backend = SQLiteJobBackend()
+    job = Job('first', dedup_key='same')
+    backend.push(job, time.time(), 60)
+    # A duplicate id makes the INSERT fail inside the transaction
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.push(Job('second', id=job.id), time.time(), 60)
+    assert not backend.connection.in_transaction
+    assert backend.push(Job('third'), time.time(), 60)
+
+def test_worker_survives_backend_errors():
+    backend = SQLiteJobBackend()
+    queue = JobQueue(backend, lease=60, max_backoff=0)
+    ran = []
+    queue.job('record')(lambda value: ran.append(value))
+    queue.enqueue('record', 1)
+    
+    claim = backend.claim
+    calls = []
+    def flaky_claim(now, lease_until):
+        calls.append(now)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return claim(now, lease_until)
+    backend.claim = flaky_claim
+    
+    assert queue.work(burst=True, poll_interval=0) == 1
+    assert ran == [1]
+
+def test_lease_is_renewed_while_job_runs():
+    backend = SQLiteJobBackend()
+    queue = JobQueue(backend, lease=0.3)
+    started = threading.Event()
+    finish = threading.Event()
+    
+    @queue.job('slow')
+    def slow():
+        started.set()
+        finish.wait(5)
+    
+    queue.enqueue('slow')
+    job = backend.claim(time.time(), time.time() + queue.lease)
+    runner = threading.Thread(target=queue.run, args=(job,))
+    runner.start()
+    started.wait(5)
+    # Past the original lease the job is still leased, so it is not recovered
+    time.sleep(0.6)
+    assert backend.recover(time.time()) == 0
+    finish.set()
+    runner.join()
+    assert backend.execute('SELECT COUNT(*) FROM jobs') == [(0,)]
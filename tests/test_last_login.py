@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+
+import pytest
+
+import app as app_module
+from app import PENDING_LAST_LOGIN_KEY, User, get_db_session, redis_client
+from conftest import PASSWORD
+
+def test_flush_skips_deleted_users(client, make_user):
+    user_id, _ = make_user('loginuser1')
+    assert client.post('/api/v1/login', json={'username': 'loginuser1', 'password': PASSWORD}).status_code == 200
+    redis_client.hset(PENDING_LAST_LOGIN_KEY, '999', '2026-01-01T00:00:00+00:00')
+    
+    app_module.flush_last_logins()
+    
+    with get_db_session() as session:
+        assert session.get(User, user_id).last_login is not None
+    assert redis_client.hlen(PENDING_LAST_LOGIN_KEY) == 0
+
+def test_failed_flush_keeps_pending_logins(client, make_user, monkeypatch):
+    make_user('loginuser2')
+    assert client.post('/api/v1/login', json={'username': 'loginuser2', 'password': PASSWORD}).status_code == 200
+    
+    @contextmanager
+    def failing_session(*args, **kwargs):
+        raise RuntimeError('database unavailable')
+        yield
+    monkeypatch.setattr(app_module, 'get_db_session', failing_session)
+    
+    with pytest.raises(RuntimeError):
+        app_module.flush_last_logins()
+    assert redis_client.hlen(PENDING_LAST_LOGIN_KEY) == 1
@@ -0,0 +1,14 @@
+from app import Collection, Favorite, ListingItem, get_db_session
+
+def test_one_flush_with_both_kinds(client, products, make_user):
+    user_id, headers = make_user('listuser1')
+    with get_db_session(user_id=user_id) as session:
+        session.add(Collection(user_id=user_id, product_id=1, count=2, size=10))
+        session.add(Favorite(user_id=user_id, product_id=2))
+    
+    with get_db_session(user_id=user_id) as session:
+        rows = {row.kind: (row.product_id, row.count) for row in session.query(ListingItem).filter_by(user_id=user_id)}
+    assert rows == {'collection': (1, 2), 'favorite': (2, None)}
+    
+    assert client.get('/api/v1/collection', headers=headers).json['total'] == 1
+    assert client.get('/api/v1/favorites', headers=headers).json['total'] == 1
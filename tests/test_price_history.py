@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import app as app_module
+from app import Collection, PricePoint, PriceRollup, get_db_session
+
+def add_points(points):
+    with get_db_session() as session:
+        session.add_all([
+            PricePoint(product_id=product_id, price=price, recorded_at=recorded_at)
+            for product_id, price, recorded_at in points
+        ])
+
+def rollup_rows(product_ids):
+    with get_db_session() as session:
+        return {
+            (row.product_id, row.period, row.bucket_start): (row.id, row.open, row.high, row.low, row.close, row.avg, row.samples)
+            for row in session.query(PriceRollup).filter(PriceRollup.product_id.in_(product_ids))
+        }
+
+def test_collection_valuation_with_holdings_out_of_order(products, make_user):
+    user_id, _ = make_user('valuer1')
+    start = datetime(2026, 1, 1)
+    add_points([
+        (product_id, float(product_id), start + timedelta(days=day))
+        for product_id in products for day in range(5)
+    ])
+    with get_db_session() as session:
+        app_module.recompute_price_rollups(session, products)
+    
+    with get_db_session(user_id=user_id) as session:
+        for product_id in (5, 3, 1, 4, 2):
+            session.add(Collection(user_id=user_id, product_id=product_id, count=1, size=10,
+                                   created_at=datetime(2025, 12, 1)))
+    
+    with get_db_session(user_id=user_id) as session:
+        series = app_module.collection_valuation(session, user_id, 'day', start, start + timedelta(days=4))
+    assert [point['value'] for point in series] == [15.0] * 5
+
+def test_incremental_rollups_match_full_recompute(products):
+    # Monday 2026-09-28 starts a week that spans the September/October boundary
+    add_points([
+        (1, price, datetime(2026, 9, 28) + timedelta(days=day, hours=hour))
+        for day, price in enumerate([10.0, 12.0, 11.0, 15.0, 9.0]) for hour in (1, 13)
+    ])
+    with get_db_session() as session:
+        app_module.recompute_price_rollups(session, [1])
+    before = rollup_rows([1])
+    
+    new_point = datetime(2026, 10, 2, 18)
+    add_points([(1, 20.0, new_point)])
+    with get_db_session() as session:
+        app_module.recompute_price_rollups(session, [1], since=new_point)
+    incremental = rollup_rows([1])
+    
+    with get_db_session() as session:
+        app_module.recompute_price_rollups(session, [1])
+    full = rollup_rows([1])
+    
+    assert {key: values[1:] for key, values in incremental.items()} == \
+           {key: values[1:] for key, values in full.items()}
+    # Buckets before the new point were left alone
+    untouched = (1, 'day', datetime(2026, 9, 30))
+    assert incremental[untouched][0] == before[untouched][0]
+    assert incremental[(1, 'month', datetime(2026, 10, 1))][2] == 20.0
+    assert incremental[(1, 'week', datetime(2026, 9, 28))][2] == 20.0
+    assert incremental[(1, 'month', datetime(2026, 9, 1))][0] == before[(1, 'month', datetime(2026, 9, 1))][0]
+
+def test_window_dates_are_validated_and_converted_to_utc(client, products, make_user):
+    _, headers = make_user('windowuser1')
+    for params in ({'start': 'yesterday'}, {'end': '2026-13-01'},
+                   {'start': '2026-02-01', 'end': '2026-01-01'}):
+        response = client.get('/api/v1/collection/valuation', query_string=params, headers=headers)
+        assert response.status_code == 400, params
+    
+    response = client.get('/api/v1/collection/valuation', headers=headers, query_string={
+        'start': '2026-01-02T03:00+05:00', 'end': '2026-01-03T12:00:00Z'
+    })
+    assert response.status_code == 200
+    # 2026-01-01T22:00 UTC falls into the bucket of January 1st
+    assert [point['bucket_start'] for point in response.json['series']] == \
+           ['2026-01-01T00:00:00', '2026-01-02T00:00:00', '2026-01-03T00:00:00']
+
+def test_bucket_axis_stays_within_the_cap(monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'MAX_PRICE_HISTORY_POINTS', 10)
+    start = datetime(2026, 1, 1)
+    assert len(app_module.bucket_axis(start, start + timedelta(days=9), 'day')) == 10
+    
+    axis = app_module.bucket_axis(start, start + timedelta(days=10), 'day')
+    assert len(axis) == 6
+    assert axis[:2] == [start, start + timedelta(days=2)]
+    
+    axis = app_module.bucket_axis(start, datetime(2027, 12, 31), 'month')
+    assert len(axis) == 8
+    assert axis[:3] == [datetime(2026, 1, 1), datetime(2026, 4, 1), datetime(2026, 7, 1)]
+    for period in ('day', 'week', 'month'):
+        assert len(app_module.bucket_axis(datetime(2000, 1, 1), datetime(2030, 1, 1), period)) <= 10
@@ -0,0 +1,20 @@
+from app import Product, get_db_session
+
+def test_product_etag_and_body_change_together(client, products, make_user):
+    _, headers = make_user('etaguser1')
+    first = client.get('/api/v1/products/1', headers=headers)
+    assert first.status_code == 200
+    assert client.get('/api/v1/products/1', headers={**headers, 'If-None-Match': first.headers['ETag']}).status_code == 304
+    
+    with get_db_session() as session:
+        session.get(Product, 1).price = 99.0
+    
+    second = client.get('/api/v1/products/1', headers={**headers, 'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert second.json['product']['price'] == 99.0
+    
+    client.post('/api/v1/collection', json={'product_id': 1, 'count': 1, 'size': 10}, headers=headers)
+    third = client.get('/api/v1/products/1', headers=headers)
+    assert third.headers['ETag'] != second.headers['ETag']
+    assert third.json['product']['in_collection'] is True
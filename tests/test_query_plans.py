@@ -0,0 +1,22 @@
+import query_plans
+
+# Fails when a listed query's plan scans a table, sorts without an index or
+# stops using its expected index; run `python query_plans.py` for the plans
+
+def test_listed_queries_use_their_indexes(app):
+    results = query_plans.query_plans()
+    names = [name for name, _, _ in results]
+    # Per-user queries once per shard, catalog queries once on the primary
+    assert names.count('search listing') == 1
+    assert {'collection listing (shard 0)', 'collection listing (shard 1)'} <= set(names)
+    assert len(names) == len(set(names)) == 2 * len(query_plans.CHECKS) - 2
+    failures = [f"{name}: {'; '.join(problems)}\n    " + '\n    '.join(plan)
+                for name, plan, problems in results if problems]
+    assert not failures, '\n'.join(failures)
+
+def test_plan_problems_flags_table_scans():
+    problems = query_plans.plan_problems(['SCAN collections', 'USE TEMP B-TREE FOR ORDER BY'],
+                                         'idx_collection_user_updated', 'sqlite')
+    assert len(problems) == 3
+    plan = ['SEARCH collections USING INDEX idx_collection_user_updated (user_id=?)']
+    assert query_plans.plan_problems(plan, 'idx_collection_user_updated', 'sqlite') == []
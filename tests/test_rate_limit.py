@@ -0,0 +1,9 @@
+from app import limiter, redis_client
+
+def test_uneven_limits_are_enforced(app):
+    # 60000 / 7 ms is not a whole number of milliseconds
+    with app.test_request_context('/', environ_base={'REMOTE_ADDR': '10.0.0.7'}):
+        results = [limiter.hit('uneven', 7, 60) for _ in range(8)]
+    assert results[:7] == [0] * 7
+    assert results[7] > 0
+    assert redis_client.pttl('ratelimit:uneven:ip:10.0.0.7') > 0
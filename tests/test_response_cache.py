@@ -0,0 +1,40 @@
+import redis
+
+import app as app_module
+
+def test_cached_responses_fail_open_without_redis(client, products, make_user, monkeypatch):
+    _, headers = make_user('cacheuser1')
+    
+    def unavailable(*args, **kwargs):
+        raise redis.ConnectionError('Redis is down')
+    monkeypatch.setattr(app_module.cache, 'get', unavailable)
+    monkeypatch.setattr(app_module.cache, 'set', unavailable)
+    
+    assert client.get('/').status_code == 200
+    response = client.get('/api/v1/products/1', headers=headers)
+    assert response.status_code == 200
+    assert response.json['product']['id'] == 1
+
+def test_catalog_writes_invalidate_cached_searches(client, products, make_user):
+    _, headers = make_user('cacheuser2')
+    def search():
+        response = client.get('/api/v1/search', query_string={'query': 'nike'}, headers=headers)
+        assert response.status_code == 200
+        return response.json['total']
+    assert search() == 5
+    
+    # A write that skips the session publishes no new catalog version, so the
+    # cached result ids are still served
+    with app_module.engine.begin() as connection:
+        connection.execute(app_module.Product.__table__.insert().values(
+            model='Model 6', brand='Nike', name='Sneaker 6', price=6.0
+        ))
+    assert search() == 5
+    
+    with app_module.get_db_session() as session:
+        session.add(app_module.Product(model='Model 7', brand='Nike', name='Sneaker 7', price=7.0))
+    assert search() == 7
+    
+    with app_module.get_db_session() as session:
+        session.get(app_module.Product, 1).brand = 'Adidas'
+    assert search() == 6
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+from datetime import timedelta
+
+import pytest
+import redis
+
+import manage_shards
+import app as app_module
+from app import ApiException, Collection, Favorite, PricePoint, Product, User, get_db_session, redis_client, shard_moving_key
+from conftest import SHARD_PATHS, TEST_DIR
+
+def shard_rows(shard, table, user_id):
+    with sqlite3.connect(SHARD_PATHS[shard]) as connection:
+        return connection.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+def collect(client, headers, product_ids):
+    for product_id in product_ids:
+        response = client.post('/api/v1/collection', json={'product_id': product_id, 'count': 1, 'size': 10}, headers=headers)
+        assert response.status_code in (200, 201), response.json
+
+def test_users_are_routed_to_their_shard(client, products, make_user):
+    first_id, first = make_user('sharduser1')
+    second_id, second = make_user('sharduser2')
+    collect(client, first, [1, 2])
+    collect(client, second, [1])
+    
+    first_shard = app_module.shard_for_user(first_id)
+    second_shard = app_module.shard_for_user(second_id)
+    assert first_shard != second_shard
+    assert shard_rows(first_shard, 'collections', first_id) == 2
+    assert shard_rows(second_shard, 'collections', second_id) == 1
+    assert shard_rows(second_shard, 'collections', first_id) == 0
+    assert client.get('/api/v1/collection', headers=first).json['total'] == 2
+    
+    # Fan-out read over both shards
+    with get_db_session() as session:
+        assert app_module.holder_counts(session, Collection, [1, 2]) == {1: 2, 2: 1}
+
+def test_rebalance_moves_a_user(client, products, make_user, monkeypatch, capsys):
+    monkeypatch.setattr(app_module.Config, 'SHARD_MOVE_GRACE', 0)
+    users = [make_user(f'moveuser{i}') for i in range(3)]
+    by_shard = {}
+    for user_id, headers in users:
+        by_shard.setdefault(app_module.shard_for_user(user_id), []).append((user_id, headers))
+    full_shard = max(by_shard, key=lambda shard: len(by_shard[shard]))
+    for user_id, headers in by_shard[full_shard]:
+        collect(client, headers, [1, 2])
+    
+    manage_shards.rebalance(tolerance=0.1, max_moves=10, dry_run=False)
+    assert '1 users moved' in capsys.readouterr().out
+    
+    loads = [sum(manage_shards.shard_user_rows(shard_engine).values()) for shard_engine in app_module.shard_engines]
+    assert loads == [2, 2]
+    moved = [(user_id, headers) for user_id, headers in by_shard[full_shard]
+             if app_module.shard_for_user(user_id) != full_shard]
+    assert len(moved) == 1
+    user_id, headers = moved[0]
+    assert shard_rows(1 - full_shard, 'collections', user_id) == 2
+    assert shard_rows(1 - full_shard, 'listing_items', user_id) == 2
+    assert shard_rows(full_shard, 'collections', user_id) == 0
+    items = client.get('/api/v1/collection', headers=headers).json['items']
+    assert sorted(item['product_id'] for item in items) == [1, 2]
+
+def test_requests_during_a_move_get_503(client, products, make_user):
+    user_id, headers = make_user('busyuser1')
+    redis_client.set(shard_moving_key(user_id), 1)
+    assert client.get('/api/v1/favorites', headers=headers).status_code == 503
+    assert client.post('/api/v1/favorites', json={'product_id': 1}, headers=headers).status_code == 503
+
+def test_moves_are_seen_without_redis(client, products, make_user, monkeypatch):
+    user_id, headers = make_user('busyuser2')
+    collect(client, headers, [1])
+    shard = app_module.begin_user_move(user_id)
+    assert shard_rows(shard, 'collections', user_id) == 1
+    
+    # Flag and cached shard lost in a Redis flush: the directory row still says moving
+    redis_client.flushall()
+    assert client.post('/api/v1/favorites', json={'product_id': 2}, headers=headers).status_code == 503
+    
+    # Redis down altogether
+    def unavailable(*args, **kwargs):
+        raise redis.ConnectionError('Redis is down')
+    with monkeypatch.context() as patch:
+        patch.setattr(redis_client, 'pipeline', unavailable)
+        with pytest.raises(ApiException) as error:
+            app_module.shard_for_user(user_id)
+        assert error.value.code == 503
+    
+    # A second move waits for the first
+    with pytest.raises(RuntimeError):
+        app_module.move_user(user_id, 1 - shard)
+    
+    app_module.end_user_move(user_id)
+    assert app_module.shard_for_user(user_id) == shard
+    assert client.get('/api/v1/collection', headers=headers).json['total'] == 1
+
+def test_interrupted_moves_can_be_run_again(client, products, make_user, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'SHARD_MOVE_GRACE', 0)
+    user_id, headers = make_user('moveuser9')
+    collect(client, headers, [1, 2])
+    source = app_module.shard_for_user(user_id)
+    target = 1 - source
+    
+    # Killed after copying, before the directory row was updated
+    class Killed(BaseException):
+        pass
+    def kill(*args, **kwargs):
+        raise Killed()
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module, 'end_user_move', kill)
+        with pytest.raises(Killed):
+            app_module.move_user(user_id, target)
+    assert shard_rows(target, 'collections', user_id) == 2
+    assert client.get('/api/v1/collection', headers=headers).status_code == 503
+    with pytest.raises(RuntimeError):
+        app_module.move_user(user_id, target)
+    
+    with get_db_session() as session:
+        session.get(app_module.UserShard, user_id).moving_since -= timedelta(seconds=app_module.Config.SHARD_MOVE_TIMEOUT + 1)
+    assert app_module.move_user(user_id, target) == 2
+    assert app_module.shard_for_user(user_id) == target
+    assert shard_rows(target, 'collections', user_id) == 2
+    assert shard_rows(source, 'collections', user_id) == 0
+    assert client.get('/api/v1/collection', headers=headers).json['total'] == 2
+
+def test_product_writes_from_a_shard_session_go_to_the_primary(products, make_user):
+    user_id, _ = make_user('pricesuser1')
+    with get_db_session(user_id=user_id) as session:
+        session.get(Product, 1).price = 42.0
+    with get_db_session() as session:
+        assert session.get(Product, 1).price == 42.0
+        assert session.query(PricePoint).filter_by(product_id=1, price=42.0).count() == 1
+    shard = app_module.shard_for_user(user_id)
+    with sqlite3.connect(SHARD_PATHS[shard]) as connection:
+        assert connection.execute('SELECT price FROM products WHERE id = 1').fetchone()[0] == 42.0
+
+def test_deleting_a_user_deletes_their_shard_rows(client, products, make_user):
+    user_id, headers = make_user('leavinguser1')
+    collect(client, headers, [1, 2])
+    client.post('/api/v1/favorites', json={'product_id': 3}, headers=headers)
+    shard = app_module.shard_for_user(user_id)
+    
+    with get_db_session() as session:
+        session.delete(session.get(User, user_id))
+    
+    for table in ('collections', 'favorites', 'listing_items'):
+        assert shard_rows(shard, table, user_id) == 0
+
+def test_tokens_of_missing_users_get_404(client, products, make_user):
+    user_id, headers = make_user('goneuser1')
+    with get_db_session() as session:
+        session.delete(session.get(User, user_id))
+    assert client.get('/api/v1/collection', headers=headers).status_code == 404
+    assert client.post('/api/v1/favorites', json={'product_id': 1}, headers=headers).status_code == 404
+
+def test_rows_on_the_primary_are_moved_to_the_shards(client, products, make_user):
+    # Written before sharding was enabled: sessions without a user use the primary
+    users = [make_user(f'olduser{i}') for i in range(2)]
+    with get_db_session() as session:
+        for user_id, _ in users:
+            session.add_all([Collection(user_id=user_id, product_id=product_id, count=1, size=10.0)
+                             for product_id in (1, 2, 4)])
+            session.add(Favorite(user_id=user_id, product_id=3))
+    with get_db_session() as session:
+        for collection in session.query(Collection).filter_by(product_id=4):
+            session.delete(collection)
+    
+    assert app_module.migrate_primary_user_rows() == 6
+    with sqlite3.connect(os.path.join(TEST_DIR, 'primary.db')) as connection:
+        for table in app_module.USER_SHARDED_TABLES:
+            assert connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] == 0
+    assert {app_module.shard_for_user(user_id) for user_id, _ in users} == {0, 1}
+    for user_id, headers in users:
+        shard = app_module.shard_for_user(user_id)
+        assert shard_rows(shard, 'collections', user_id) == 2
+        assert shard_rows(shard, 'favorites', user_id) == 1
+        assert shard_rows(shard, 'listing_items', user_id) == 3
+        assert shard_rows(shard, 'sync_tombstones', user_id) == 1
+        items = client.get('/api/v1/collection', headers=headers).json['items']
+        assert sorted(item['product_id'] for item in items) == [1, 2]
+        assert client.get('/api/v1/favorites', headers=headers).json['total'] == 1
+    
+    assert app_module.migrate_primary_user_rows() == 0
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import app as app_module
+from app import CacheEntry, cache, get_db_session, redis_client, single_flight
+
+def run_together(count, target):
+    barrier = threading.Barrier(count)
+    results = []
+    def run():
+        barrier.wait()
+        results.append(target())
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_misses_compute_once(app):
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'value'
+    assert run_together(4, lambda: single_flight('flight:key', compute)) == ['value'] * 4
+    assert len(calls) == 1
+
+def test_concurrent_product_document_misses_load_once(products, monkeypatch):
+    serializer = app_module.PRODUCT_SERIALIZER
+    loads = []
+    class CountingSerializer:
+        def __getattr__(self, name):
+            return getattr(serializer, name)
+        def __call__(self, rows):
+            return serializer(rows)
+        def select(self, query):
+            loads.append(1)
+            time.sleep(0.2)
+            return serializer.select(query)
+    monkeypatch.setattr(app_module, 'PRODUCT_SERIALIZER', CountingSerializer())
+    
+    def fetch():
+        with get_db_session() as session:
+            return app_module.get_product_documents(session, [1, 2, 3, 99])
+    results = run_together(4, fetch)
+    assert len(loads) == 1
+    assert all(sorted(documents) == [1, 2, 3] for documents in results)
+    assert results[0][2]['price'] == 2.0
+    
+    # The unknown id was cached as missing until the product is created
+    monkeypatch.setattr(app_module, 'PRODUCT_SERIALIZER', serializer)
+    with get_db_session() as session:
+        session.add(app_module.Product(id=99, model='Model 99', brand='Nike', name='Sneaker 99', price=99.0))
+    assert fetch()[99]['price'] == 99.0
+
+def test_entries_near_expiry_are_refreshed_by_one_worker(app, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'CACHE_EARLY_EXPIRY_BETA', 1000.0)
+    cache.set('flight:early', CacheEntry('old', 10.0, time.time() + 1), timeout=60)
+    
+    # Another worker holds the lock: the current value is served meanwhile
+    redis_client.set('lock:flight:early', 'other')
+    assert single_flight('flight:early', lambda: 'new') == 'old'
+    
+    redis_client.delete('lock:flight:early')
+    assert single_flight('flight:early', lambda: 'new') == 'new'
+    assert cache.get('flight:early').value == 'new'
+
+def test_timeouts_are_jittered(app):
+    timeout = 1000
+    jitter = app_module.Config.CACHE_TTL_JITTER
+    for i in range(20):
+        single_flight(f'flight:jitter:{i}', lambda: 'value', timeout=timeout)
+    expiries = [cache.get(f'flight:jitter:{i}').expires - time.time() for i in range(20)]
+    assert all(timeout * (1 - jitter) - 2 <= expiry <= timeout * (1 + jitter) for expiry in expiries)
+    assert len({round(expiry) for expiry in expiries}) > 1
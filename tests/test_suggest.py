@@ -0,0 +1,17 @@
+from app import Product, get_db_session, suggester
+
+def test_refresh_swaps_in_a_new_index(products):
+    suggester.build()
+    assert [item['id'] for item in suggester.suggest('sneaker 3')] == [3]
+    
+    before = suggester.index
+    snapshot = (list(before[0]), dict(before[1]))
+    with get_db_session() as session:
+        session.get(Product, 3).name = 'Renamed Runner'
+    suggester.refresh()
+    
+    # Readers holding the old index keep a consistent, unchanged view
+    assert (before[0], before[1]) == snapshot
+    assert suggester.index is not before
+    assert suggester.suggest('sneaker 3') == []
+    assert [item['id'] for item in suggester.suggest('renamed')] == [3]
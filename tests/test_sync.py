@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, UTC
+
+import app as app_module
+from app import SyncTombstone, encode_sync_token, get_db_session
+
+def sync(client, headers, token=None):
+    response = client.get('/api/v1/sync', query_string={'since': token} if token else {}, headers=headers)
+    assert response.status_code == 200, response.json
+    return response.json
+
+def product_ids(items):
+    return sorted(item['product_id'] for item in items)
+
+def test_sync_deltas_and_tombstones(client, products, make_user, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'SYNC_OVERLAP', timedelta(0))
+    user_id, headers = make_user('syncuser1')
+    for product_id in (1, 2):
+        client.post('/api/v1/collection', json={'product_id': product_id, 'count': 1, 'size': 10}, headers=headers)
+    client.post('/api/v1/favorites', json={'product_id': 3}, headers=headers)
+    
+    first = sync(client, headers)
+    assert first['full_resync'] is True
+    assert product_ids(first['collection']['items']) == [1, 2]
+    assert product_ids(first['favorites']['items']) == [3]
+    
+    client.post('/api/v1/collection', json={'product_id': 4, 'count': 1, 'size': 10}, headers=headers)
+    client.delete('/api/v1/collection', json={'product_id': 1}, headers=headers)
+    with get_db_session(user_id=user_id) as session:
+        assert [(row.kind, row.product_id) for row in session.query(SyncTombstone).filter_by(user_id=user_id)] == \
+               [('collection', 1)]
+    
+    second = sync(client, headers, first['token'])
+    assert second['full_resync'] is False
+    assert product_ids(second['collection']['items']) == [4]
+    assert second['collection']['deleted'] == [1]
+    assert second['favorites'] == {'items': [], 'deleted': []}
+    assert int(second['token']) > int(first['token'])
+    
+    # The cursor moved past both changes
+    third = sync(client, headers, second['token'])
+    assert third['full_resync'] is False
+    assert third['collection'] == {'items': [], 'deleted': []}
+
+def test_cursors_older_than_the_tombstones_get_a_full_listing(client, products, make_user):
+    _, headers = make_user('syncuser2')
+    client.post('/api/v1/favorites', json={'product_id': 2}, headers=headers)
+    
+    too_old = encode_sync_token(datetime.now(UTC) - app_module.Config.SYNC_TOMBSTONE_RETENTION - timedelta(hours=1))
+    result = sync(client, headers, too_old)
+    assert result['full_resync'] is True
+    assert product_ids(result['favorites']['items']) == [2]
+    
+    assert client.get('/api/v1/sync', query_string={'since': 'abc'}, headers=headers).status_code == 400
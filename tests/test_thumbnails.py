@@ -0,0 +1,122 @@
+import http.server
+import io
+import socket
+import threading
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from app import Product, get_db_session
+
+def jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 10, 10)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+@pytest.fixture
+def origin():
+    # Stand-in image origin on a local port; records the paths it served
+    requests = []
+    images = {'/shoe.jpg': jpeg(2000, 1500), '/secret.jpg': jpeg(10, 10)}
+    
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            if self.path.startswith('/redirect'):
+                self.send_response(302)
+                self.send_header('Location', self.path.split('to=', 1)[1])
+                self.end_headers()
+                return
+            body = images.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+
+def thumbnail_url(client, headers, image_url, size='medium'):
+    with get_db_session() as session:
+        session.get(Product, 1).image_url = image_url
+    return client.get('/api/v1/products/1', headers=headers).json['product']['thumbnails'][size]
+
+def test_thumbnails_are_resized_and_cached(client, products, make_user, origin, monkeypatch):
+    base_url, requests = origin
+    monkeypatch.setattr(app_module.Config, 'IMAGE_TRUSTED_HOSTS', ('127.0.0.1',))
+    _, headers = make_user('thumbuser1')
+    url = thumbnail_url(client, headers, f'{base_url}/shoe.jpg')
+    
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(first.data)).size == (400, 300)
+    assert 'immutable' in first.headers['Cache-Control']
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    small = client.get(url.replace('/medium', '/small'))
+    assert Image.open(io.BytesIO(small.data)).size == (160, 120)
+    assert requests == ['/shoe.jpg']
+
+def test_private_origins_are_rejected(client, products, make_user, origin):
+    base_url, requests = origin
+    _, headers = make_user('thumbuser2')
+    assert client.get(thumbnail_url(client, headers, f'{base_url}/shoe.jpg')).status_code == 502
+    assert requests == []
+
+def test_redirects_to_private_hosts_are_rejected(client, products, make_user, origin, monkeypatch):
+    base_url, requests = origin
+    monkeypatch.setattr(app_module.Config, 'IMAGE_TRUSTED_HOSTS', ('127.0.0.1',))
+    _, headers = make_user('thumbuser3')
+    port = base_url.rsplit(':', 1)[1]
+    url = thumbnail_url(client, headers, f'{base_url}/redirect?to=http://localhost:{port}/secret.jpg')
+    assert client.get(url).status_code == 502
+    assert '/secret.jpg' not in requests
+
+def test_non_http_schemes_are_rejected():
+    with pytest.raises(app_module.ThumbnailError):
+        app_module.check_image_origin('file:///etc/passwd')
+
+def test_connections_go_to_the_checked_address(client, products, make_user, origin, monkeypatch):
+    # The name resolves to a public address when checked and to a private one
+    # afterwards; the fetch must still connect to the address that was checked
+    base_url, requests = origin
+    port = int(base_url.rsplit(':', 1)[1])
+    answers = iter(['93.184.216.34'] + ['127.0.0.1'] * 10)
+    monkeypatch.setattr(socket, 'getaddrinfo', lambda host, *args, **kwargs: [
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', (next(answers), port))
+    ])
+    connected = []
+    real_create_connection = socket.create_connection
+    def create_connection(address, *args, **kwargs):
+        connected.append(address)
+        # Stands in for the public server
+        return real_create_connection(('127.0.0.1', port), *args, **kwargs)
+    monkeypatch.setattr(socket, 'create_connection', create_connection)
+    _, headers = make_user('thumbuser4')
+    
+    url = thumbnail_url(client, headers, f'http://images.example:{port}/shoe.jpg')
+    assert client.get(url).status_code == 200
+    assert connected == [('93.184.216.34', port)]
+    assert requests == ['/shoe.jpg']
+
+def test_thumbnails_do_not_count_as_product_views(client, products, make_user, origin, monkeypatch):
+    base_url, _ = origin
+    monkeypatch.setattr(app_module.Config, 'IMAGE_TRUSTED_HOSTS', ('127.0.0.1',))
+    _, headers = make_user('thumbuser5')
+    url = thumbnail_url(client, headers, f'{base_url}/shoe.jpg')
+    monkeypatch.setattr(app_module.Config, 'WARM_TRACK_SAMPLE_RATE', 1.0)
+    app_module.redis_client.delete(app_module.POPULAR_PRODUCTS_KEY)
+    
+    assert client.get(url).status_code == 200
+    assert app_module.redis_client.zscore(app_module.POPULAR_PRODUCTS_KEY, 1) is None
@@ -0,0 +1,37 @@
+import time
+
+import app as app_module
+from app import Collection, TRENDING_EPOCH_KEY, get_db_session, redis_client, trending_key
+
+def test_removed_entries_leave_no_residue(products, make_user):
+    user_id, _ = make_user('trenduser1')
+    with get_db_session(user_id=user_id) as session:
+        session.add(Collection(user_id=user_id, product_id=1, count=1, size=10))
+        session.add(Collection(user_id=user_id, product_id=2, count=1, size=10))
+    assert redis_client.zscore(trending_key('all'), 1) > 0
+    
+    with get_db_session(user_id=user_id) as session:
+        session.delete(session.query(Collection).filter_by(user_id=user_id, product_id=1).one())
+    assert redis_client.zscore(trending_key('all'), 1) is None
+    assert redis_client.zscore(trending_key('collected'), 1) is None
+    assert redis_client.zscore(trending_key('all'), 2) > 0
+
+def test_scores_are_rebased_when_the_epoch_falls_behind(products, make_user):
+    half_life = app_module.Config.TRENDING_HALF_LIFE.total_seconds()
+    stale_epoch = time.time() - 100 * half_life
+    redis_client.set(TRENDING_EPOCH_KEY, stale_epoch)
+    # An event from a day ago, weighted against the stale epoch
+    redis_client.zadd(trending_key('all'), {'2': 2 ** 99})
+    
+    user_id, _ = make_user('trenduser2')
+    with get_db_session(user_id=user_id) as session:
+        session.add(Collection(user_id=user_id, product_id=1, count=1, size=10))
+    
+    epoch = float(redis_client.get(TRENDING_EPOCH_KEY))
+    window = app_module.Config.TRENDING_WINDOW.total_seconds()
+    assert abs(epoch - (time.time() - window)) < 60
+    new_score = redis_client.zscore(trending_key('all'), 1)
+    old_score = redis_client.zscore(trending_key('all'), 2)
+    assert 0 < new_score < 2 ** (window / half_life + 1)
+    # Relative weights are unchanged by the rebase: one day newer, twice the weight
+    assert abs(new_score / old_score - 2) < 0.01
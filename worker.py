@@ -0,0 +1,25 @@
+import argparse
+from multiprocessing import Process
+from app import create_app, job_queue
+
+def run_worker(burst=False):
+    app = create_app(background_threads=False)
+    with app.app_context():
+        processed = job_queue.work(burst=burst)
+    if burst:
+        print(f"Processed {processed} jobs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run background job workers')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--burst', action='store_true', help='exit once no jobs are due')
+    args = parser.parse_args()
+    
+    if args.processes == 1:
+        run_worker(args.burst)
+    else:
+        workers = [Process(target=run_worker, args=(args.burst,)) for _ in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()